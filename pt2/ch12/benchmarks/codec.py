@@ -0,0 +1,66 @@
+""" 메시지 타입별 인코딩/디코딩 벤치마크.
+
+예전 방식(``json.dumps(asdict(message))`` / ``cls(**json.loads(raw))``)과
+``codec`` 의 생성된 인코더, 캐시된 인코딩, 쓸 수 있는 백엔드들을 비교한다.
+
+    python -m pt2.ch12.benchmarks.codec --iterations 100000
+"""
+import argparse
+import json
+import timeit
+from dataclasses import asdict
+from datetime import date
+
+from pt2.ch12.src.allocation.adapters import codec
+from pt2.ch12.src.allocation.domain import commands, events
+
+
+SAMPLES = {
+    events.Allocated: lambda: events.Allocated(orderid="order-1", sku="sku-1", qty=10, batchref="batch-1"),
+    events.Deallocated: lambda: events.Deallocated(orderid="order-1", sku="sku-1", qty=10),
+    events.OutOfStock: lambda: events.OutOfStock(sku="sku-1"),
+    commands.Allocate: lambda: commands.Allocate(order_id="order-1", sku="sku-1", qty=10),
+    commands.Deallocate: lambda: commands.Deallocate(order_id="order-1", sku="sku-1", qty=10),
+    commands.CreateBatch: lambda: commands.CreateBatch(ref="batch-1", sku="sku-1", qty=100, eta=date(2023, 1, 1)),
+    commands.ChangeBatchQuantity: lambda: commands.ChangeBatchQuantity(ref="batch-1", qty=50),
+}
+
+
+def per_second(func, iterations: int) -> float:
+    return iterations / timeit.timeit(func, number=iterations)
+
+
+def bench(cls, make, iterations: int):
+    message = make()
+    results = {
+        "asdict+json": per_second(lambda: json.dumps(asdict(message), default=str).encode(), iterations),
+        "generated": per_second(lambda: codec.encode(make()), iterations),
+        "cached": per_second(lambda: codec.encode(message), iterations),
+    }
+    if codec.MSGPACK in codec.BACKENDS:
+        results["msgpack"] = per_second(lambda: codec.encode(make(), codec.MSGPACK), iterations)
+    # "generated" 는 매번 새 인스턴스를 만드니 생성 비용이 섞여 있다
+    results["(construct)"] = per_second(make, iterations)
+
+    raw = json.dumps(asdict(message), default=str)
+    results["json+cls(**)"] = per_second(lambda: cls(**json.loads(raw)), iterations)
+    results["decode"] = per_second(lambda: codec.decode(cls, raw), iterations)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--iterations", type=int, default=100_000)
+    args = parser.parse_args()
+
+    print(f"JSON backend: {'orjson' if codec.orjson else 'stdlib json'}")
+    print(f"msgpack: {'available' if codec.msgpack else 'not installed'}")
+    for cls, make in SAMPLES.items():
+        results = bench(cls, make, args.iterations)
+        print(f"\n{cls.__name__}")
+        for name, ops in results.items():
+            print(f"  {name:<14} {ops:>12,.0f} ops/s")
+
+
+if __name__ == "__main__":
+    main()
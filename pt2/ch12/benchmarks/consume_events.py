@@ -0,0 +1,97 @@
+""" 인바운드 메시지 처리량 벤치마크.
+
+레디스 대신 프로세스 안의 브로커(``InMemoryRedis``)에 ``change_batch_quantity``
+메시지를 넣고 ``EventConsumer`` 가 다 처리할 때까지 걸린 시간을 잰다.
+네트워크가 끼지 않으므로 디코딩, 레인 분배, ACK 같은 앱 쪽 비용만 보인다.
+
+    python -m pt2.ch12.benchmarks.consume_events --messages 20000 --transport streams
+"""
+import argparse
+import asyncio
+import json
+import time
+
+from pt2.ch12.src.allocation.adapters import redis
+from pt2.ch12.src.allocation.adapters.inmemory import InMemoryRedis
+from pt2.ch12.src.allocation.adapters.streams import PubSubConsumer, StreamConsumer
+from pt2.ch12.src.allocation.domain import commands
+from pt2.ch12.src.allocation.entrypoints.redis_eventconsumer import EventConsumer
+
+
+CHANNEL = "change_batch_quantity"
+
+
+def make_messages(count: int, skus: int):
+    # 외부 시스템이 보내는 모양 그대로(batchref, sku)
+    return [
+        (CHANNEL, json.dumps({"batchref": f"batch-{i}", "qty": i, "sku": f"sku-{i % skus}"}))
+        for i in range(count)
+    ]
+
+
+def make_consumer(session: InMemoryRedis, transport: str, batch_size: int):
+    if transport == redis.STREAMS:
+        return StreamConsumer(
+            session,
+            streams=[CHANNEL],
+            group="benchmark",
+            consumer="c1",
+            batch_size=batch_size,
+            block_ms=10,
+        )
+    return PubSubConsumer(
+        session,
+        channels=[CHANNEL],
+        consumer="c1",
+        batch_size=batch_size,
+        block_ms=10,
+    )
+
+
+async def run(count: int, transport: str, concurrency: int, batch_size: int, skus: int):
+    session = InMemoryRedis(pubsub_buffer=count + 1)
+    channel = redis.AsyncRedis(session, transport=transport)
+    consumer = make_consumer(session, transport, batch_size)
+    handled = 0
+    done = asyncio.Event()
+
+    async def handle(command: commands.ChangeBatchQuantity):
+        nonlocal handled
+        handled += 1
+        if handled == count:
+            done.set()
+
+    event_consumer = EventConsumer(consumer, handle, concurrency=concurrency)
+    # 구독/그룹 생성이 끝난 뒤에 넣어야 pub/sub 에서 메시지를 잃지 않는다
+    await consumer.start()
+    messages = make_messages(count, skus)
+    started = time.perf_counter()
+    await channel.publish_raw_many(messages)
+    publish_elapsed = time.perf_counter() - started
+
+    stop = asyncio.Event()
+    task = asyncio.create_task(event_consumer.run(stop))
+    await done.wait()
+    elapsed = time.perf_counter() - started
+    stop.set()
+    await task
+
+    print(f"{transport:<8} publish {count / publish_elapsed:12,.0f} msgs/s")
+    print(f"{transport:<8} end-to-end {elapsed:8.3f}s  {count / elapsed:12,.0f} msgs/s")
+    print(f"         batches={event_consumer.stats.batches} dropped={session.dropped}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--messages", type=int, default=20_000)
+    parser.add_argument("--transport", choices=[redis.PUBSUB, redis.STREAMS], default=redis.STREAMS)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--batch-size", type=int, default=100)
+    parser.add_argument("--skus", type=int, default=100)
+    args = parser.parse_args()
+
+    asyncio.run(run(args.messages, args.transport, args.concurrency, args.batch_size, args.skus))
+
+
+if __name__ == "__main__":
+    main()
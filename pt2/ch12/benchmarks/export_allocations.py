@@ -0,0 +1,98 @@
+""" allocations_view 스트리밍 내보내기 벤치마크.
+
+SQLite 파일에 합성 행을 채운 뒤 ``exports.export`` 로 끝까지 읽어 버린다.
+처리량과 함께 내보내기 전후의 최대 RSS를 출력해서 메모리가 행 수와 무관한지 본다.
+
+    python -m pt2.ch12.benchmarks.export_allocations --rows 10000000
+"""
+import argparse
+import asyncio
+import os
+import resource
+import sqlite3
+import tempfile
+import time
+
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy.orm import sessionmaker
+
+from pt2.ch12.src.allocation import exports
+
+
+def peak_rss_mb() -> float:
+    # 리눅스에서 ru_maxrss 는 KiB 단위
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def populate(path: str, rows: int, chunk: int = 100_000):
+    conn = sqlite3.connect(path)
+    conn.execute("PRAGMA journal_mode=OFF")
+    conn.execute("PRAGMA synchronous=OFF")
+    conn.execute(
+        "CREATE TABLE allocations_view"
+        " (orderid VARCHAR(255), sku VARCHAR(255), batchref VARCHAR(255))"
+    )
+    for start in range(0, rows, chunk):
+        conn.executemany(
+            "INSERT INTO allocations_view VALUES (?, ?, ?)",
+            (
+                (f"order-{i}", f"sku-{i % 1000}", f"batch-{i % 5000}")
+                for i in range(start, min(start + chunk, rows))
+            ),
+        )
+        conn.commit()
+    conn.close()
+
+
+async def run_export(path: str, fmt: str, gzip: bool, partition_size: int):
+    engine = create_async_engine(f"sqlite+aiosqlite:///{path}")
+    session_factory = sessionmaker(bind=engine, class_=AsyncSession)
+    exported_rows, exported_bytes = 0, 0
+
+    async with session_factory() as session:
+        async for chunk in exports.export(
+                session,
+                exports.ALLOCATIONS_QUERY,
+                fmt=fmt,
+                gzip=gzip,
+                partition_size=partition_size,
+        ):
+            exported_bytes += len(chunk)
+            if not gzip:
+                exported_rows += chunk.count(b"\n")
+
+    await engine.dispose()
+    return exported_rows, exported_bytes
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=10_000_000)
+    parser.add_argument("--format", choices=list(exports.MEDIA_TYPES), default=exports.NDJSON)
+    parser.add_argument("--gzip", action="store_true")
+    parser.add_argument("--partition-size", type=int, default=exports.EXPORT_PARTITION_SIZE)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "export-bench.sqlite3")
+
+        started = time.perf_counter()
+        populate(path, args.rows)
+        print(f"populated {args.rows:,} rows in {time.perf_counter() - started:.1f}s")
+
+        rss_before = peak_rss_mb()
+        started = time.perf_counter()
+        rows, size = asyncio.run(
+            run_export(path, args.format, args.gzip, args.partition_size)
+        )
+        elapsed = time.perf_counter() - started
+
+    print(f"exported {args.rows:,} rows ({size / 2 ** 20:.1f} MiB) in {elapsed:.1f}s")
+    print(f"throughput: {args.rows / elapsed:,.0f} rows/s")
+    print(f"peak RSS: {rss_before:.1f} MiB before export, {peak_rss_mb():.1f} MiB after")
+    if not args.gzip:
+        print(f"lines written: {rows:,}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,183 @@
+""" 엔드포인트별 요청 검증/응답 인코딩 오버헤드 벤치마크.
+
+DB 와 메시지 버스는 빼고, 각 엔드포인트가 요청 본문을 검증하고 응답을 만드는 데
+드는 비용만 잰다. FastAPI 기본 경로(``dict`` 를 돌려주면 ``jsonable_encoder`` 를 거쳐
+``JSONResponse``)와 지금 쓰는 빠른 경로(``FastJSONResponse`` / 행을 바로 바이트로)를
+비교하고, 같은 비교를 ASGI 요청 한 번 단위로도 잰다.
+
+    python -m pt2.ch12.benchmarks.http_endpoints --iterations 20000
+"""
+import argparse
+import asyncio
+import json
+import time
+import timeit
+from dataclasses import dataclass
+
+from fastapi import FastAPI
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+from httpx import AsyncClient
+from pydantic import parse_obj_as
+from sqlalchemy import create_engine, text
+
+from pt2.ch12.src.allocation import views
+from pt2.ch12.src.allocation.adapters import codec
+from pt2.ch12.src.allocation.domain import model
+from pt2.ch12.src.allocation.entrypoints import BatchRequest, OrderLineRequest
+from pt2.ch12.src.allocation.entrypoints.responses import FastJSONResponse, RawJSONResponse
+
+
+LINE = json.dumps({"orderid": "order-1", "sku": "sku-1", "qty": 10}).encode()
+BATCH = json.dumps({"ref": "batch-1", "sku": "sku-1", "qty": 100, "eta": "2023-01-01"}).encode()
+
+
+@dataclass
+class Endpoint:
+    method: str
+    path: str
+    body: bytes
+    # 예전 요청 모델과 지금 요청 모델
+    default_model: type
+    fast_model: type
+    response: object
+
+
+def allocation_rows(count: int):
+    # 실제 쿼리 결과와 같은 RowMapping 을 만든다
+    engine = create_engine("sqlite://")
+    with engine.connect() as conn:
+        conn.execute(text("CREATE TABLE allocations_view (orderid, sku, batchref)"))
+        conn.execute(
+            text("INSERT INTO allocations_view VALUES ('order-1', :sku, :batchref)"),
+            [dict(sku=f"sku-{i}", batchref=f"batch-{i}") for i in range(count)],
+        )
+        return conn.execute(
+            text("SELECT batchref, sku FROM allocations_view WHERE orderid = 'order-1'")
+        ).mappings().all()
+
+
+ENDPOINTS = {
+    "POST /batches": Endpoint(
+        "POST", "/batches", BATCH, BatchRequest, BatchRequest,
+        {"message": "Batch added"},
+    ),
+    "POST /allocate": Endpoint(
+        "POST", "/allocate", LINE, OrderLineRequest, OrderLineRequest,
+        {"message": "allocated"},
+    ),
+    # 예전에는 도메인 데이터클래스(model.OrderLine)를 pydantic 이 감싸서 검증했다
+    "POST /deallocate": Endpoint(
+        "POST", "/deallocate", LINE, model.OrderLine, OrderLineRequest,
+        {"message": "deallocation done."},
+    ),
+    "GET /allocations/{id}": Endpoint(
+        "GET", "/allocations/order-1", b"", None, None,
+        allocation_rows(3),
+    ),
+}
+
+
+def per_second(func, iterations: int) -> float:
+    return iterations / timeit.timeit(func, number=iterations)
+
+
+def validate(model_cls, raw: bytes):
+    # FastAPI 처럼 타입별로 한 번 만든 검증기를 쓴다
+    return parse_obj_as(model_cls, json.loads(raw))
+
+
+def default_response(content):
+    return JSONResponse(jsonable_encoder(content))
+
+
+def fast_response(content):
+    if isinstance(content, list):
+        return RawJSONResponse(views.encode_allocations(content))
+    return FastJSONResponse(content)
+
+
+def make_handler(model_cls, content, respond):
+    # 기본값 인자로 넘기면 FastAPI 가 쿼리 파라미터로 보므로 클로저로 묶는다
+    if model_cls is None:
+        async def handler():
+            return respond(content)
+    else:
+        async def handler(body: model_cls):
+            return respond(content)
+    return handler
+
+
+def make_app(endpoints) -> FastAPI:
+    """ 엔드포인트마다 기본 경로(/default)와 빠른 경로(/fast) 두 벌을 단다. """
+    app = FastAPI()
+    for endpoint in endpoints.values():
+        for prefix, model_cls, respond in (
+                ("/default", endpoint.default_model, lambda content: content),
+                ("/fast", endpoint.fast_model, fast_response),
+        ):
+            app.add_api_route(
+                prefix + endpoint.path,
+                make_handler(model_cls, endpoint.response, respond),
+                methods=[endpoint.method],
+            )
+    return app
+
+
+async def requests_per_second(client: AsyncClient, endpoint: Endpoint, prefix: str, iterations: int) -> float:
+    started = time.perf_counter()
+    for _ in range(iterations):
+        res = await client.request(
+            endpoint.method,
+            prefix + endpoint.path,
+            content=endpoint.body or None,
+            headers={"content-type": "application/json"},
+        )
+        assert res.status_code == 200, res.text
+    return iterations / (time.perf_counter() - started)
+
+
+async def bench_requests(iterations: int) -> dict:
+    results = {}
+    async with AsyncClient(app=make_app(ENDPOINTS), base_url="http://bench") as client:
+        for name, endpoint in ENDPOINTS.items():
+            results[name] = {
+                prefix: await requests_per_second(client, endpoint, prefix, iterations)
+                for prefix in ("/default", "/fast")
+            }
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--iterations", type=int, default=20_000)
+    parser.add_argument("--requests", type=int, default=2_000)
+    args = parser.parse_args()
+
+    print(f"JSON backend: {'orjson' if codec.orjson else 'stdlib json'}")
+    requests = asyncio.run(bench_requests(args.requests))
+    for name, endpoint in ENDPOINTS.items():
+        results = {}
+        if endpoint.default_model is not None:
+            results["validate default"] = per_second(
+                lambda: validate(endpoint.default_model, endpoint.body), args.iterations
+            )
+            results["validate fast"] = per_second(
+                lambda: validate(endpoint.fast_model, endpoint.body), args.iterations
+            )
+        results["encode default"] = per_second(
+            lambda: default_response(endpoint.response), args.iterations
+        )
+        results["encode fast"] = per_second(
+            lambda: fast_response(endpoint.response), args.iterations
+        )
+        results["request default"] = requests[name]["/default"]
+        results["request fast"] = requests[name]["/fast"]
+
+        print(f"\n{name}")
+        for label, ops in results.items():
+            print(f"  {label:<18} {ops:>12,.0f} ops/s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+""" 레디스 이벤트 발행 처리량 벤치마크.
+
+왕복 지연을 흉내내는 ``InMemoryRedis(latency=...)`` 를 상대로
+이벤트마다 PUBLISH 하기, ``publish_many`` 한 번, ``BatchingPublisher`` 를 비교한다.
+
+    python -m pt2.ch12.benchmarks.publish_events --events 10000 --latency 0.0005
+"""
+import argparse
+import asyncio
+import time
+
+from pt2.ch12.src.allocation.adapters.inmemory import InMemoryRedis
+from pt2.ch12.src.allocation.adapters.publisher import BatchingPublisher
+from pt2.ch12.src.allocation.adapters.redis import AsyncRedis
+from pt2.ch12.src.allocation.domain import events
+
+
+def make_events(count: int):
+    return [
+        events.Allocated(orderid=f"order-{i}", sku=f"sku-{i % 100}", qty=1, batchref="batch")
+        for i in range(count)
+    ]
+
+
+async def one_by_one(channel: AsyncRedis, messages):
+    for event in messages:
+        await channel.publish("line_allocated", event)
+
+
+async def pipelined(channel: AsyncRedis, messages):
+    await channel.publish_many(("line_allocated", event) for event in messages)
+
+
+async def batching(channel: AsyncRedis, messages, max_batch: int):
+    publisher = BatchingPublisher(channel, max_batch=max_batch)
+    for event in messages:
+        await publisher.publish("line_allocated", event)
+    await publisher.close()
+
+
+async def run(count: int, latency: float, max_batch: int):
+    messages = make_events(count)
+    scenarios = [
+        ("publish (1 per event)", lambda channel: one_by_one(channel, messages)),
+        ("publish_many", lambda channel: pipelined(channel, messages)),
+        (f"BatchingPublisher(max_batch={max_batch})",
+         lambda channel: batching(channel, messages, max_batch)),
+    ]
+    for name, scenario in scenarios:
+        channel = AsyncRedis(InMemoryRedis(latency=latency))
+        started = time.perf_counter()
+        await scenario(channel)
+        elapsed = time.perf_counter() - started
+        print(f"{name:<36} {elapsed:8.3f}s  {count / elapsed:12,.0f} events/s")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--events", type=int, default=10_000)
+    parser.add_argument("--latency", type=float, default=0.0005)
+    parser.add_argument("--max-batch", type=int, default=500)
+    args = parser.parse_args()
+
+    asyncio.run(run(args.events, args.latency, args.max_batch))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,10 +1,11 @@
-from typing import Union
+from typing import Optional, Union
 
 from pydantic import (
     BaseSettings,
     Field,
     PostgresDsn,
     RedisDsn,
+    validator,
 )
 
 
@@ -23,6 +24,19 @@ class DataSettings(BaseSettings):
         env="DATABASE_PG_URL",
         default="sqlite+aiosqlite:///:memory:",
     )
+    # 설정하면 조회(views, exports)는 레플리카로 보낸다
+    DB_REPLICA_URI: Optional[Union[PostgresDsn, str]] = Field(
+        env="DATABASE_PG_REPLICA_URL",
+        default=None,
+    )
+    MAX_REPLICA_LAG: float = Field(
+        env="MAX_REPLICA_LAG",
+        default=1.0,
+    )
+    REPLICA_LAG_CHECK_INTERVAL: float = Field(
+        env="REPLICA_LAG_CHECK_INTERVAL",
+        default=1.0,
+    )
 
 
 class MessageBrokerSettings(BaseSettings):
@@ -30,6 +44,425 @@ class MessageBrokerSettings(BaseSettings):
         env="REDIS_URL",
         default="redis://localhost:6379/0",
     )
+    # "memory" 면 레디스 대신 프로세스 안의 브로커(InMemoryRedis)를 쓴다
+    BROKER_BACKEND: str = Field(
+        env="BROKER_BACKEND",
+        default="redis",
+    )
+    # 인메모리 브로커에서 구독자마다 쌓아둘 수 있는 메시지 수
+    BROKER_BUFFER_SIZE: int = Field(
+        env="BROKER_BUFFER_SIZE",
+        default=10_000,
+    )
+    # "pubsub" 은 PUBLISH, "streams" 는 채널 이름과 같은 스트림에 XADD 한다
+    EVENT_TRANSPORT: str = Field(
+        env="EVENT_TRANSPORT",
+        default="pubsub",
+    )
+    STREAM_MAXLEN: int = Field(
+        env="STREAM_MAXLEN",
+        default=100_000,
+    )
+    # 지금은 "json" 만 받는다. 레디스 커넥션이 응답을 문자열로 디코딩하고(decode_responses=True)
+    # 컨슈머도 JSON 으로만 읽으므로 msgpack 같은 바이너리 코덱은 브로커를 거쳐 되돌아오지 못한다
+    EVENT_CODEC: str = Field(
+        env="EVENT_CODEC",
+        default="json",
+    )
+    CONSUMER_GROUP: str = Field(
+        env="CONSUMER_GROUP",
+        default="allocation",
+    )
+    # 비워두면 "호스트이름-pid" 를 쓴다. 컨슈머 프로세스마다 달라야 한다
+    CONSUMER_NAME: Optional[str] = Field(
+        env="CONSUMER_NAME",
+        default=None,
+    )
+    CONSUMER_BATCH_SIZE: int = Field(
+        env="CONSUMER_BATCH_SIZE",
+        default=100,
+    )
+    CONSUMER_BLOCK_MS: int = Field(
+        env="CONSUMER_BLOCK_MS",
+        default=1000,
+    )
+    CONSUMER_CLAIM_IDLE_MS: int = Field(
+        env="CONSUMER_CLAIM_IDLE_MS",
+        default=60_000,
+    )
+    CONSUMER_CONCURRENCY: int = Field(
+        env="CONSUMER_CONCURRENCY",
+        default=16,
+    )
+    CONSUMER_DRAIN_TIMEOUT: float = Field(
+        env="CONSUMER_DRAIN_TIMEOUT",
+        default=30.0,
+    )
+    CONSUMER_METRICS_INTERVAL: float = Field(
+        env="CONSUMER_METRICS_INTERVAL",
+        default=10.0,
+    )
+    # 실패한 메시지를 레인 안에서 다시 처리해보는 횟수. 지수적으로 늘어나는 간격을 둔다
+    CONSUMER_RETRIES: int = Field(
+        env="CONSUMER_RETRIES",
+        default=2,
+    )
+    CONSUMER_RETRY_BACKOFF: float = Field(
+        env="CONSUMER_RETRY_BACKOFF",
+        default=0.1,
+    )
+    # 실패하고 들고 있는 메시지를 다시 처리하는 간격과, 전달 횟수가 이만큼 차도록 실패하면 데드 레터 스트림으로 옮기는 한도
+    CONSUMER_REDELIVER_INTERVAL: float = Field(
+        env="CONSUMER_REDELIVER_INTERVAL",
+        default=1.0,
+    )
+    CONSUMER_MAX_DELIVERIES: int = Field(
+        env="CONSUMER_MAX_DELIVERIES",
+        default=5,
+    )
+    CONSUMER_DEAD_LETTER_STREAM: str = Field(
+        env="CONSUMER_DEAD_LETTER_STREAM",
+        default="dead_letters",
+    )
+    # 컨슈머가 기억하는 최근 이벤트 ID 수. DEDUP_SHARED 면 레디스 SET NX 로 컨슈머끼리도 나눠서 본다
+    DEDUP_WINDOW: int = Field(
+        env="DEDUP_WINDOW",
+        default=100_000,
+    )
+    DEDUP_SHARED: bool = Field(
+        env="DEDUP_SHARED",
+        default=False,
+    )
+    DEDUP_TTL: int = Field(
+        env="DEDUP_TTL",
+        default=86_400,
+    )
+    # "immediate" 는 이벤트마다 PUBLISH 한 번, "cascade"/"window" 는 BatchingPublisher로 모아서 보낸다
+    PUBLISH_MODE: str = Field(
+        env="PUBLISH_MODE",
+        default="immediate",
+    )
+    PUBLISH_MAX_BATCH: int = Field(
+        env="PUBLISH_MAX_BATCH",
+        default=500,
+    )
+    PUBLISH_MAX_DELAY: float = Field(
+        env="PUBLISH_MAX_DELAY",
+        default=0.005,
+    )
+    PUBLISH_MAX_BUFFER: int = Field(
+        env="PUBLISH_MAX_BUFFER",
+        default=10_000,
+    )
+    # "spool" 이면 서킷 브레이커가 열려 있는 동안 이벤트를 로컬 파일에 쌓았다가 다시 보낸다
+    PUBLISH_RESILIENCE: str = Field(
+        env="PUBLISH_RESILIENCE",
+        default="none",
+    )
+    PUBLISH_TIMEOUT: float = Field(
+        env="PUBLISH_TIMEOUT",
+        default=0.2,
+    )
+    BREAKER_FAILURE_THRESHOLD: int = Field(
+        env="BREAKER_FAILURE_THRESHOLD",
+        default=5,
+    )
+    BREAKER_SLOW_CALL: float = Field(
+        env="BREAKER_SLOW_CALL",
+        default=0.1,
+    )
+    BREAKER_RESET_TIMEOUT: float = Field(
+        env="BREAKER_RESET_TIMEOUT",
+        default=5.0,
+    )
+    PUBLISH_SPOOL_PATH: str = Field(
+        env="PUBLISH_SPOOL_PATH",
+        default="publish.spool",
+    )
+    PUBLISH_SPOOL_FSYNC: bool = Field(
+        env="PUBLISH_SPOOL_FSYNC",
+        default=False,
+    )
+    SPOOL_REPLAY_BATCH: int = Field(
+        env="SPOOL_REPLAY_BATCH",
+        default=500,
+    )
+    SPOOL_REPLAY_INTERVAL: float = Field(
+        env="SPOOL_REPLAY_INTERVAL",
+        default=1.0,
+    )
+
+    @validator("EVENT_CODEC")
+    def event_codec_must_be_text(cls, value: str) -> str:
+        if value != "json":
+            raise ValueError(
+                f"EVENT_CODEC={value} is not supported, redis responses are decoded as text"
+            )
+        return value
+
+
+class ReadModelSettings(BaseSettings):
+    # "sql" 이면 allocations_view 테이블을, "redis" 면 주문별 레디스 해시를 읽는다
+    READ_MODEL_BACKEND: str = Field(
+        env="READ_MODEL_BACKEND",
+        default="sql",
+    )
+
+
+class ProjectionSettings(BaseSettings):
+    # "immediate" 는 이벤트마다 트랜잭션 하나, "sync"/"async" 는 ReadModelWriter로 모아서 쓴다
+    READ_MODEL_CONSISTENCY: str = Field(
+        env="READ_MODEL_CONSISTENCY",
+        default="immediate",
+    )
+    READ_MODEL_MAX_BATCH: int = Field(
+        env="READ_MODEL_MAX_BATCH",
+        default=1000,
+    )
+    READ_MODEL_MAX_DELAY: float = Field(
+        env="READ_MODEL_MAX_DELAY",
+        default=0.05,
+    )
+    READ_MODEL_REBUILD_WORKERS: int = Field(
+        env="READ_MODEL_REBUILD_WORKERS",
+        default=4,
+    )
+    READ_MODEL_REBUILD_CHUNK_SIZE: int = Field(
+        env="READ_MODEL_REBUILD_CHUNK_SIZE",
+        default=50_000,
+    )
+
+
+class CacheSettings(BaseSettings):
+    ALLOCATIONS_CACHE_MAXSIZE: int = Field(
+        env="ALLOCATIONS_CACHE_MAXSIZE",
+        default=10_000,
+    )
+    ALLOCATIONS_CACHE_TTL: float = Field(
+        env="ALLOCATIONS_CACHE_TTL",
+        default=5.0,
+    )
+
+
+class SkuFilterSettings(BaseSettings):
+    # off | on: products 의 SKU 로 블룸 필터를 만들어 없는 SKU 는 애그리거트를 읽기 전에 거른다
+    SKU_FILTER: str = Field(
+        env="SKU_FILTER",
+        default="off",
+    )
+    SKU_FILTER_CAPACITY: int = Field(
+        env="SKU_FILTER_CAPACITY",
+        default=100_000,
+    )
+    SKU_FILTER_ERROR_RATE: float = Field(
+        env="SKU_FILTER_ERROR_RATE",
+        default=0.01,
+    )
+    # 필터를 이 주기마다 다시 올린다. 그 사이 다른 프로세스가 만든 SKU 는 DB 에 물어서 찾는다
+    SKU_FILTER_REFRESH_INTERVAL: float = Field(
+        env="SKU_FILTER_REFRESH_INTERVAL",
+        default=60.0,
+    )
+    SKU_NEGATIVE_TTL: float = Field(
+        env="SKU_NEGATIVE_TTL",
+        default=5.0,
+    )
+    SKU_NEGATIVE_MAXSIZE: int = Field(
+        env="SKU_NEGATIVE_MAXSIZE",
+        default=10_000,
+    )
+
+
+class AvailabilitySettings(BaseSettings):
+    # off | memory | redis: SKU 별 최대 가용 수량을 기억해서 넘치는 할당을 애그리거트 없이 돌려보낸다.
+    # redis 면 프로세스끼리 나눠 쓴다
+    AVAILABILITY_CACHE: str = Field(
+        env="AVAILABILITY_CACHE",
+        default="off",
+    )
+    AVAILABILITY_CACHE_MAXSIZE: int = Field(
+        env="AVAILABILITY_CACHE_MAXSIZE",
+        default=10_000,
+    )
+
+
+class BulkSettings(BaseSettings):
+    # POST /allocate/bulk 에서 서로 다른 SKU 를 동시에 할당하는 수
+    BULK_ALLOCATE_CONCURRENCY: int = Field(
+        env="BULK_ALLOCATE_CONCURRENCY",
+        default=16,
+    )
+    # 결과를 돌려주지 못한 라인이 이만큼 쌓이면 요청 본문을 그만 읽는다
+    BULK_ALLOCATE_MAX_PENDING: int = Field(
+        env="BULK_ALLOCATE_MAX_PENDING",
+        default=1_000,
+    )
+
+
+class CommandQueueSettings(BaseSettings):
+    # "sync" 는 요청 안에서 처리, "queued" 는 command_queue 테이블에 넣고 바로 202 를 돌려준다
+    ALLOCATE_MODE: str = Field(
+        env="ALLOCATE_MODE",
+        default="sync",
+    )
+    COMMAND_WORKERS: int = Field(
+        env="COMMAND_WORKERS",
+        default=4,
+    )
+    COMMAND_POLL_INTERVAL: float = Field(
+        env="COMMAND_POLL_INTERVAL",
+        default=0.1,
+    )
+    COMMAND_MAX_ATTEMPTS: int = Field(
+        env="COMMAND_MAX_ATTEMPTS",
+        default=3,
+    )
+    # 이 시간 동안 끝나지 않은 커맨드는 워커가 죽은 것으로 보고 다시 가져간다
+    COMMAND_CLAIM_TIMEOUT: float = Field(
+        env="COMMAND_CLAIM_TIMEOUT",
+        default=60.0,
+    )
+    # 종료할 때 처리 중인 커맨드가 끝나기를 기다리는 최대 시간
+    COMMAND_DRAIN_TIMEOUT: float = Field(
+        env="COMMAND_DRAIN_TIMEOUT",
+        default=10.0,
+    )
+
+
+class IdempotencySettings(BaseSettings):
+    # "memory" 는 프로세스 안에서만, "sql" 은 idempotency_keys 테이블로 프로세스끼리도 나눠 본다
+    IDEMPOTENCY_STORE: str = Field(
+        env="IDEMPOTENCY_STORE",
+        default="memory",
+    )
+    IDEMPOTENCY_MAXSIZE: int = Field(
+        env="IDEMPOTENCY_MAXSIZE",
+        default=10_000,
+    )
+    IDEMPOTENCY_TTL: float = Field(
+        env="IDEMPOTENCY_TTL",
+        default=86_400.0,
+    )
+    IDEMPOTENCY_LOCK_TIMEOUT: float = Field(
+        env="IDEMPOTENCY_LOCK_TIMEOUT",
+        default=60.0,
+    )
+
+
+class AdmissionSettings(BaseSettings):
+    # "on" 이면 포화 상태에서 기다리게 두지 않고 503 으로 바로 돌려보낸다
+    ADMISSION_CONTROL: str = Field(
+        env="ADMISSION_CONTROL",
+        default="off",
+    )
+    ADMISSION_MAX_INFLIGHT_COMMANDS: int = Field(
+        env="ADMISSION_MAX_INFLIGHT_COMMANDS",
+        default=64,
+    )
+    ADMISSION_MAX_INFLIGHT_READS: int = Field(
+        env="ADMISSION_MAX_INFLIGHT_READS",
+        default=256,
+    )
+    # 둘 중 하나라도 넘으면 쓰기를 막고 읽기만 받는다
+    ADMISSION_MAX_POOL_WAIT: float = Field(
+        env="ADMISSION_MAX_POOL_WAIT",
+        default=0.5,
+    )
+    ADMISSION_MAX_LOOP_LAG: float = Field(
+        env="ADMISSION_MAX_LOOP_LAG",
+        default=0.2,
+    )
+    ADMISSION_SAMPLE_INTERVAL: float = Field(
+        env="ADMISSION_SAMPLE_INTERVAL",
+        default=0.5,
+    )
+    ADMISSION_RETRY_AFTER: float = Field(
+        env="ADMISSION_RETRY_AFTER",
+        default=1.0,
+    )
+
+
+class EventStreamSettings(BaseSettings):
+    # GET /events 구독자마다 쌓아둘 이벤트 수. 넘치면 그 구독자를 끊는다
+    SSE_BUFFER_SIZE: int = Field(
+        env="SSE_BUFFER_SIZE",
+        default=1_000,
+    )
+    SSE_HEARTBEAT_INTERVAL: float = Field(
+        env="SSE_HEARTBEAT_INTERVAL",
+        default=15.0,
+    )
+    # broker: 브로커의 pub/sub 채널로 모든 프로세스(API 워커, 컨슈머)의 변경을 받는다
+    # local: 이 프로세스의 메시지 버스가 처리한 변경만 받는다(브로커 없이 단일 프로세스)
+    SSE_SOURCE: str = Field(
+        env="SSE_SOURCE",
+        default="broker",
+    )
+
+
+class ChangeFeedSettings(BaseSettings):
+    # GET /changes 한 번에 돌려줄 최대 변경 수와 long-poll 로 기다릴 최대 시간
+    CHANGES_MAX_LIMIT: int = Field(
+        env="CHANGES_MAX_LIMIT",
+        default=10_000,
+    )
+    CHANGES_MAX_WAIT: float = Field(
+        env="CHANGES_MAX_WAIT",
+        default=30.0,
+    )
+    CHANGES_POLL_INTERVAL: float = Field(
+        env="CHANGES_POLL_INTERVAL",
+        default=0.5,
+    )
+
+
+class NotificationSettings(BaseSettings):
+    # immediate: OutOfStock 마다 바로 보낸다 | digest: SKU 별로 거르고 모아서 SMTP 로 보낸다
+    OUT_OF_STOCK_NOTIFICATIONS: str = Field(
+        env="OUT_OF_STOCK_NOTIFICATIONS",
+        default="immediate",
+    )
+    NOTIFY_RECIPIENT: str = Field(
+        env="NOTIFY_RECIPIENT",
+        default="stock_admin@made.com",
+    )
+    NOTIFY_DEDUP_WINDOW: float = Field(
+        env="NOTIFY_DEDUP_WINDOW",
+        default=300.0,
+    )
+    NOTIFY_DIGEST_INTERVAL: float = Field(
+        env="NOTIFY_DIGEST_INTERVAL",
+        default=60.0,
+    )
+    NOTIFY_WORKERS: int = Field(
+        env="NOTIFY_WORKERS",
+        default=2,
+    )
+    NOTIFY_MAX_QUEUE: int = Field(
+        env="NOTIFY_MAX_QUEUE",
+        default=100,
+    )
+    # 로컬에서는 docker-compose 의 mailhog 로 보낸다
+    SMTP_HOST: str = Field(
+        env="SMTP_HOST",
+        default="localhost",
+    )
+    SMTP_PORT: int = Field(
+        env="SMTP_PORT",
+        default=1025,
+    )
+    SMTP_SENDER: str = Field(
+        env="SMTP_SENDER",
+        default="allocation@made.com",
+    )
+    SMTP_POOL_SIZE: int = Field(
+        env="SMTP_POOL_SIZE",
+        default=2,
+    )
+    SMTP_TIMEOUT: float = Field(
+        env="SMTP_TIMEOUT",
+        default=10.0,
+    )
 
 
 class Settings(BaseSettings):
@@ -38,6 +471,18 @@ class Settings(BaseSettings):
     desc: ServerDescriptionSettings = ServerDescriptionSettings()
     data: DataSettings = DataSettings()
     broker: MessageBrokerSettings = MessageBrokerSettings()
+    cache: CacheSettings = CacheSettings()
+    skus: SkuFilterSettings = SkuFilterSettings()
+    availability: AvailabilitySettings = AvailabilitySettings()
+    read_model: ReadModelSettings = ReadModelSettings()
+    projection: ProjectionSettings = ProjectionSettings()
+    bulk: BulkSettings = BulkSettings()
+    commands: CommandQueueSettings = CommandQueueSettings()
+    idempotency: IdempotencySettings = IdempotencySettings()
+    admission: AdmissionSettings = AdmissionSettings()
+    stream: EventStreamSettings = EventStreamSettings()
+    changes: ChangeFeedSettings = ChangeFeedSettings()
+    notify: NotificationSettings = NotificationSettings()
 
     class Config:
         case_sensitive = True
@@ -1,8 +1,24 @@
+import inspect
+
 from dependency_injector import containers, providers
 
 from pt2.ch12.config import Settings
-from pt2.ch12.src.allocation.adapters import redis
+from pt2.ch12.src.allocation.adapters import cache, redis
+from pt2.ch12.src.allocation.adapters.availability import AvailabilityCache
+from pt2.ch12.src.allocation.adapters.command_queue import CommandQueue, CommandWorkers
+from pt2.ch12.src.allocation.adapters.email import SmtpMailer
+from pt2.ch12.src.allocation.adapters.hub import BrokerFeed, EventHub
+from pt2.ch12.src.allocation.adapters.idempotency import IdempotencyStore
+from pt2.ch12.src.allocation.adapters.notifications import OutOfStockNotifier
+from pt2.ch12.src.allocation.adapters.breaker import CircuitBreaker
 from pt2.ch12.src.allocation.adapters.postgres import AsyncSQLAlchemy
+from pt2.ch12.src.allocation.adapters.projection import ReadModelWriter
+from pt2.ch12.src.allocation.adapters.publisher import BatchingPublisher
+from pt2.ch12.src.allocation.adapters.redis import RedisReadModel
+from pt2.ch12.src.allocation.adapters.replica import ReplicaLagGuard
+from pt2.ch12.src.allocation.adapters.skus import KnownSkus
+from pt2.ch12.src.allocation.adapters.spool import Spool, SpoolingPublisher
+from pt2.ch12.src.allocation.entrypoints.admission import AdmissionController
 from pt2.ch12.src.allocation.service_layer import unit_of_work
 
 
@@ -23,17 +39,240 @@ class Container(containers.DeclarativeContainer):
         db_uri=config.data.DB_URI,
     )
 
+    replica_db = providers.Singleton(
+        AsyncSQLAlchemy,
+        db_uri=config.data.DB_REPLICA_URI,
+    )
+
+    replica_lag_guard = providers.Singleton(
+        ReplicaLagGuard,
+        primary=db,
+        replica=replica_db,
+        max_lag=config.data.MAX_REPLICA_LAG,
+        check_interval=config.data.REPLICA_LAG_CHECK_INTERVAL,
+    )
+
     redis_pool = providers.Resource(
         redis.init_redis_pool,
         redis_uri=config.broker.REDIS_URI,
+        backend=config.broker.BROKER_BACKEND,
+        buffer_size=config.broker.BROKER_BUFFER_SIZE,
     )
 
     redis = providers.Factory(
         redis.AsyncRedis,
         session=redis_pool,
+        transport=config.broker.EVENT_TRANSPORT,
+        stream_maxlen=config.broker.STREAM_MAXLEN,
+        codec_name=config.broker.EVENT_CODEC,
+    )
+
+    breaker = providers.Singleton(
+        CircuitBreaker,
+        failure_threshold=config.broker.BREAKER_FAILURE_THRESHOLD,
+        slow_call=config.broker.BREAKER_SLOW_CALL,
+        reset_timeout=config.broker.BREAKER_RESET_TIMEOUT,
+    )
+
+    spooling_publisher = providers.Singleton(
+        SpoolingPublisher,
+        channel=redis,
+        spool=providers.Singleton(
+            Spool,
+            path=config.broker.PUBLISH_SPOOL_PATH,
+            fsync=config.broker.PUBLISH_SPOOL_FSYNC,
+        ),
+        breaker=breaker,
+        timeout=config.broker.PUBLISH_TIMEOUT,
+        replay_batch=config.broker.SPOOL_REPLAY_BATCH,
+        replay_interval=config.broker.SPOOL_REPLAY_INTERVAL,
+    )
+
+    # 레디스로 실제로 보내는 쪽. "spool" 이면 브레이커와 스풀을 한 겹 씌운다
+    raw_channel = providers.Selector(
+        config.broker.PUBLISH_RESILIENCE,
+        none=redis,
+        spool=spooling_publisher,
+    )
+
+    publisher = providers.Singleton(
+        BatchingPublisher,
+        channel=raw_channel,
+        mode=config.broker.PUBLISH_MODE,
+        max_batch=config.broker.PUBLISH_MAX_BATCH,
+        max_delay=config.broker.PUBLISH_MAX_DELAY,
+        max_buffer=config.broker.PUBLISH_MAX_BUFFER,
+    )
+
+    event_channel = providers.Selector(
+        config.broker.PUBLISH_MODE,
+        immediate=raw_channel,
+        cascade=publisher,
+        window=publisher,
+    )
+
+    read_model = providers.Selector(
+        config.read_model.READ_MODEL_BACKEND,
+        sql=providers.Object(None),
+        redis=providers.Factory(
+            RedisReadModel,
+            session=redis_pool,
+        ),
+    )
+
+    allocations_cache = providers.Singleton(
+        cache.AllocationsCache,
+        maxsize=config.cache.ALLOCATIONS_CACHE_MAXSIZE,
+        ttl=config.cache.ALLOCATIONS_CACHE_TTL,
+    )
+
+    sku_filter = providers.Singleton(
+        KnownSkus,
+        session_factory=db.provided.session_factory,
+        capacity=config.skus.SKU_FILTER_CAPACITY,
+        error_rate=config.skus.SKU_FILTER_ERROR_RATE,
+        refresh_interval=config.skus.SKU_FILTER_REFRESH_INTERVAL,
+        negative_ttl=config.skus.SKU_NEGATIVE_TTL,
+        negative_maxsize=config.skus.SKU_NEGATIVE_MAXSIZE,
+    )
+
+    known_skus = providers.Selector(
+        config.skus.SKU_FILTER,
+        off=providers.Object(None),
+        on=sku_filter,
+    )
+
+    availability = providers.Selector(
+        config.availability.AVAILABILITY_CACHE,
+        off=providers.Object(None),
+        memory=providers.Singleton(
+            AvailabilityCache,
+            maxsize=config.availability.AVAILABILITY_CACHE_MAXSIZE,
+        ),
+        redis=providers.Singleton(
+            AvailabilityCache,
+            maxsize=config.availability.AVAILABILITY_CACHE_MAXSIZE,
+            session=redis_pool,
+        ),
+    )
+
+    read_model_writer = providers.Singleton(
+        ReadModelWriter,
+        session_factory=db.provided.session_factory,
+        consistency=config.projection.READ_MODEL_CONSISTENCY,
+        max_batch=config.projection.READ_MODEL_MAX_BATCH,
+        max_delay=config.projection.READ_MODEL_MAX_DELAY,
+        cache=allocations_cache,
+    )
+
+    projection = providers.Selector(
+        config.projection.READ_MODEL_CONSISTENCY,
+        immediate=providers.Object(None),
+        sync=read_model_writer,
+        # async 는 예약어라 키워드 인자로 넘길 수 없다
+        **{"async": read_model_writer},
+    )
+
+    command_queue = providers.Singleton(
+        CommandQueue,
+        session_factory=db.provided.session_factory,
+        claim_timeout=config.commands.COMMAND_CLAIM_TIMEOUT,
+    )
+
+    # 핸들러(메시지 버스 호출)는 엔트리포인트가 처음 만들 때 넘긴다
+    command_workers = providers.Singleton(
+        CommandWorkers,
+        queue=command_queue,
+        workers=config.commands.COMMAND_WORKERS,
+        poll_interval=config.commands.COMMAND_POLL_INTERVAL,
+        max_attempts=config.commands.COMMAND_MAX_ATTEMPTS,
+        drain_timeout=config.commands.COMMAND_DRAIN_TIMEOUT,
+    )
+
+    idempotency_store = providers.Singleton(
+        IdempotencyStore,
+        maxsize=config.idempotency.IDEMPOTENCY_MAXSIZE,
+        ttl=config.idempotency.IDEMPOTENCY_TTL,
+        session_factory=providers.Selector(
+            config.idempotency.IDEMPOTENCY_STORE,
+            memory=providers.Object(None),
+            sql=db.provided.session_factory,
+        ),
+        lock_timeout=config.idempotency.IDEMPOTENCY_LOCK_TIMEOUT,
+    )
+
+    event_hub = providers.Singleton(
+        EventHub,
+        buffer_size=config.stream.SSE_BUFFER_SIZE,
+    )
+
+    hub_feed = providers.Selector(
+        config.stream.SSE_SOURCE,
+        local=providers.Object(None),
+        broker=providers.Singleton(
+            BrokerFeed,
+            hub=event_hub,
+            session=redis_pool,
+            codec_name=config.broker.EVENT_CODEC,
+        ),
+    )
+
+    mailer = providers.Singleton(
+        SmtpMailer,
+        host=config.notify.SMTP_HOST,
+        port=config.notify.SMTP_PORT,
+        sender=config.notify.SMTP_SENDER,
+        pool_size=config.notify.SMTP_POOL_SIZE,
+        timeout=config.notify.SMTP_TIMEOUT,
+    )
+
+    out_of_stock_notifier = providers.Singleton(
+        OutOfStockNotifier,
+        mailer=mailer,
+        recipient=config.notify.NOTIFY_RECIPIENT,
+        dedup_window=config.notify.NOTIFY_DEDUP_WINDOW,
+        digest_interval=config.notify.NOTIFY_DIGEST_INTERVAL,
+        workers=config.notify.NOTIFY_WORKERS,
+        max_queue=config.notify.NOTIFY_MAX_QUEUE,
+    )
+
+    notifier = providers.Selector(
+        config.notify.OUT_OF_STOCK_NOTIFICATIONS,
+        immediate=providers.Object(None),
+        digest=out_of_stock_notifier,
+    )
+
+    admission = providers.Singleton(
+        AdmissionController,
+        db=db,
+        max_inflight_commands=config.admission.ADMISSION_MAX_INFLIGHT_COMMANDS,
+        max_inflight_reads=config.admission.ADMISSION_MAX_INFLIGHT_READS,
+        max_pool_wait=config.admission.ADMISSION_MAX_POOL_WAIT,
+        max_loop_lag=config.admission.ADMISSION_MAX_LOOP_LAG,
+        sample_interval=config.admission.ADMISSION_SAMPLE_INTERVAL,
+        retry_after=config.admission.ADMISSION_RETRY_AFTER,
+    )
+
+    # 메시지 버스 핸들러에 이름으로 넘기는 의존성. 엔트리포인트는 이것만 받아서 펼친다
+    bus_dependencies = providers.Dict(
+        channel=event_channel,
+        cache=allocations_cache,
+        read_model=read_model,
+        projection=projection,
+        hub=event_hub,
+        hub_feed=hub_feed,
+        notifier=notifier,
+        known_skus=known_skus,
+        availability=availability,
     )
 
     allocation_uow = providers.Factory(
         unit_of_work.SqlAlchemyUnitOfWork,
         session_factory=db.provided.session_factory,
     )
+
+
+async def provide(provider):
+    # 비동기 리소스(레디스 풀)에 기대는 프로바이더는 Future 를 돌려준다
+    value = provider()
+    return await value if inspect.isawaitable(value) else value
@@ -0,0 +1,140 @@
+import logging
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Optional, Tuple
+
+import redis.asyncio as redis
+
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class AvailabilityStats:
+    rejections: int = 0
+    passes: int = 0
+    misses: int = 0
+    updates: int = 0
+    redis_hits: int = 0
+    redis_errors: int = 0
+
+    def as_dict(self) -> dict:
+        return dict(
+            rejections=self.rejections,
+            passes=self.passes,
+            misses=self.misses,
+            updates=self.updates,
+            redis_hits=self.redis_hits,
+            redis_errors=self.redis_errors,
+        )
+
+
+class AvailabilityCache:
+    """ SKU 별로 ``(products.version_number, 배치 중 가장 많이 남은 수량)`` 을 기억한다.
+
+    값은 그 버전의 애그리거트에서 잰 것이라, 지금 DB 의 버전과 같을 때만 쓴다.
+    애그리거트를 바꾸는 모든 경로가 버전을 올리므로 버전이 같으면 요약도 정확하다.
+    버전이 다르거나 모르면 ``None`` 을 돌려주고, 호출하는 쪽은 애그리거트를 읽는다.
+    그래서 오래된 값은 느린 길로 보낼 뿐 요청을 잘못 돌려보내지 않는다.
+
+    ``session`` 을 주면 ``availability`` 해시에도 적어서 다른 프로세스와 나눠 쓴다.
+    할당은 먼저 버전 없이 ``might_reject`` 로 보고, 돌려보낼 것 같을 때만 버전을 묻는다.
+    """
+
+    KEY = "availability"
+
+    def __init__(
+            self,
+            maxsize: int = 10_000,
+            session: Optional[redis.Redis] = None,
+    ):
+        self._maxsize = maxsize
+        self._session = session
+        self._entries: "OrderedDict[str, Tuple[int, int]]" = OrderedDict()
+        self.stats = AvailabilityStats()
+
+    def __len__(self):
+        return len(self._entries)
+
+    async def might_reject(self, sku: str, qty: int) -> bool:
+        """ 알고 있는 가장 최근 요약으로는 ``qty`` 를 할당할 수 없으면 True.
+
+        버전을 DB 에 묻지 않고 보므로 True 면 ``rejects`` 로 지금 버전인지 확인해야 한다.
+        False 면 확인할 것 없이 애그리거트를 읽는다(돌려보내지 않는 쪽은 틀려도 안전하다).
+        """
+        entry = self._entries.get(sku)
+        if entry is None:
+            entry = await self._fetch(sku)
+            if entry is None:
+                self.stats.misses += 1
+                return False
+            self.stats.redis_hits += 1
+        if qty > entry[1]:
+            return True
+        self.stats.passes += 1
+        return False
+
+    async def rejects(self, sku: str, version: int, qty: int) -> bool:
+        """ ``version`` 의 애그리거트가 ``qty`` 를 할당할 수 없는 게 확실하면 True. """
+        available = await self.max_available(sku, version)
+        if available is None:
+            self.stats.misses += 1
+            return False
+        if qty > available:
+            self.stats.rejections += 1
+            return True
+        self.stats.passes += 1
+        return False
+
+    async def max_available(self, sku: str, version: int) -> Optional[int]:
+        entry = self._entries.get(sku)
+        if entry is not None and entry[0] == version:
+            self._entries.move_to_end(sku)
+            return entry[1]
+
+        entry = await self._fetch(sku)
+        if entry is None or entry[0] != version:
+            return None
+        self.stats.redis_hits += 1
+        return entry[1]
+
+    async def _fetch(self, sku: str) -> Optional[Tuple[int, int]]:
+        """ 레디스에 적힌 요약을 읽어서 로컬에도 넣는다. """
+        if self._session is None:
+            return None
+
+        try:
+            raw = await self._session.hget(self.KEY, sku)
+        except Exception as ex:
+            self.stats.redis_errors += 1
+            logger.warning(f'Exception reading availability from redis... detail: {ex}')
+            return None
+        if raw is None:
+            return None
+
+        version, available = (int(part) for part in raw.split(":"))
+        self._put(sku, version, available)
+        return version, available
+
+    async def update(self, sku: str, version: int, available: int):
+        """ 커밋한 뒤에 그 버전의 요약을 적는다. """
+        self.stats.updates += 1
+        self._put(sku, version, available)
+        if self._session is None:
+            return
+
+        try:
+            await self._session.hset(self.KEY, sku, f"{version}:{available}")
+        except Exception as ex:
+            self.stats.redis_errors += 1
+            logger.warning(f'Exception writing availability to redis... detail: {ex}')
+
+    def _put(self, sku: str, version: int, available: int):
+        entry = self._entries.get(sku)
+        if entry is not None and entry[0] > version:
+            # 늦게 도착한 옛 버전의 요약으로 덮어쓰지 않는다
+            return
+        self._entries[sku] = (version, available)
+        self._entries.move_to_end(sku)
+        while len(self._entries) > self._maxsize:
+            self._entries.popitem(last=False)
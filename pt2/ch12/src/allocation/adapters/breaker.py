@@ -0,0 +1,96 @@
+import time
+from dataclasses import dataclass
+from typing import Callable
+
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+@dataclass
+class BreakerStats:
+    successes: int = 0
+    failures: int = 0
+    slow_calls: int = 0
+    rejected: int = 0
+    opened: int = 0
+
+    def as_dict(self) -> dict:
+        return dict(
+            successes=self.successes,
+            failures=self.failures,
+            slow_calls=self.slow_calls,
+            rejected=self.rejected,
+            opened=self.opened,
+        )
+
+
+class CircuitBreaker:
+    """ 실패나 느린 호출이 ``failure_threshold`` 번 이어지면 열린다.
+
+    열려 있는 동안은 ``allow()`` 가 False 라서 호출하지 않고 바로 우회한다.
+    ``reset_timeout`` 이 지나면 반쯤 열려서 시험 호출 하나만 보내 보고,
+    성공하면 닫고 실패하면 다시 연다.
+    """
+
+    def __init__(
+            self,
+            failure_threshold: int = 5,
+            slow_call: float = 0.1,
+            reset_timeout: float = 5.0,
+            clock: Callable[[], float] = time.monotonic,
+    ):
+        self._failure_threshold = failure_threshold
+        self._slow_call = slow_call
+        self._reset_timeout = reset_timeout
+        self._clock = clock
+        self._state = CLOSED
+        self._consecutive_failures = 0
+        self._opened_at = 0.0
+        self._trial_in_flight = False
+        self.stats = BreakerStats()
+
+    @property
+    def state(self) -> str:
+        if self._state == OPEN and self._clock() - self._opened_at >= self._reset_timeout:
+            self._state = HALF_OPEN
+            self._trial_in_flight = False
+        return self._state
+
+    def allow(self) -> bool:
+        state = self.state
+        if state == CLOSED:
+            return True
+        if state == HALF_OPEN and not self._trial_in_flight:
+            self._trial_in_flight = True
+            return True
+
+        self.stats.rejected += 1
+        return False
+
+    def record(self, elapsed: float):
+        if elapsed > self._slow_call:
+            self.stats.slow_calls += 1
+            self._fail()
+        else:
+            self.record_success()
+
+    def record_success(self):
+        self.stats.successes += 1
+        self._consecutive_failures = 0
+        self._trial_in_flight = False
+        self._state = CLOSED
+
+    def record_failure(self):
+        self.stats.failures += 1
+        self._fail()
+
+    def _fail(self):
+        self._consecutive_failures += 1
+        self._trial_in_flight = False
+        if self._state == HALF_OPEN or self._consecutive_failures >= self._failure_threshold:
+            if self._state != OPEN:
+                self.stats.opened += 1
+            self._state = OPEN
+            self._opened_at = self._clock()
@@ -0,0 +1,145 @@
+import asyncio
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import (
+    Any,
+    Awaitable,
+    Callable,
+    Dict,
+    Hashable,
+    Tuple,
+)
+
+
+_MISSING = object()
+
+
+@dataclass
+class CacheStats:
+    hits: int = 0
+    misses: int = 0
+    loads: int = 0
+    coalesced: int = 0
+    evictions: int = 0
+    expirations: int = 0
+    invalidations: int = 0
+
+    @property
+    def hit_ratio(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def as_dict(self) -> dict:
+        return dict(
+            hits=self.hits,
+            misses=self.misses,
+            loads=self.loads,
+            coalesced=self.coalesced,
+            evictions=self.evictions,
+            expirations=self.expirations,
+            invalidations=self.invalidations,
+            hit_ratio=self.hit_ratio,
+        )
+
+
+class AllocationsCache:
+    """ 읽기 모델 앞단에 두는 TTL + LRU 캐시.
+
+    같은 키에 대한 동시 미스는 하나의 로더 호출로 합친다(single-flight).
+    로딩하던 요청이 취소되면 기다리던 요청 중 하나가 다시 로딩한다.
+    로딩 도중 무효화가 일어나면 진행 중인 로딩을 떼어내므로
+    오래된 결과가 캐시에 들어가거나 이후의 미스에 공유되지 않는다.
+    """
+
+    def __init__(
+            self,
+            maxsize: int = 1024,
+            ttl: float = 5.0,
+            clock: Callable[[], float] = time.monotonic,
+    ):
+        self._maxsize = maxsize
+        self._ttl = ttl
+        self._clock = clock
+        self._entries: "OrderedDict[Hashable, Tuple[float, Any]]" = OrderedDict()
+        self._inflight: Dict[Hashable, asyncio.Future] = {}
+        self.stats = CacheStats()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key: Hashable, default: Any = None):
+        """ 살아 있는 항목이 있으면 돌려준다. 없으면 로딩하지 않고 ``default`` 를 돌려준다. """
+        entry = self._entries.get(key)
+        if entry is None:
+            return default
+
+        expires_at, value = entry
+        if expires_at <= self._clock():
+            del self._entries[key]
+            self.stats.expirations += 1
+            return default
+
+        self._entries.move_to_end(key)
+        self.stats.hits += 1
+        return value
+
+    async def get_or_load(
+            self,
+            key: Hashable,
+            loader: Callable[[], Awaitable[Any]],
+    ):
+        entry = self.get(key, _MISSING)
+        if entry is not _MISSING:
+            return entry
+
+        self.stats.misses += 1
+        while True:
+            inflight = self._inflight.get(key)
+            if inflight is None:
+                break
+            self.stats.coalesced += 1
+            try:
+                return await asyncio.shield(inflight)
+            except asyncio.CancelledError:
+                # 로딩하던 요청이 취소됐으면(클라이언트가 끊는 등) 기다리던 쪽이 로딩을 이어받는다
+                if not inflight.cancelled():
+                    raise
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            self.stats.loads += 1
+            value = await loader()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # 기다리는 쪽이 없으면 "exception was never retrieved" 경고가 뜬다
+            future.exception()
+            raise
+        else:
+            future.set_result(value)
+            if self._inflight.get(key) is future:
+                self._put(key, value)
+            return value
+        finally:
+            if self._inflight.get(key) is future:
+                del self._inflight[key]
+
+    def invalidate(self, key: Hashable):
+        self._inflight.pop(key, None)
+        if self._entries.pop(key, None) is not None:
+            self.stats.invalidations += 1
+
+    def clear(self):
+        self._entries.clear()
+        self._inflight.clear()
+
+    def _put(self, key: Hashable, value: Any):
+        self._entries[key] = (self._clock() + self._ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self._maxsize:
+            self._entries.popitem(last=False)
+            self.stats.evictions += 1
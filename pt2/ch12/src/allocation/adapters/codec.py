@@ -0,0 +1,172 @@
+""" ``events.*`` / ``commands.*`` 직렬화.
+
+메시지 타입마다 필드를 그대로 나열한 인코더 함수를 처음 쓸 때 만들어 둔다.
+``dataclasses.asdict`` 처럼 재귀적으로 복사하거나 매번 필드를 훑지 않는다.
+디코딩은 읽은 dict 를 생성자에 그대로 넘기고, 날짜 필드만 되돌린다.
+
+백엔드는 JSON(orjson 이 깔려 있으면 orjson)과, msgpack 이 깔려 있으면 msgpack 을 쓸 수 있다.
+인코딩한 바이트는 메시지 인스턴스에 백엔드별로 붙여두므로 같은 이벤트를
+여러 전송 수단(레디스, 스풀 파일 등)으로 보내도 한 번만 직렬화한다.
+메시지는 만든 뒤에 고치지 않는다는 전제다.
+"""
+import dataclasses
+import json
+import typing
+from datetime import date
+from typing import Any, Callable, Dict, Tuple, Type, Union
+
+from pt2.ch12.src.allocation.domain import commands, events
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - 선택 의존성
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:  # pragma: no cover - 선택 의존성
+    msgpack = None
+
+
+Message = Union[commands.Command, events.Event]
+
+JSON = "json"
+MSGPACK = "msgpack"
+
+# 인코딩 결과를 붙여두는 인스턴스 속성 이름. 데이터클래스 필드가 아니라 eq/repr 에 안 끼어든다
+CACHE_ATTRIBUTE = "_encoded"
+
+
+class JsonBackend:
+    name = JSON
+
+    # 디코딩은 한 번 더 감싸지 않고 라이브러리 함수를 그대로 부른다
+    if orjson is not None:
+        dumps = staticmethod(orjson.dumps)
+        loads = staticmethod(orjson.loads)
+    else:
+        _encoder = json.JSONEncoder(separators=(",", ":"), ensure_ascii=False)
+
+        @classmethod
+        def dumps(cls, data: dict) -> bytes:
+            return cls._encoder.encode(data).encode()
+
+        loads = staticmethod(json.loads)
+
+
+class MsgPackBackend:
+    """ 바이너리라서 ``decode_responses=True`` 인 레디스 커넥션으로는 읽을 수 없다. """
+
+    name = MSGPACK
+
+    @staticmethod
+    def dumps(data: dict) -> bytes:
+        return msgpack.packb(data, use_bin_type=True)
+
+    @staticmethod
+    def loads(raw: bytes) -> dict:
+        return msgpack.unpackb(raw, raw=False)
+
+
+BACKENDS = {JSON: JsonBackend}
+if msgpack is not None:
+    BACKENDS[MSGPACK] = MsgPackBackend
+
+
+def get_backend(name: str):
+    try:
+        return BACKENDS[name]
+    except KeyError:
+        raise ValueError(f"unknown or unavailable codec {name}") from None
+
+
+def _message_types(base: type) -> Dict[str, Type]:
+    found = {}
+    for cls in base.__subclasses__():
+        if dataclasses.is_dataclass(cls):
+            found[cls.__name__] = cls
+        found.update(_message_types(cls))
+    return found
+
+
+MESSAGE_TYPES: Dict[str, Type] = {
+    **_message_types(events.Event),
+    **_message_types(commands.Command),
+}
+
+
+def _is_date(hint) -> bool:
+    return hint is date or date in typing.get_args(hint)
+
+
+def _iso(value):
+    return None if value is None else value.isoformat()
+
+
+def _parse_date(value):
+    return date.fromisoformat(value) if isinstance(value, str) else value
+
+
+def _generate(cls: Type) -> Callable:
+    hints = typing.get_type_hints(cls)
+    encode_items = []
+    for field in dataclasses.fields(cls):
+        value = f"message.{field.name}"
+        encode_items.append(f"{field.name!r}: {'_iso(' + value + ')' if _is_date(hints[field.name]) else value}")
+
+    namespace: Dict[str, Any] = {"_iso": _iso}
+    source = "\n".join([
+        "def encode(message):",
+        f"    return {{{', '.join(encode_items)}}}",
+    ])
+    exec(compile(source, f"<codec {cls.__name__}>", "exec"), namespace)
+    return namespace["encode"]
+
+
+def _date_fields(cls: Type) -> Tuple[str, ...]:
+    hints = typing.get_type_hints(cls)
+    return tuple(field.name for field in dataclasses.fields(cls) if _is_date(hints[field.name]))
+
+
+_encoders: Dict[Type, Callable] = {}
+_dates: Dict[Type, Tuple[str, ...]] = {}
+
+
+def to_dict(message: Message) -> dict:
+    """ ``asdict`` 대신 쓴다. 필드 값을 복사하지 않고 날짜는 ISO 문자열로 바꾼다. """
+    cls = type(message)
+    encoder = _encoders.get(cls)
+    if encoder is None:
+        encoder = _encoders[cls] = _generate(cls)
+    return encoder(message)
+
+
+def from_dict(cls: Type, data: dict) -> Message:
+    dates = _dates.get(cls)
+    if dates is None:
+        dates = _dates[cls] = _date_fields(cls)
+    if dates:
+        data = dict(data)
+        for name in dates:
+            if name in data:
+                data[name] = _parse_date(data[name])
+    return cls(**data)
+
+
+def encode(message: Message, backend: str = JSON) -> bytes:
+    cache = message.__dict__.get(CACHE_ATTRIBUTE)
+    if cache is None:
+        cache = message.__dict__[CACHE_ATTRIBUTE] = {}
+
+    encoded = cache.get(backend)
+    if encoded is None:
+        encoded = cache[backend] = get_backend(backend).dumps(to_dict(message))
+    return encoded
+
+
+def decode(cls: Type, raw: Union[bytes, str], backend: str = JSON) -> Message:
+    data = get_backend(backend).loads(raw)
+    if _dates.get(cls) == ():
+        # 날짜 필드가 없으면 json.loads + cls(**data) 와 같은 일만 한다
+        return cls(**data)
+    return from_dict(cls, data)
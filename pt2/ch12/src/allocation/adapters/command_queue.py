@@ -0,0 +1,279 @@
+import asyncio
+import json
+import logging
+import time
+import uuid
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, List, Optional
+
+from sqlalchemy import and_, insert, or_, select, update
+
+from pt2.ch12.src.allocation.adapters import codec
+from pt2.ch12.src.allocation.adapters.orm import command_queue
+from pt2.ch12.src.allocation.domain import commands
+from pt2.ch12.src.allocation.service_layer import handlers
+
+
+logger = logging.getLogger(__name__)
+
+PENDING = "pending"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+# 다시 시도해도 결과가 같은 도메인 오류는 바로 실패로 기록한다
+PERMANENT_ERRORS = (handlers.InvalidSku,)
+
+
+@dataclass(frozen=True)
+class QueuedCommand:
+    id: str
+    command: commands.Command
+    attempts: int
+    created_at: float
+
+
+@dataclass
+class CommandQueueStats:
+    enqueued: int = 0
+    done: int = 0
+    failed: int = 0
+    retried: int = 0
+    last_wait: float = 0.0
+    max_wait: float = 0.0
+
+    def as_dict(self) -> dict:
+        return dict(
+            enqueued=self.enqueued,
+            done=self.done,
+            failed=self.failed,
+            retried=self.retried,
+            last_wait=self.last_wait,
+            max_wait=self.max_wait,
+        )
+
+
+class CommandQueue:
+    """ 커맨드를 ``command_queue`` 테이블에 쌓아두는 내구성 있는 큐.
+
+    ``claim`` 은 ``status`` 를 조건으로 건 UPDATE 로 한 행씩 가져가므로 여러 워커나
+    프로세스가 같은 커맨드를 두 번 집지 않는다. ``claim_timeout`` 동안 끝나지 않은
+    running 행은 워커가 죽은 것으로 보고 다시 가져간다.
+    """
+
+    def __init__(
+            self,
+            session_factory,
+            claim_timeout: float = 60.0,
+            clock: Callable[[], float] = time.time,
+    ):
+        self._session_factory = session_factory
+        self._claim_timeout = claim_timeout
+        self._clock = clock
+
+    async def enqueue(self, command: commands.Command) -> str:
+        command_id = uuid.uuid4().hex
+        now = self._clock()
+        async with self._session_factory() as session:
+            await session.execute(
+                insert(command_queue).values(
+                    id=command_id,
+                    type=type(command).__name__,
+                    payload=json.dumps(codec.to_dict(command)),
+                    status=PENDING,
+                    attempts=0,
+                    created_at=now,
+                    updated_at=now,
+                )
+            )
+            await session.commit()
+        return command_id
+
+    async def claim(self, limit: int = 1) -> List[QueuedCommand]:
+        now = self._clock()
+        claimable = or_(
+            command_queue.c.status == PENDING,
+            and_(
+                command_queue.c.status == RUNNING,
+                command_queue.c.claimed_at < now - self._claim_timeout,
+            ),
+        )
+        claimed = []
+        async with self._session_factory() as session:
+            rows = await session.execute(
+                select(
+                    command_queue.c.id,
+                    command_queue.c.type,
+                    command_queue.c.payload,
+                    command_queue.c.attempts,
+                    command_queue.c.created_at,
+                )
+                .where(claimable)
+                .order_by(command_queue.c.created_at)
+                .limit(limit)
+            )
+            for command_id, type_name, payload, attempts, created_at in list(rows):
+                result = await session.execute(
+                    update(command_queue)
+                    .where(and_(command_queue.c.id == command_id, claimable))
+                    .values(
+                        status=RUNNING,
+                        claimed_at=now,
+                        updated_at=now,
+                        attempts=attempts + 1,
+                    )
+                )
+                if result.rowcount != 1:
+                    # 다른 워커가 먼저 가져갔다
+                    continue
+                command = codec.from_dict(codec.MESSAGE_TYPES[type_name], json.loads(payload))
+                claimed.append(QueuedCommand(command_id, command, attempts + 1, created_at))
+            await session.commit()
+        return claimed
+
+    async def complete(self, command_id: str, result: Any = None):
+        await self._finish(command_id, status=DONE, result=json.dumps(result))
+
+    async def fail(self, command_id: str, error: str):
+        await self._finish(command_id, status=FAILED, error=error)
+
+    async def retry(self, command_id: str, error: str):
+        await self._finish(command_id, status=PENDING, error=error, claimed_at=None)
+
+    async def get(self, command_id: str) -> Optional[dict]:
+        async with self._session_factory() as session:
+            row = (await session.execute(
+                select(command_queue).where(command_queue.c.id == command_id)
+            )).first()
+        if row is None:
+            return None
+
+        return {
+            "id": row.id,
+            "type": row.type,
+            "status": row.status,
+            "result": json.loads(row.result) if row.result is not None else None,
+            "error": row.error,
+            "attempts": row.attempts,
+            "created_at": row.created_at,
+            "updated_at": row.updated_at,
+        }
+
+    async def _finish(self, command_id: str, **values):
+        async with self._session_factory() as session:
+            await session.execute(
+                update(command_queue)
+                .where(command_queue.c.id == command_id)
+                .values(updated_at=self._clock(), **values)
+            )
+            await session.commit()
+
+
+class CommandWorkers:
+    """ ``workers`` 개의 태스크가 큐를 비운다.
+
+    같은 프로세스에서 넣은 커맨드는 ``notify()`` 로 바로 깨우고, 다른 프로세스가
+    넣은 것은 ``poll_interval`` 마다 확인한다. 일시적인 오류는 ``max_attempts``
+    번까지 다시 시도하고, 없는 SKU 같은 도메인 오류는 곧바로 실패로 남긴다.
+    할당할 배치가 없어서 결과가 없는 Allocate 도 재고 부족으로 실패 처리한다.
+
+    ``close`` 는 워커를 처리 도중에 취소하지 않는다. 지금 처리 중인 커맨드를 끝내고
+    멈추기를 ``drain_timeout`` 동안 기다린 뒤에야 남은 태스크를 취소한다.
+    """
+
+    def __init__(
+            self,
+            queue: CommandQueue,
+            handle: Callable[[commands.Command], Awaitable[Any]],
+            workers: int = 4,
+            poll_interval: float = 0.1,
+            max_attempts: int = 3,
+            drain_timeout: float = 10.0,
+            clock: Callable[[], float] = time.time,
+    ):
+        self._queue = queue
+        self._handle = handle
+        self._workers = workers
+        self._poll_interval = poll_interval
+        self._max_attempts = max_attempts
+        self._drain_timeout = drain_timeout
+        self._clock = clock
+        self._wakeup = asyncio.Event()
+        self._stopping = False
+        self._tasks: List[asyncio.Task] = []
+        self.stats = CommandQueueStats()
+
+    def notify(self):
+        self.stats.enqueued += 1
+        self._wakeup.set()
+
+    async def start(self):
+        if not self._tasks:
+            self._stopping = False
+            self._tasks = [
+                asyncio.create_task(self._run())
+                for _ in range(self._workers)
+            ]
+
+    async def close(self):
+        if not self._tasks:
+            return
+
+        self._stopping = True
+        self._wakeup.set()
+        _, running = await asyncio.wait(self._tasks, timeout=self._drain_timeout)
+        if running:
+            logger.warning(f'Cancelling {len(running)} command workers still running')
+        for task in running:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def run_once(self) -> bool:
+        """ 커맨드 하나를 처리한다. 큐가 비어 있으면 False. """
+        claimed = await self._queue.claim(limit=1)
+        if not claimed:
+            return False
+
+        [queued] = claimed
+        wait = self._clock() - queued.created_at
+        self.stats.last_wait = wait
+        self.stats.max_wait = max(self.stats.max_wait, wait)
+        try:
+            results = await self._handle(queued.command)
+        except PERMANENT_ERRORS as e:
+            await self._queue.fail(queued.id, str(e))
+            self.stats.failed += 1
+        except Exception as ex:
+            logger.exception(f'Exception handling queued {queued.command}... detail: {ex}')
+            if queued.attempts >= self._max_attempts:
+                await self._queue.fail(queued.id, repr(ex))
+                self.stats.failed += 1
+            else:
+                await self._queue.retry(queued.id, repr(ex))
+                self.stats.retried += 1
+        else:
+            result = results[0] if results else None
+            if isinstance(queued.command, commands.Allocate) and result is None:
+                await self._queue.fail(queued.id, f"Out of stock for sku {queued.command.sku}")
+                self.stats.failed += 1
+            else:
+                await self._queue.complete(queued.id, result)
+                self.stats.done += 1
+        return True
+
+    async def _run(self):
+        while not self._stopping:
+            try:
+                if await self.run_once():
+                    continue
+            except Exception as ex:
+                logger.exception(f'Exception draining command queue... detail: {ex}')
+
+            if self._stopping:
+                break
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self._poll_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
@@ -0,0 +1,77 @@
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Optional
+
+import redis.asyncio as redis
+
+
+@dataclass
+class DedupStats:
+    claimed: int = 0
+    duplicates: int = 0
+    released: int = 0
+
+    def as_dict(self) -> dict:
+        return dict(
+            claimed=self.claimed,
+            duplicates=self.duplicates,
+            released=self.released,
+        )
+
+
+class DedupStore:
+    """ 이미 처리한(혹은 처리 중인) 이벤트 ID를 기억한다.
+
+    프로세스 안에서는 최근 ``window`` 개를 기억하고, ``session`` 을 주면
+    ``SET NX EX`` 로 같은 그룹의 다른 컨슈머와도 나눠서 본다.
+    처리에 실패하면 ``release`` 해서 다시 받았을 때 처리할 수 있게 한다.
+    """
+
+    def __init__(
+            self,
+            window: int = 100_000,
+            session: Optional[redis.Redis] = None,
+            ttl: int = 86_400,
+            prefix: str = "dedup",
+    ):
+        self._window = window
+        self._session = session
+        self._ttl = ttl
+        self._prefix = prefix
+        self._seen: "OrderedDict[str, None]" = OrderedDict()
+        self.stats = DedupStats()
+
+    def __len__(self):
+        return len(self._seen)
+
+    def key(self, event_id: str) -> str:
+        return f"{self._prefix}:{event_id}"
+
+    async def claim(self, event_id: str) -> bool:
+        """ 처음 보는 ID면 표시하고 True, 이미 본 ID면 False. """
+        if event_id in self._seen:
+            self._seen.move_to_end(event_id)
+            self.stats.duplicates += 1
+            return False
+
+        if self._session is not None:
+            first = await self._session.set(self.key(event_id), 1, nx=True, ex=self._ttl)
+            if not first:
+                self._remember(event_id)
+                self.stats.duplicates += 1
+                return False
+
+        self._remember(event_id)
+        self.stats.claimed += 1
+        return True
+
+    async def release(self, event_id: str):
+        self._seen.pop(event_id, None)
+        if self._session is not None:
+            await self._session.delete(self.key(event_id))
+        self.stats.released += 1
+
+    def _remember(self, event_id: str):
+        self._seen[event_id] = None
+        while len(self._seen) > self._window:
+            self._seen.popitem(last=False)
@@ -1,2 +1,74 @@
+import asyncio
+import smtplib
+from email.message import EmailMessage
+from typing import List, Optional
+
+
 async def send_mail(*args):
     print("SENDING EMAIL:", *args)
+
+
+class SmtpMailer:
+    """ SMTP 연결을 ``pool_size`` 개까지 열어두고 돌려 쓴다.
+
+    smtplib 은 블로킹이라 보내는 일은 스레드에서 한다. 서버가 쉬는 연결을 끊었으면
+    한 번 다시 연결해서 보낸다.
+    """
+
+    def __init__(
+            self,
+            host: str,
+            port: int,
+            sender: str,
+            pool_size: int = 2,
+            timeout: float = 10.0,
+    ):
+        self._host = host
+        self._port = port
+        self._sender = sender
+        self._timeout = timeout
+        self._slots = asyncio.Semaphore(pool_size)
+        self._idle: List[smtplib.SMTP] = []
+
+    async def send(self, to: str, subject: str, body: str):
+        message = EmailMessage()
+        message["From"] = self._sender
+        message["To"] = to
+        message["Subject"] = subject
+        message.set_content(body)
+
+        async with self._slots:
+            conn = self._idle.pop() if self._idle else None
+            conn = await asyncio.to_thread(self._deliver, conn, message)
+            self._idle.append(conn)
+
+    async def close(self):
+        idle, self._idle = self._idle, []
+        for conn in idle:
+            await asyncio.to_thread(self._quit, conn)
+
+    def _deliver(self, conn: Optional[smtplib.SMTP], message: EmailMessage) -> smtplib.SMTP:
+        if conn is not None:
+            try:
+                conn.send_message(message)
+                return conn
+            except smtplib.SMTPServerDisconnected:
+                pass
+            except Exception:
+                self._quit(conn)
+                raise
+
+        conn = smtplib.SMTP(self._host, self._port, timeout=self._timeout)
+        try:
+            conn.send_message(message)
+        except Exception:
+            self._quit(conn)
+            raise
+        return conn
+
+    @staticmethod
+    def _quit(conn: smtplib.SMTP):
+        try:
+            conn.quit()
+        except (smtplib.SMTPException, OSError):
+            conn.close()
@@ -0,0 +1,94 @@
+""" 발행하는 이벤트를 감싸는 봉투.
+
+    {"id": ..., "type": "Allocated", "schema": 1,
+     "aggregate_version": 7, "occurred_at": 1690000000.123, "data": {...}}
+
+``id`` 는 이벤트마다 한 번 정해지고 다시 보내도 바뀌지 않아서, 받는 쪽은
+이걸로 at-least-once 재전송을 걸러낼 수 있다. ``aggregate_version`` 은
+이벤트를 모아갈 때(``collect_new_events``) 애그리거트의 버전이다.
+메타데이터도 인코딩 결과처럼 인스턴스에 붙여두고 데이터클래스 필드로 만들지 않는다.
+"""
+import time
+import uuid
+from dataclasses import dataclass
+from typing import Optional, Tuple
+
+from pt2.ch12.src.allocation.adapters import codec
+
+
+SCHEMA_VERSION = 1
+
+METADATA_ATTRIBUTE = "_metadata"
+
+
+@dataclass(frozen=True)
+class Metadata:
+    event_id: str
+    type: str
+    occurred_at: float
+    aggregate_version: Optional[int] = None
+    schema: int = SCHEMA_VERSION
+
+
+def stamp(
+        message: codec.Message,
+        aggregate_version: Optional[int] = None,
+) -> Metadata:
+    """ 처음 한 번만 정한다. 이미 붙어있으면 그대로 돌려준다. """
+    metadata = message.__dict__.get(METADATA_ATTRIBUTE)
+    if metadata is None:
+        metadata = message.__dict__[METADATA_ATTRIBUTE] = Metadata(
+            event_id=uuid.uuid4().hex,
+            type=type(message).__name__,
+            occurred_at=time.time(),
+            aggregate_version=aggregate_version,
+        )
+    return metadata
+
+
+def wrap(message: codec.Message) -> dict:
+    metadata = stamp(message)
+    return {
+        "id": metadata.event_id,
+        "type": metadata.type,
+        "schema": metadata.schema,
+        "aggregate_version": metadata.aggregate_version,
+        "occurred_at": metadata.occurred_at,
+        "data": codec.to_dict(message),
+    }
+
+
+def encode(message: codec.Message, backend: str = codec.JSON) -> bytes:
+    cache = message.__dict__.get(codec.CACHE_ATTRIBUTE)
+    if cache is None:
+        cache = message.__dict__[codec.CACHE_ATTRIBUTE] = {}
+
+    key = f"envelope:{backend}"
+    encoded = cache.get(key)
+    if encoded is None:
+        encoded = cache[key] = codec.get_backend(backend).dumps(wrap(message))
+    return encoded
+
+
+def unwrap(data: dict) -> Tuple[Optional[Metadata], dict]:
+    """ 봉투면 (메타데이터, 본문)을, 외부에서 온 맨 본문이면 (None, 본문)을 돌려준다. """
+    if not isinstance(data, dict) or "id" not in data or "data" not in data:
+        return None, data
+
+    return Metadata(
+        event_id=str(data["id"]),
+        type=data.get("type", ""),
+        occurred_at=data.get("occurred_at", 0.0),
+        aggregate_version=data.get("aggregate_version"),
+        schema=data.get("schema", SCHEMA_VERSION),
+    ), data["data"]
+
+
+def decode(raw, backend: str = codec.JSON) -> codec.Message:
+    metadata, payload = unwrap(codec.get_backend(backend).loads(raw))
+    if metadata is None:
+        raise ValueError("message is not wrapped in an envelope")
+
+    message = codec.from_dict(codec.MESSAGE_TYPES[metadata.type], payload)
+    message.__dict__[METADATA_ATTRIBUTE] = metadata
+    return message
@@ -0,0 +1,296 @@
+import asyncio
+import logging
+from collections import deque
+from dataclasses import dataclass
+from typing import Collection, Deque, Optional, Set
+
+import redis.asyncio as redis
+
+from pt2.ch12.src.allocation.adapters import codec, envelope
+from pt2.ch12.src.allocation.adapters.redis import STREAM_FIELD
+from pt2.ch12.src.allocation.adapters.streams import PubSubConsumer
+from pt2.ch12.src.allocation.domain import events
+
+
+logger = logging.getLogger(__name__)
+
+
+class SlowConsumer(Exception):
+    """ 버퍼가 넘쳐서 구독이 끊겼다. 다시 구독해서 놓친 변경은 조회로 채워야 한다. """
+
+
+@dataclass
+class HubStats:
+    subscribers: int = 0
+    published: int = 0
+    delivered: int = 0
+    dropped_subscribers: int = 0
+
+    def as_dict(self) -> dict:
+        return dict(
+            subscribers=self.subscribers,
+            published=self.published,
+            delivered=self.delivered,
+            dropped_subscribers=self.dropped_subscribers,
+        )
+
+
+@dataclass
+class FeedStats:
+    broadcast: int = 0
+    dropped: int = 0
+    failed: int = 0
+    received: int = 0
+    invalid: int = 0
+    reconnects: int = 0
+
+    def as_dict(self) -> dict:
+        return dict(
+            broadcast=self.broadcast,
+            dropped=self.dropped,
+            failed=self.failed,
+            received=self.received,
+            invalid=self.invalid,
+            reconnects=self.reconnects,
+        )
+
+
+class Subscription:
+    """ 구독자 하나의 버퍼. ``skus`` / ``orderids`` 를 주면 그에 해당하는 이벤트만 받는다. """
+
+    def __init__(
+            self,
+            hub: "EventHub",
+            buffer_size: int,
+            skus: Optional[Collection[str]] = None,
+            orderids: Optional[Collection[str]] = None,
+    ):
+        self._hub = hub
+        self._buffer_size = buffer_size
+        self._skus = frozenset(skus) if skus else None
+        self._orderids = frozenset(orderids) if orderids else None
+        self._events: Deque[events.Event] = deque()
+        self._ready = asyncio.Event()
+        self.dropped = False
+
+    def __len__(self):
+        return len(self._events)
+
+    def matches(self, event: events.Event) -> bool:
+        if self._skus is not None and event.sku not in self._skus:
+            return False
+        if self._orderids is not None:
+            # OutOfStock 처럼 주문이 없는 이벤트는 주문으로 거를 때 보내지 않는다
+            return getattr(event, "orderid", None) in self._orderids
+        return True
+
+    def put(self, event: events.Event) -> bool:
+        """ 버퍼가 가득 차면 받지 않고 구독을 끊는다. """
+        if len(self._events) >= self._buffer_size:
+            self._events.clear()
+            self.dropped = True
+            self._ready.set()
+            return False
+
+        self._events.append(event)
+        self._ready.set()
+        return True
+
+    async def get(self, timeout: Optional[float] = None) -> Optional[events.Event]:
+        """ 다음 이벤트. ``timeout`` 동안 아무것도 없으면 None. """
+        while not self._events:
+            if self.dropped:
+                raise SlowConsumer("subscriber fell behind and was dropped")
+            try:
+                await asyncio.wait_for(self._ready.wait(), timeout=timeout)
+            except asyncio.TimeoutError:
+                return None
+            self._ready.clear()
+        return self._events.popleft()
+
+    def close(self):
+        self._hub.unsubscribe(self)
+
+
+class EventHub:
+    """ 할당 이벤트를 프로세스 안의 구독자(SSE 연결)에게 나눠준다.
+
+    ``publish`` 는 기다리지 않는다. 구독자마다 ``buffer_size`` 개까지 쌓아두고,
+    그보다 뒤처진 구독자는 끊어서 다른 구독자와 메시지 버스를 붙잡지 않게 한다.
+    """
+
+    def __init__(self, buffer_size: int = 1_000):
+        self._buffer_size = buffer_size
+        self._subscriptions: Set[Subscription] = set()
+        self.stats = HubStats()
+
+    def __len__(self):
+        return len(self._subscriptions)
+
+    def subscribe(
+            self,
+            skus: Optional[Collection[str]] = None,
+            orderids: Optional[Collection[str]] = None,
+    ) -> Subscription:
+        subscription = Subscription(self, self._buffer_size, skus=skus, orderids=orderids)
+        self._subscriptions.add(subscription)
+        self.stats.subscribers = len(self._subscriptions)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        self._subscriptions.discard(subscription)
+        self.stats.subscribers = len(self._subscriptions)
+
+    def publish(self, event: events.Event) -> int:
+        """ 이벤트를 받은 구독자 수를 돌려준다. """
+        self.stats.published += 1
+        delivered = 0
+        for subscription in list(self._subscriptions):
+            if not subscription.matches(event):
+                continue
+            if subscription.put(event):
+                delivered += 1
+            else:
+                logger.warning(f'Dropping slow event stream subscriber... buffered: {self._buffer_size}')
+                self.unsubscribe(subscription)
+                self.stats.dropped_subscribers += 1
+        self.stats.delivered += delivered
+        return delivered
+
+
+class BrokerFeed:
+    """ 할당 이벤트를 pub/sub 채널 하나로 모든 프로세스에 퍼뜨리고, 받은 것을 이 프로세스의 허브에 넣는다.
+
+    API 워커와 컨슈머가 모두 ``broadcast`` 로 보내므로 어느 프로세스의 변경이든 모든 API
+    프로세스의 구독자가 받는다. 자기 프로세스의 이벤트도 채널을 거쳐서 한 번만 허브에 들어간다.
+    SSE 는 끊기면 조회로 채우는 용도라 ACK 가 있는 스트림 대신 pub/sub 을 쓴다.
+    구독이 끊기면 ``retry_interval`` 뒤에 다시 구독한다.
+
+    ``broadcast`` 는 기다리지 않는다. ``max_pending`` 크기의 큐에 넣고, 보내는 태스크가
+    ``batch_size`` 개씩 파이프라인으로 묶어 ``publish_timeout`` 안에 보낸다.
+    큐가 가득 차거나 보내다 실패한 변경은 버리고 센다. ``relay=False`` 면 받지 않고 보내기만 한다.
+    """
+
+    CHANNEL = "allocation_changes"
+
+    def __init__(
+            self,
+            hub: EventHub,
+            session: redis.Redis,
+            codec_name: str = codec.JSON,
+            batch_size: int = 100,
+            block_ms: int = 1000,
+            retry_interval: float = 1.0,
+            publish_timeout: float = 0.5,
+            max_pending: int = 10_000,
+            drain_timeout: float = 5.0,
+            relay: bool = True,
+    ):
+        self._hub = hub
+        self._session = session
+        self._codec = codec_name
+        self._batch_size = batch_size
+        self._block_ms = block_ms
+        self._retry_interval = retry_interval
+        self._publish_timeout = publish_timeout
+        self._drain_timeout = drain_timeout
+        self._relay_enabled = relay
+        self._outbox: asyncio.Queue = asyncio.Queue(maxsize=max_pending)
+        self._task: Optional[asyncio.Task] = None
+        self._sender: Optional[asyncio.Task] = None
+        self.stats = FeedStats()
+
+    def broadcast(self, event: events.Event) -> bool:
+        """ 보낼 큐에 넣었으면 True. """
+        try:
+            self._outbox.put_nowait(envelope.encode(event, self._codec))
+        except asyncio.QueueFull:
+            self.stats.dropped += 1
+            logger.warning(f'Dropping event feed change... pending: {self._outbox.qsize()}')
+            return False
+        return True
+
+    async def start(self):
+        if self._sender is None:
+            self._sender = asyncio.create_task(self._send())
+        if self._relay_enabled and self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._sender is not None:
+            try:
+                await asyncio.wait_for(self._outbox.join(), timeout=self._drain_timeout)
+            except asyncio.TimeoutError:
+                logger.warning(f'Giving up on {self._outbox.qsize()} event feed changes')
+            self._sender.cancel()
+            try:
+                await self._sender
+            except asyncio.CancelledError:
+                pass
+            self._sender = None
+
+    async def _send(self):
+        while True:
+            payloads = [await self._outbox.get()]
+            while len(payloads) < self._batch_size and not self._outbox.empty():
+                payloads.append(self._outbox.get_nowait())
+            try:
+                await asyncio.wait_for(self._publish(payloads), timeout=self._publish_timeout)
+                self.stats.broadcast += len(payloads)
+            except asyncio.CancelledError:
+                raise
+            except Exception as ex:
+                self.stats.failed += len(payloads)
+                logger.warning(f'Exception broadcasting event feed changes... changes: {len(payloads)}, detail: {ex!r}')
+            finally:
+                for _ in payloads:
+                    self._outbox.task_done()
+
+    async def _publish(self, payloads):
+        async with self._session.pipeline(transaction=False) as pipe:
+            for payload in payloads:
+                pipe.publish(self.CHANNEL, payload)
+            await pipe.execute()
+
+    async def _run(self):
+        while True:
+            consumer = PubSubConsumer(
+                self._session,
+                channels=[self.CHANNEL],
+                consumer="event-hub",
+                batch_size=self._batch_size,
+                block_ms=self._block_ms,
+            )
+            try:
+                await consumer.start()
+                while True:
+                    for message in await consumer.read():
+                        self._relay(message.fields[STREAM_FIELD])
+            except asyncio.CancelledError:
+                raise
+            except Exception as ex:
+                self.stats.reconnects += 1
+                logger.warning(f'Exception reading event feed, retrying... detail: {ex}')
+            finally:
+                try:
+                    await consumer.close()
+                except Exception:
+                    pass
+            await asyncio.sleep(self._retry_interval)
+
+    def _relay(self, raw):
+        self.stats.received += 1
+        try:
+            event = envelope.decode(raw, self._codec)
+        except (KeyError, TypeError, ValueError) as ex:
+            self.stats.invalid += 1
+            logger.warning(f'Dropping event feed message... detail: {ex}')
+            return
+        self._hub.publish(event)
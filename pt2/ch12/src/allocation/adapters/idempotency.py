@@ -0,0 +1,257 @@
+import asyncio
+import hashlib
+import json
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+from sqlalchemy import and_, delete, insert, select, update
+from sqlalchemy.exc import IntegrityError
+
+from pt2.ch12.src.allocation.adapters.orm import idempotency_keys
+
+
+class IdempotencyConflict(Exception):
+    """ 같은 키로 다른 요청 본문이 들어왔다. """
+
+
+class IdempotencyInProgress(Exception):
+    """ 다른 프로세스가 같은 키의 요청을 아직 처리하고 있다. """
+
+
+@dataclass(frozen=True)
+class StoredResponse:
+    status_code: int
+    body: Any
+    headers: Dict[str, str] = field(default_factory=dict)
+
+
+@dataclass
+class IdempotencyStats:
+    executions: int = 0
+    replays: int = 0
+    coalesced: int = 0
+    conflicts: int = 0
+    evictions: int = 0
+    expirations: int = 0
+
+    def as_dict(self) -> dict:
+        return dict(
+            executions=self.executions,
+            replays=self.replays,
+            coalesced=self.coalesced,
+            conflicts=self.conflicts,
+            evictions=self.evictions,
+            expirations=self.expirations,
+        )
+
+
+def fingerprint(payload: Any) -> str:
+    return hashlib.sha256(json.dumps(payload, sort_keys=True, default=str).encode()).hexdigest()
+
+
+class IdempotencyStore:
+    """ ``Idempotency-Key`` 별로 처음 실행한 응답을 ``ttl`` 동안 기억한다.
+
+    프로세스 안에서는 최근 ``maxsize`` 개를 LRU 로 들고 있고, 같은 키로 동시에
+    들어온 요청은 한 번만 실행해서 결과를 나눠 준다(single-flight).
+    ``session_factory`` 를 주면 ``idempotency_keys`` 테이블에 먼저 키를 예약해서
+    다른 프로세스와도 한 번만 실행되게 한다. 예약하고 ``lock_timeout`` 이 지나도
+    응답이 없으면 그 프로세스가 죽은 것으로 보고 새로 예약한다.
+    5xx 응답은 기억하지 않고 다시 실행하게 둔다.
+    """
+
+    def __init__(
+            self,
+            maxsize: int = 10_000,
+            ttl: float = 86_400.0,
+            session_factory=None,
+            lock_timeout: float = 60.0,
+            purge_interval: float = 60.0,
+            clock: Callable[[], float] = time.time,
+    ):
+        self._maxsize = maxsize
+        self._ttl = ttl
+        self._session_factory = session_factory
+        self._lock_timeout = lock_timeout
+        self._purge_interval = purge_interval
+        self._clock = clock
+        self._purged_at = clock()
+        self._entries: "OrderedDict[str, Tuple[float, str, StoredResponse]]" = OrderedDict()
+        self._inflight: Dict[str, Tuple[str, asyncio.Future]] = {}
+        self.stats = IdempotencyStats()
+
+    def __len__(self):
+        return len(self._entries)
+
+    async def execute(
+            self,
+            key: str,
+            request_fingerprint: str,
+            run: Callable[[], Awaitable[StoredResponse]],
+    ) -> Tuple[StoredResponse, bool]:
+        """ 응답과, 저장해둔 응답을 다시 돌려준 것인지 여부를 돌려준다. """
+        stored = self._lookup(key, request_fingerprint)
+        if stored is not None:
+            self.stats.replays += 1
+            return stored, True
+
+        inflight = self._inflight.get(key)
+        if inflight is not None:
+            self._check(inflight[0], request_fingerprint)
+            self.stats.coalesced += 1
+            return await asyncio.shield(inflight[1]), True
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = (request_fingerprint, future)
+        try:
+            response, replayed = await self._execute_once(key, request_fingerprint, run)
+        except BaseException as e:
+            if isinstance(e, asyncio.CancelledError):
+                future.cancel()
+            else:
+                future.set_exception(e)
+                future.exception()
+            raise
+        else:
+            future.set_result(response)
+            if response.status_code < 500:
+                self._put(key, request_fingerprint, response)
+            return response, replayed
+        finally:
+            del self._inflight[key]
+
+    async def _execute_once(
+            self,
+            key: str,
+            request_fingerprint: str,
+            run: Callable[[], Awaitable[StoredResponse]],
+    ) -> Tuple[StoredResponse, bool]:
+        if self._session_factory is None:
+            self.stats.executions += 1
+            return await run(), False
+
+        await self._purge_if_due()
+        stored = await self._reserve(key, request_fingerprint)
+        if stored is not None:
+            self.stats.replays += 1
+            return stored, True
+
+        self.stats.executions += 1
+        try:
+            response = await run()
+        except BaseException:
+            await self._release(key)
+            raise
+        if response.status_code >= 500:
+            await self._release(key)
+        else:
+            await self._save(key, response)
+        return response, False
+
+    def _lookup(self, key: str, request_fingerprint: str) -> Optional[StoredResponse]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+
+        expires_at, stored_fingerprint, response = entry
+        if expires_at <= self._clock():
+            del self._entries[key]
+            self.stats.expirations += 1
+            return None
+        self._check(stored_fingerprint, request_fingerprint)
+        self._entries.move_to_end(key)
+        return response
+
+    def _check(self, stored_fingerprint: str, request_fingerprint: str):
+        if stored_fingerprint != request_fingerprint:
+            self.stats.conflicts += 1
+            raise IdempotencyConflict("Idempotency-Key was already used with a different request")
+
+    def _put(self, key: str, request_fingerprint: str, response: StoredResponse):
+        self._entries[key] = (self._clock() + self._ttl, request_fingerprint, response)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self._maxsize:
+            self._entries.popitem(last=False)
+            self.stats.evictions += 1
+
+    async def _reserve(self, key: str, request_fingerprint: str) -> Optional[StoredResponse]:
+        """ 키를 예약한다. 이미 끝난 요청이면 그 응답을, 처음이면 None 을 돌려준다. """
+        now = self._clock()
+        async with self._session_factory() as session:
+            await session.execute(
+                delete(idempotency_keys).where(and_(
+                    idempotency_keys.c.key == key,
+                    idempotency_keys.c.expires_at <= now,
+                ))
+            )
+            try:
+                await session.execute(
+                    insert(idempotency_keys).values(
+                        key=key,
+                        fingerprint=request_fingerprint,
+                        created_at=now,
+                        expires_at=now + self._ttl,
+                    )
+                )
+                await session.commit()
+                return None
+            except IntegrityError:
+                await session.rollback()
+
+            row = (await session.execute(
+                select(idempotency_keys).where(idempotency_keys.c.key == key)
+            )).first()
+
+        if row is None:
+            # 그 사이에 만료돼서 지워졌다. 다시 예약한다
+            return await self._reserve(key, request_fingerprint)
+        self._check(row.fingerprint, request_fingerprint)
+        if row.status_code is None:
+            if now - row.created_at < self._lock_timeout:
+                raise IdempotencyInProgress(f"request with Idempotency-Key {key} is still running")
+            await self._release(key, reserved_at=row.created_at)
+            return await self._reserve(key, request_fingerprint)
+
+        response = StoredResponse(row.status_code, json.loads(row.body), json.loads(row.headers))
+        self._put(key, request_fingerprint, response)
+        return response
+
+    async def _save(self, key: str, response: StoredResponse):
+        async with self._session_factory() as session:
+            await session.execute(
+                update(idempotency_keys)
+                .where(idempotency_keys.c.key == key)
+                .values(
+                    status_code=response.status_code,
+                    body=json.dumps(response.body),
+                    headers=json.dumps(response.headers),
+                )
+            )
+            await session.commit()
+
+    async def _release(self, key: str, reserved_at: Optional[float] = None):
+        condition = idempotency_keys.c.key == key
+        if reserved_at is not None:
+            # 다른 프로세스가 먼저 새로 예약했으면 건드리지 않는다
+            condition = and_(
+                condition,
+                idempotency_keys.c.status_code.is_(None),
+                idempotency_keys.c.created_at == reserved_at,
+            )
+        async with self._session_factory() as session:
+            await session.execute(delete(idempotency_keys).where(condition))
+            await session.commit()
+
+    async def _purge_if_due(self):
+        now = self._clock()
+        if now - self._purged_at < self._purge_interval:
+            return
+
+        self._purged_at = now
+        async with self._session_factory() as session:
+            await session.execute(
+                delete(idempotency_keys).where(idempotency_keys.c.expires_at <= now)
+            )
+            await session.commit()
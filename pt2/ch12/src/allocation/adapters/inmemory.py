@@ -0,0 +1,531 @@
+import asyncio
+import bisect
+import time
+from collections import OrderedDict, defaultdict
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List, Optional, Set, Tuple
+
+from redis.exceptions import ResponseError
+
+
+StreamId = Tuple[int, int]
+StreamEntry = Tuple[str, Dict[str, str]]
+
+
+def as_str(value) -> str:
+    # decode_responses=True 인 커넥션처럼 바이트도 문자열로 돌려준다
+    return value.decode() if isinstance(value, bytes) else str(value)
+
+
+def parse_stream_id(value: str) -> StreamId:
+    ms, _, seq = value.partition("-")
+    return int(ms), int(seq or 0)
+
+
+def format_stream_id(value: StreamId) -> str:
+    return f"{value[0]}-{value[1]}"
+
+
+@dataclass
+class PendingEntry:
+    consumer: str
+    delivered_at: float
+    deliveries: int = 1
+
+
+@dataclass
+class ConsumerGroup:
+    last_delivered: StreamId
+    pending: "OrderedDict[StreamId, PendingEntry]" = field(default_factory=OrderedDict)
+
+
+@dataclass
+class Stream:
+    entries: "OrderedDict[StreamId, Dict[str, str]]" = field(default_factory=OrderedDict)
+    # 항목 ID 를 순서대로. 앞의 ``head`` 개는 잘려나간 것이라 가끔 한꺼번에 지운다
+    ids: List[StreamId] = field(default_factory=list)
+    head: int = 0
+    last_id: StreamId = (0, 0)
+    groups: Dict[str, ConsumerGroup] = field(default_factory=dict)
+
+    def append(self, entry_id: StreamId, fields: Dict[str, str]):
+        self.entries[entry_id] = fields
+        self.ids.append(entry_id)
+        self.last_id = entry_id
+
+    def trim(self, maxlen: int):
+        while len(self.entries) > maxlen:
+            self.entries.popitem(last=False)
+            self.head += 1
+        if self.head > len(self.ids) // 2:
+            del self.ids[:self.head]
+            self.head = 0
+
+    def after(self, entry_id: StreamId, count: Optional[int]) -> List[StreamId]:
+        """ ``entry_id`` 보다 뒤의 항목 ID 를 ``count`` 개까지. 이진 탐색으로 시작점을 찾는다. """
+        start = bisect.bisect_right(self.ids, entry_id, lo=self.head)
+        end = start + count if count is not None else len(self.ids)
+        return self.ids[start:end]
+
+
+class InMemoryPubSub:
+    """ ``redis.asyncio.client.PubSub`` 의 프로세스 내 구현체.
+
+    구독자마다 ``buffer_size`` 만큼의 큐를 갖는다. 레디스는 출력 버퍼가 넘친
+    구독자의 연결을 끊지만, 여기서는 가장 오래된 메시지를 버리고 ``dropped`` 를 센다.
+    """
+
+    def __init__(self, broker: "InMemoryRedis", buffer_size: int):
+        self._broker = broker
+        self._queue: "asyncio.Queue[dict]" = asyncio.Queue(maxsize=buffer_size)
+        self.channels: Set[str] = set()
+        self.dropped = 0
+
+    async def subscribe(self, *channels: str):
+        for channel in channels:
+            self.channels.add(channel)
+            self._broker._subscribers[channel].add(self)
+            self.put(self._control("subscribe", channel))
+
+    async def unsubscribe(self, *channels: str):
+        for channel in channels or list(self.channels):
+            self.channels.discard(channel)
+            self._broker._subscribers[channel].discard(self)
+            self.put(self._control("unsubscribe", channel))
+
+    async def get_message(
+            self,
+            ignore_subscribe_messages: bool = False,
+            timeout: float = 0.0,
+    ) -> Optional[dict]:
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while True:
+            try:
+                message = self._queue.get_nowait()
+            except asyncio.QueueEmpty:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    return None
+                try:
+                    message = await asyncio.wait_for(self._queue.get(), timeout=remaining)
+                except asyncio.TimeoutError:
+                    return None
+
+            if ignore_subscribe_messages and message["type"] != "message":
+                continue
+            return message
+
+    async def close(self):
+        await self.unsubscribe()
+        while not self._queue.empty():
+            self._queue.get_nowait()
+
+    def put(self, message: dict):
+        if self._queue.full():
+            self._queue.get_nowait()
+            self.dropped += 1
+            self._broker.dropped += 1
+        self._queue.put_nowait(message)
+
+    def _control(self, kind: str, channel: str) -> dict:
+        return {"type": kind, "pattern": None, "channel": channel, "data": len(self.channels)}
+
+
+class InMemoryRedis:
+    """ 로컬 개발/테스트용으로 redis.asyncio.Redis 대신 쓰는 프로세스 내 구현체.
+
+    앱에서 실제로 쓰는 명령만 흉내낸다. ``decode_responses=True`` 로
+    만든 커넥션처럼 문자열을 돌려준다. ``latency`` 를 주면 명령(파이프라인은
+    ``execute`` 한 번)마다 그만큼 기다려서 네트워크 왕복을 흉내낸다.
+    스트림은 컨슈머 그룹(XREADGROUP/XACK/XAUTOCLAIM)까지, pub/sub 은
+    구독자별로 크기가 정해진 큐에 나눠 넣는 식으로 흉내낸다.
+    """
+
+    def __init__(
+            self,
+            latency: float = 0.0,
+            clock: Callable[[], float] = time.monotonic,
+            pubsub_buffer: int = 10_000,
+    ):
+        self._latency = latency
+        self._clock = clock
+        self._pubsub_buffer = pubsub_buffer
+        self._subscribers: Dict[str, Set[InMemoryPubSub]] = defaultdict(set)
+        # 버퍼가 넘쳐서 구독자가 받지 못한 메시지 수
+        self.dropped = 0
+        self._pipelined = False
+        self._hashes: Dict[str, Dict[str, str]] = defaultdict(dict)
+        # 값과 만료 시각(clock 기준, 없으면 None)
+        self._strings: Dict[str, Tuple[str, Optional[float]]] = {}
+        self._streams: Dict[str, Stream] = {}
+        self._stream_waiters: List[asyncio.Future] = []
+
+    def pipeline(self, transaction: bool = True) -> "InMemoryPipeline":
+        return InMemoryPipeline(self)
+
+    def pubsub(self) -> InMemoryPubSub:
+        return InMemoryPubSub(self, self._pubsub_buffer)
+
+    async def round_trip(self):
+        if self._latency and not self._pipelined:
+            await asyncio.sleep(self._latency)
+
+    async def hset(
+            self,
+            name: str,
+            key: Optional[str] = None,
+            value: Optional[str] = None,
+            mapping: Optional[dict] = None,
+    ) -> int:
+        await self.round_trip()
+        items = dict(mapping or {})
+        if key is not None:
+            items[key] = value
+
+        created = 0
+        for field, val in items.items():
+            if field not in self._hashes[name]:
+                created += 1
+            self._hashes[name][field] = as_str(val)
+        return created
+
+    async def hget(self, name: str, key: str) -> Optional[str]:
+        await self.round_trip()
+        return self._hashes.get(name, {}).get(key)
+
+    async def hgetall(self, name: str) -> Dict[str, str]:
+        await self.round_trip()
+        return dict(self._hashes.get(name, {}))
+
+    async def hdel(self, name: str, *keys: str) -> int:
+        await self.round_trip()
+        fields = self._hashes.get(name)
+        if fields is None:
+            return 0
+
+        removed = sum(1 for key in keys if fields.pop(key, None) is not None)
+        if not fields:
+            del self._hashes[name]
+        return removed
+
+    async def set(
+            self,
+            name: str,
+            value,
+            ex: Optional[int] = None,
+            nx: bool = False,
+    ) -> Optional[bool]:
+        await self.round_trip()
+        if nx and self._get_string(name) is not None:
+            return None
+
+        expires_at = self._clock() + ex if ex is not None else None
+        self._strings[name] = (as_str(value), expires_at)
+        return True
+
+    async def get(self, name: str) -> Optional[str]:
+        await self.round_trip()
+        return self._get_string(name)
+
+    async def incr(self, name: str, amount: int = 1) -> int:
+        await self.round_trip()
+        value = int(self._get_string(name) or 0) + amount
+        entry = self._strings.get(name)
+        # INCR 은 만료 시각을 그대로 둔다
+        self._strings[name] = (str(value), entry[1] if entry is not None else None)
+        return value
+
+    async def delete(self, *names: str) -> int:
+        await self.round_trip()
+        return sum(
+            1 for name in names
+            if self._hashes.pop(name, None) is not None
+            or self._strings.pop(name, None) is not None
+        )
+
+    async def publish(self, channel: str, message) -> int:
+        await self.round_trip()
+        subscribers = self._subscribers.get(channel, ())
+        data = as_str(message)
+        for subscriber in subscribers:
+            subscriber.put({"type": "message", "pattern": None, "channel": channel, "data": data})
+        return len(subscribers)
+
+    async def xadd(
+            self,
+            name: str,
+            fields: Dict[str, str],
+            id: str = "*",
+            maxlen: Optional[int] = None,
+            approximate: bool = True,
+    ) -> str:
+        await self.round_trip()
+        stream = self._streams.setdefault(name, Stream())
+        if id == "*":
+            now = int(time.time() * 1000)
+            last_ms, last_seq = stream.last_id
+            entry_id = (now, 0) if now > last_ms else (last_ms, last_seq + 1)
+        else:
+            entry_id = parse_stream_id(id)
+            if entry_id <= stream.last_id:
+                raise ResponseError("ERR The ID specified in XADD is equal or smaller than the target stream top item")
+
+        stream.append(entry_id, {key: as_str(value) for key, value in fields.items()})
+        # approximate 여부와 상관없이 정확히 잘라낸다
+        if maxlen is not None:
+            stream.trim(maxlen)
+
+        waiters, self._stream_waiters = self._stream_waiters, []
+        for waiter in waiters:
+            if not waiter.done():
+                waiter.set_result(None)
+        return format_stream_id(entry_id)
+
+    async def xlen(self, name: str) -> int:
+        await self.round_trip()
+        stream = self._streams.get(name)
+        return len(stream.entries) if stream else 0
+
+    async def xgroup_create(
+            self,
+            name: str,
+            groupname: str,
+            id: str = "$",
+            mkstream: bool = False,
+    ) -> bool:
+        await self.round_trip()
+        stream = self._streams.get(name)
+        if stream is None:
+            if not mkstream:
+                raise ResponseError("ERR The XGROUP subcommand requires the key to exist")
+            stream = self._streams[name] = Stream()
+        if groupname in stream.groups:
+            raise ResponseError("BUSYGROUP Consumer Group name already exists")
+
+        start = stream.last_id if id == "$" else parse_stream_id(id)
+        stream.groups[groupname] = ConsumerGroup(last_delivered=start)
+        return True
+
+    async def xreadgroup(
+            self,
+            groupname: str,
+            consumername: str,
+            streams: Dict[str, str],
+            count: Optional[int] = None,
+            block: Optional[int] = None,
+            noack: bool = False,
+    ) -> List[Tuple[str, List[StreamEntry]]]:
+        """ ``block`` 이 None 이면 기다리지 않고, 0 이면 레디스처럼 새 항목이 올 때까지 기다린다. """
+        await self.round_trip()
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + block / 1000 if block else None
+        while True:
+            found = self._read_group(groupname, consumername, streams, count, noack)
+            if found or block is None:
+                return found
+            remaining = deadline - loop.time() if deadline is not None else None
+            if remaining is not None and remaining <= 0:
+                return found
+
+            waiter = loop.create_future()
+            self._stream_waiters.append(waiter)
+            try:
+                await asyncio.wait_for(waiter, timeout=remaining)
+            except asyncio.TimeoutError:
+                pass
+
+    async def xack(self, name: str, groupname: str, *ids: str) -> int:
+        await self.round_trip()
+        group = self._group(name, groupname)
+        return sum(
+            1 for entry_id in ids
+            if group.pending.pop(parse_stream_id(entry_id), None) is not None
+        )
+
+    async def xpending_range(
+            self,
+            name: str,
+            groupname: str,
+            min: str,
+            max: str,
+            count: int,
+            consumername: Optional[str] = None,
+    ) -> List[dict]:
+        await self.round_trip()
+        group = self._group(name, groupname)
+        now = self._clock()
+        low = parse_stream_id(min) if min != "-" else (0, 0)
+        high = parse_stream_id(max) if max != "+" else None
+        found = []
+        for entry_id, pending in group.pending.items():
+            if len(found) >= count:
+                break
+            if entry_id < low or (high is not None and entry_id > high):
+                continue
+            if consumername is not None and pending.consumer != consumername:
+                continue
+            found.append({
+                "message_id": format_stream_id(entry_id),
+                "consumer": pending.consumer,
+                "time_since_delivered": int((now - pending.delivered_at) * 1000),
+                "times_delivered": pending.deliveries,
+            })
+        return found
+
+    async def xclaim(
+            self,
+            name: str,
+            groupname: str,
+            consumername: str,
+            min_idle_time: int,
+            message_ids: List[str],
+    ) -> List[StreamEntry]:
+        await self.round_trip()
+        stream = self._streams[name]
+        group = self._group(name, groupname)
+        now = self._clock()
+        claimed: List[StreamEntry] = []
+        for message_id in message_ids:
+            entry_id = parse_stream_id(message_id)
+            pending = group.pending.get(entry_id)
+            if pending is None or (now - pending.delivered_at) * 1000 < min_idle_time:
+                continue
+            if entry_id not in stream.entries:
+                del group.pending[entry_id]
+                continue
+            pending.consumer = consumername
+            pending.delivered_at = now
+            pending.deliveries += 1
+            claimed.append((format_stream_id(entry_id), dict(stream.entries[entry_id])))
+        return claimed
+
+    async def xautoclaim(
+            self,
+            name: str,
+            groupname: str,
+            consumername: str,
+            min_idle_time: int,
+            start_id: str = "0-0",
+            count: Optional[int] = None,
+    ) -> list:
+        await self.round_trip()
+        stream = self._streams[name]
+        group = self._group(name, groupname)
+        now = self._clock()
+        start = parse_stream_id(start_id)
+        limit = count or 100
+
+        claimed: List[StreamEntry] = []
+        deleted: List[str] = []
+        next_id = (0, 0)
+        for entry_id in [entry_id for entry_id in group.pending if entry_id >= start]:
+            if len(claimed) + len(deleted) >= limit:
+                next_id = entry_id
+                break
+            pending = group.pending[entry_id]
+            if (now - pending.delivered_at) * 1000 < min_idle_time:
+                continue
+            if entry_id not in stream.entries:
+                # MAXLEN 으로 잘려나간 항목은 PEL 에서도 지운다
+                del group.pending[entry_id]
+                deleted.append(format_stream_id(entry_id))
+                continue
+            pending.consumer = consumername
+            pending.delivered_at = now
+            pending.deliveries += 1
+            claimed.append((format_stream_id(entry_id), dict(stream.entries[entry_id])))
+
+        return [format_stream_id(next_id), claimed, deleted]
+
+    async def close(self):
+        self._hashes.clear()
+        self._strings.clear()
+        self._streams.clear()
+        self._subscribers.clear()
+
+    def _get_string(self, name: str) -> Optional[str]:
+        entry = self._strings.get(name)
+        if entry is None:
+            return None
+        value, expires_at = entry
+        if expires_at is not None and expires_at <= self._clock():
+            del self._strings[name]
+            return None
+        return value
+
+    def _group(self, name: str, groupname: str) -> ConsumerGroup:
+        stream = self._streams.get(name)
+        if stream is None or groupname not in stream.groups:
+            raise ResponseError(f"NOGROUP No such key '{name}' or consumer group '{groupname}'")
+        return stream.groups[groupname]
+
+    def _read_group(
+            self,
+            groupname: str,
+            consumername: str,
+            streams: Dict[str, str],
+            count: Optional[int],
+            noack: bool,
+    ) -> List[Tuple[str, List[StreamEntry]]]:
+        now = self._clock()
+        found = []
+        for name, offset in streams.items():
+            stream = self._streams[name]
+            group = self._group(name, groupname)
+            if offset == ">":
+                entry_ids = stream.after(group.last_delivered, count)
+                if entry_ids:
+                    group.last_delivered = entry_ids[-1]
+                for entry_id in entry_ids if not noack else []:
+                    group.pending[entry_id] = PendingEntry(consumername, now)
+            else:
+                # ">" 가 아니면 이 컨슈머의 PEL 을 다시 읽는다
+                start = parse_stream_id(offset)
+                entry_ids = [
+                    entry_id for entry_id, pending in group.pending.items()
+                    if pending.consumer == consumername and entry_id > start
+                    and entry_id in stream.entries
+                ][:count]
+
+            if entry_ids:
+                found.append(
+                    (name, [(format_stream_id(i), dict(stream.entries[i])) for i in entry_ids])
+                )
+        return found
+
+
+class InMemoryPipeline:
+    """ 명령을 모아뒀다가 ``execute`` 때 한 번의 왕복으로 실행한다. """
+
+    def __init__(self, session: InMemoryRedis):
+        self._session = session
+        self._commands: List[Tuple[Callable, tuple, dict]] = []
+
+    async def __aenter__(self) -> "InMemoryPipeline":
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        self._commands.clear()
+
+    def __len__(self):
+        return len(self._commands)
+
+    def __getattr__(self, name):
+        command = getattr(self._session, name)
+
+        def buffer(*args, **kwargs):
+            self._commands.append((command, args, kwargs))
+            return self
+
+        return buffer
+
+    async def execute(self) -> list:
+        await self._session.round_trip()
+        commands, self._commands = self._commands, []
+        # 명령 안에서는 round_trip 외에 await 할 곳이 없으므로 그동안 다른 태스크가 끼어들지 않는다
+        self._session._pipelined = True
+        try:
+            return [await command(*args, **kwargs) for command, args, kwargs in commands]
+        finally:
+            self._session._pipelined = False
@@ -0,0 +1,156 @@
+import asyncio
+import logging
+import time
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Optional
+
+from pt2.ch12.src.allocation.adapters.email import SmtpMailer
+
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class NotificationStats:
+    received: int = 0
+    suppressed: int = 0
+    digests: int = 0
+    sent: int = 0
+    failed: int = 0
+    dropped: int = 0
+
+    def as_dict(self) -> dict:
+        return dict(
+            received=self.received,
+            suppressed=self.suppressed,
+            digests=self.digests,
+            sent=self.sent,
+            failed=self.failed,
+            dropped=self.dropped,
+        )
+
+
+class OutOfStockNotifier:
+    """ 품절 알림을 모아서 보낸다.
+
+    1. 같은 SKU 는 ``dedup_window`` 동안 한 번만 받는다.
+    2. ``digest_interval`` 마다 그동안 모인 SKU 를 메일 한 통(digest)으로 묶는다.
+    3. digest 는 ``max_queue`` 크기의 큐를 거쳐 ``workers`` 개의 워커가 보낸다.
+       큐가 가득 차면 그 digest 는 버리고 센다.
+
+    ``notify`` 는 기다리지 않으므로 메일 서버가 느려도 메시지 버스를 붙잡지 않는다.
+    """
+
+    def __init__(
+            self,
+            mailer: SmtpMailer,
+            recipient: str,
+            dedup_window: float = 300.0,
+            digest_interval: float = 60.0,
+            workers: int = 2,
+            max_queue: int = 100,
+            drain_timeout: float = 10.0,
+            clock: Callable[[], float] = time.monotonic,
+    ):
+        self._mailer = mailer
+        self._recipient = recipient
+        self._dedup_window = dedup_window
+        self._digest_interval = digest_interval
+        self._workers = workers
+        self._drain_timeout = drain_timeout
+        self._clock = clock
+        self._notified_at: Dict[str, float] = {}
+        self._pending: Dict[str, None] = {}
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=max_queue)
+        self._tasks: List[asyncio.Task] = []
+        self.stats = NotificationStats()
+
+    def __len__(self):
+        return len(self._pending)
+
+    def notify(self, sku: str) -> bool:
+        """ 다음 digest 에 넣었으면 True, 창 안에서 이미 받은 SKU 면 False. """
+        self.stats.received += 1
+        now = self._clock()
+        notified_at = self._notified_at.get(sku)
+        if notified_at is not None and now - notified_at < self._dedup_window:
+            self.stats.suppressed += 1
+            return False
+
+        self._notified_at[sku] = now
+        self._pending[sku] = None
+        return True
+
+    def flush(self) -> Optional[List[str]]:
+        """ 모인 SKU 로 digest 를 만들어 큐에 넣는다. 넣은 SKU 목록을 돌려준다. """
+        self._forget_expired()
+        if not self._pending:
+            return None
+
+        skus, self._pending = list(self._pending), {}
+        try:
+            self._queue.put_nowait(skus)
+        except asyncio.QueueFull:
+            logger.warning(f'Dropping out of stock digest... skus: {len(skus)}')
+            self.stats.dropped += 1
+            return None
+        self.stats.digests += 1
+        return skus
+
+    async def start(self):
+        if not self._tasks:
+            self._tasks = [asyncio.create_task(self._flush_periodically())] + [
+                asyncio.create_task(self._work()) for _ in range(self._workers)
+            ]
+
+    async def close(self):
+        if not self._tasks:
+            return
+
+        # 주기적으로 비우던 태스크를 멈추고 남은 SKU 를 마지막 digest 로 보낸다
+        self._tasks[0].cancel()
+        self.flush()
+        try:
+            await asyncio.wait_for(self._queue.join(), timeout=self._drain_timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f'Giving up on {self._queue.qsize()} out of stock digests')
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def _flush_periodically(self):
+        while True:
+            await asyncio.sleep(self._digest_interval)
+            self.flush()
+
+    async def _work(self):
+        while True:
+            skus = await self._queue.get()
+            try:
+                await self._mailer.send(self._recipient, *self._digest(skus))
+                self.stats.sent += 1
+            except Exception as ex:
+                self.stats.failed += 1
+                logger.exception(f'Exception sending out of stock digest... detail: {ex}')
+            finally:
+                self._queue.task_done()
+
+    @staticmethod
+    def _digest(skus: List[str]):
+        if len(skus) == 1:
+            return f'out of stock for {skus[0]}', f'{skus[0]} is out of stock.'
+        return (
+            f'out of stock for {len(skus)} skus',
+            "These skus are out of stock:\n" + "\n".join(skus),
+        )
+
+    def _forget_expired(self):
+        # 창이 지난 SKU 는 다시 받을 수 있으니 기록을 지워서 맵이 계속 커지지 않게 한다
+        now = self._clock()
+        expired = [
+            sku for sku, notified_at in self._notified_at.items()
+            if now - notified_at >= self._dedup_window
+        ]
+        for sku in expired:
+            del self._notified_at[sku]
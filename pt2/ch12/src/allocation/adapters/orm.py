@@ -4,10 +4,13 @@ from sqlalchemy import (
     Column,
     Date,
     event,
+    Float,
     ForeignKey,
+    Index,
     Integer,
     String,
     Table,
+    Text,
 )
 
 from pt2.ch12.src.allocation.domain import model
@@ -60,6 +63,70 @@ allocations_view = Table(
 )
 
 
+# 주문별 allocations_view 변경 횟수. GET /allocations/{orderid} 의 ETag 로 쓴다
+allocations_view_versions = Table(
+    'allocations_view_versions',
+    metadata,
+    Column('orderid', String(255), primary_key=True),
+    Column('version', Integer, nullable=False),
+)
+
+
+# allocations_view 에 일어난 변경을 순서대로 쌓아두는 로그. GET /changes 가 seq 구간으로 읽는다
+allocation_changes = Table(
+    'allocation_changes',
+    metadata,
+    Column('seq', Integer, primary_key=True, autoincrement=True),
+    Column('op', String(16), nullable=False),
+    Column('orderid', String(255), nullable=False),
+    Column('sku', String(255), nullable=False),
+    Column('batchref', String(255), nullable=True),
+    Column('changed_at', Float, nullable=False),
+)
+
+
+# 프라이머리가 주기적으로 갱신하는 한 줄짜리 테이블. 레플리카에서 읽은 값과 비교해 복제 지연을 잰다
+replication_heartbeat = Table(
+    'replication_heartbeat',
+    metadata,
+    Column('id', Integer, primary_key=True),
+    Column('beat_at', Float, nullable=False),
+)
+
+
+# 비동기로 받아둔 커맨드. 워커가 status 를 pending -> running -> done/failed 로 바꾼다
+command_queue = Table(
+    'command_queue',
+    metadata,
+    Column('id', String(32), primary_key=True),
+    Column('type', String(255), nullable=False),
+    Column('payload', Text, nullable=False),
+    Column('status', String(16), nullable=False),
+    Column('result', Text, nullable=True),
+    Column('error', Text, nullable=True),
+    Column('attempts', Integer, nullable=False, server_default="0"),
+    Column('created_at', Float, nullable=False),
+    Column('updated_at', Float, nullable=False),
+    Column('claimed_at', Float, nullable=True),
+    Index('ix_command_queue_status_created_at', 'status', 'created_at'),
+)
+
+
+# Idempotency-Key 로 받은 요청의 응답. status_code 가 비어 있으면 아직 처리 중이다
+idempotency_keys = Table(
+    'idempotency_keys',
+    metadata,
+    Column('key', String(255), primary_key=True),
+    Column('fingerprint', String(64), nullable=False),
+    Column('status_code', Integer, nullable=True),
+    Column('body', Text, nullable=True),
+    Column('headers', Text, nullable=True),
+    Column('created_at', Float, nullable=False),
+    Column('expires_at', Float, nullable=False),
+    Index('ix_idempotency_keys_expires_at', 'expires_at'),
+)
+
+
 def start_mappers():
     lines_mapper = mapper_registry.map_imperatively(
         model.OrderLine,
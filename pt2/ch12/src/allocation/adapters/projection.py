@@ -0,0 +1,235 @@
+import asyncio
+import logging
+import time
+from dataclasses import dataclass
+from itertools import groupby
+from typing import Callable, Iterable, List, Optional, Tuple
+
+from sqlalchemy import delete, insert, text, tuple_
+
+from pt2.ch12.src.allocation.adapters import cache as read_cache
+from pt2.ch12.src.allocation.adapters.orm import allocation_changes, allocations_view
+
+
+logger = logging.getLogger(__name__)
+
+# SQLite(3.24+)와 PostgreSQL 모두 이 문법의 upsert 를 지원한다
+BUMP_VERSION = text(
+    """
+    INSERT INTO allocations_view_versions (orderid, version)
+    VALUES (:orderid, 1)
+    ON CONFLICT (orderid)
+    DO UPDATE SET version = allocations_view_versions.version + 1
+    """
+)
+
+# Postgres 시퀀스 값은 커밋 순서와 다르게 붙을 수 있다. 늦게 커밋된 작은 seq 를
+# 소비자가 커서 뒤로 건너뛰지 않도록 변경 로그를 쓰는 트랜잭션을 줄 세운다
+LOCK_CHANGES = text("SELECT pg_advisory_xact_lock(7240311)")
+
+INSERT = "insert"
+DELETE = "delete"
+
+SYNC = "sync"
+ASYNC = "async"
+
+
+async def bump_versions(session, orderids: Iterable[str]):
+    """ 주문별 변경 횟수를 올린다. 읽기 모델을 바꾸는 트랜잭션 안에서 불러야 한다. """
+    params = [dict(orderid=orderid) for orderid in sorted(set(orderids))]
+    if params:
+        await session.execute(BUMP_VERSION, params)
+
+
+async def record_changes(session, changes: Iterable[Tuple[str, dict]]):
+    """ 변경(``(INSERT|DELETE, 행)``)을 allocation_changes 에 순서대로 남긴다.
+
+    읽기 모델을 바꾸는 트랜잭션 안에서 불러야 한다.
+    """
+    changed_at = time.time()
+    rows = [
+        dict(
+            op=op,
+            orderid=row["orderid"],
+            sku=row["sku"],
+            batchref=row.get("batchref"),
+            changed_at=changed_at,
+        )
+        for op, row in changes
+    ]
+    if not rows:
+        return
+
+    if session.bind.dialect.name == "postgresql":
+        await session.execute(LOCK_CHANGES)
+    await session.execute(insert(allocation_changes), rows)
+
+
+@dataclass
+class ProjectionStats:
+    flushes: int = 0
+    rows: int = 0
+    last_flush_size: int = 0
+    max_flush_size: int = 0
+    last_lag: float = 0.0
+    max_lag: float = 0.0
+
+    def as_dict(self) -> dict:
+        return dict(
+            flushes=self.flushes,
+            rows=self.rows,
+            last_flush_size=self.last_flush_size,
+            max_flush_size=self.max_flush_size,
+            last_lag=self.last_lag,
+            max_lag=self.max_lag,
+        )
+
+
+class ReadModelWriter:
+    """ allocations_view 변경을 모아뒀다가 여러 행짜리 INSERT/DELETE로 한번에 반영한다.
+
+    - sync: 메시지 버스의 ``handle()`` 이 끝날 때 비운다. 응답 전에 읽기 모델이 갱신된다.
+    - async: 백그라운드 태스크가 ``max_delay`` 마다, 혹은 ``max_batch`` 가 차면 비운다.
+
+    어느 쪽이든 버퍼가 ``max_batch`` 에 닿으면 곧바로 비운다.
+    """
+
+    # SQLite의 바인드 파라미터 개수 제한(999)을 넘지 않도록 구문당 행 수를 나눈다
+    ROWS_PER_STATEMENT = 300
+
+    def __init__(
+            self,
+            session_factory,
+            consistency: str = SYNC,
+            max_batch: int = 1000,
+            max_delay: float = 0.05,
+            cache: Optional[read_cache.AllocationsCache] = None,
+            clock: Callable[[], float] = time.monotonic,
+    ):
+        if consistency not in (SYNC, ASYNC):
+            raise ValueError(f"unknown consistency mode {consistency}")
+
+        self._session_factory = session_factory
+        self._consistency = consistency
+        self._max_batch = max_batch
+        self._max_delay = max_delay
+        self._cache = cache
+        self._clock = clock
+        self._buffer: List[Tuple[str, dict]] = []
+        self._oldest: Optional[float] = None
+        self._lock = asyncio.Lock()
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self.stats = ProjectionStats()
+
+    def __len__(self):
+        return len(self._buffer)
+
+    async def add(self, orderid: str, sku: str, batchref: str):
+        await self._append(INSERT, dict(orderid=orderid, sku=sku, batchref=batchref))
+
+    async def remove(self, orderid: str, sku: str):
+        await self._append(DELETE, dict(orderid=orderid, sku=sku))
+
+    async def after_handle(self):
+        """ 메시지 버스가 한 번의 ``handle()`` 을 마칠 때 부른다.
+
+        커맨드는 이미 커밋됐으므로 비우다 실패해도 올려보내지 않는다.
+        변경은 버퍼에 남아서 다음 flush 에 다시 쓴다.
+        """
+        if self._consistency != SYNC:
+            return
+
+        try:
+            await self.flush()
+        except Exception as ex:
+            logger.exception(f'Exception flushing read model after handle... detail: {ex}')
+
+    async def flush(self):
+        async with self._lock:
+            if not self._buffer:
+                return
+
+            pending, self._buffer = self._buffer, []
+            oldest, self._oldest = self._oldest, None
+            try:
+                await self._write(pending)
+            except Exception:
+                # 다음 flush 에서 다시 시도할 수 있도록 순서를 지켜 되돌린다
+                self._buffer = pending + self._buffer
+                self._oldest = oldest
+                raise
+
+            self._record(len(pending), self._clock() - oldest)
+            if self._cache is not None:
+                for orderid in {row["orderid"] for _, row in pending}:
+                    self._cache.invalidate(orderid)
+
+    async def start(self):
+        if self._consistency == ASYNC and self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+
+    async def _append(self, op: str, row: dict):
+        if self._oldest is None:
+            self._oldest = self._clock()
+        self._buffer.append((op, row))
+
+        if len(self._buffer) >= self._max_batch:
+            if self._task is not None:
+                self._wakeup.set()
+            else:
+                await self.flush()
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self._max_delay)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+
+            try:
+                await self.flush()
+            except Exception as ex:
+                logger.exception(f'Exception flushing read model... detail: {ex}')
+
+    async def _write(self, pending: List[Tuple[str, dict]]):
+        # 같은 종류의 변경이 이어지는 구간끼리 묶어야 INSERT/DELETE 순서가 유지된다
+        async with self._session_factory() as session:
+            for op, run in groupby(pending, key=lambda item: item[0]):
+                rows = [row for _, row in run]
+                for start in range(0, len(rows), self.ROWS_PER_STATEMENT):
+                    chunk = rows[start:start + self.ROWS_PER_STATEMENT]
+                    await session.execute(self._statement(op, chunk))
+            await bump_versions(session, (row["orderid"] for _, row in pending))
+            await record_changes(session, pending)
+            await session.commit()
+
+    @staticmethod
+    def _statement(op: str, rows: List[dict]):
+        if op == INSERT:
+            return insert(allocations_view).values(rows)
+
+        return delete(allocations_view).where(
+            tuple_(allocations_view.c.orderid, allocations_view.c.sku).in_(
+                [(row["orderid"], row["sku"]) for row in rows]
+            )
+        )
+
+    def _record(self, size: int, lag: float):
+        self.stats.flushes += 1
+        self.stats.rows += size
+        self.stats.last_flush_size = size
+        self.stats.max_flush_size = max(self.stats.max_flush_size, size)
+        self.stats.last_lag = lag
+        self.stats.max_lag = max(self.stats.max_lag, lag)
@@ -0,0 +1,154 @@
+import asyncio
+import logging
+from dataclasses import dataclass
+from typing import List, Optional, Tuple
+
+from pt2.ch12.src.allocation.adapters.redis import AsyncRedis
+from pt2.ch12.src.allocation.domain import events
+
+
+logger = logging.getLogger(__name__)
+
+CASCADE = "cascade"
+WINDOW = "window"
+
+
+@dataclass
+class PublisherStats:
+    published: int = 0
+    flushes: int = 0
+    last_flush_size: int = 0
+    max_flush_size: int = 0
+    failures: int = 0
+    dropped: int = 0
+
+    def as_dict(self) -> dict:
+        return dict(
+            published=self.published,
+            flushes=self.flushes,
+            last_flush_size=self.last_flush_size,
+            max_flush_size=self.max_flush_size,
+            failures=self.failures,
+            dropped=self.dropped,
+        )
+
+
+class BatchingPublisher:
+    """ ``AsyncRedis`` 앞에 두고 이벤트를 모아 파이프라인 하나로 보낸다.
+
+    - cascade: 메시지 버스의 ``handle()`` 이 끝날 때 한 번에 보낸다.
+    - window: 백그라운드 태스크가 ``max_delay`` 마다, 혹은 ``max_batch`` 가 차면 보낸다.
+
+    ``publish`` 시그니처가 ``AsyncRedis`` 와 같아서 ``channel`` 의존성 자리에 그대로 넣을 수 있다.
+    버퍼는 ``max_buffer`` 를 넘지 않는다. 가득 차면 보낼 때까지 ``publish`` 가 기다리고,
+    레디스가 계속 실패하면 가장 오래된 이벤트부터 버린다.
+    """
+
+    def __init__(
+            self,
+            channel: AsyncRedis,
+            mode: str = CASCADE,
+            max_batch: int = 500,
+            max_delay: float = 0.005,
+            max_buffer: int = 10_000,
+    ):
+        if mode not in (CASCADE, WINDOW):
+            raise ValueError(f"unknown publish mode {mode}")
+
+        self._channel = channel
+        self._mode = mode
+        self._max_batch = max_batch
+        self._max_delay = max_delay
+        self._max_buffer = max(max_buffer, max_batch)
+        self._buffer: List[Tuple[str, events.Event]] = []
+        self._lock = asyncio.Lock()
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self.stats = PublisherStats()
+
+    def __len__(self):
+        return len(self._buffer)
+
+    async def publish(
+            self,
+            channel,
+            event: events.Event,
+    ):
+        self._buffer.append((channel, event))
+
+        if len(self._buffer) >= self._max_buffer:
+            await self.flush()
+        elif len(self._buffer) >= self._max_batch:
+            if self._task is not None:
+                self._wakeup.set()
+            else:
+                await self.flush()
+
+    async def after_handle(self):
+        """ 메시지 버스가 한 번의 ``handle()`` 을 마칠 때 부른다.
+
+        이벤트 핸들러에서 바로 보낼 때처럼 발행 실패가 커맨드 처리를 실패시키지 않는다.
+        """
+        if self._mode != CASCADE:
+            return
+
+        try:
+            await self.flush()
+        except Exception as ex:
+            logger.exception(f'Exception publishing events... detail: {ex}')
+
+    async def flush(self):
+        async with self._lock:
+            while self._buffer:
+                pending = self._buffer[:self._max_batch]
+                del self._buffer[:self._max_batch]
+                try:
+                    await self._channel.publish_many(pending)
+                except Exception:
+                    self.stats.failures += 1
+                    self._requeue(pending)
+                    raise
+
+                self._record(len(pending))
+
+    async def start(self):
+        if self._mode == WINDOW and self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+
+    def _requeue(self, pending: List[Tuple[str, events.Event]]):
+        # 다음 flush 에서 다시 보내도록 순서를 지켜 되돌리되 버퍼 한도는 지킨다
+        self._buffer = pending + self._buffer
+        overflow = len(self._buffer) - self._max_buffer
+        if overflow > 0:
+            del self._buffer[:overflow]
+            self.stats.dropped += overflow
+            logger.warning(f'Dropped {overflow} events, publish buffer is full')
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self._max_delay)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+
+            try:
+                await self.flush()
+            except Exception as ex:
+                logger.exception(f'Exception publishing events... detail: {ex}')
+
+    def _record(self, size: int):
+        self.stats.flushes += 1
+        self.stats.published += size
+        self.stats.last_flush_size = size
+        self.stats.max_flush_size = max(self.stats.max_flush_size, size)
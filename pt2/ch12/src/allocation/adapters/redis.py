@@ -1,14 +1,36 @@
-import json
-from dataclasses import asdict
-from typing import Union
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple, Union
 
 import redis.asyncio as redis
 from pydantic import RedisDsn
 
+from pt2.ch12.src.allocation.adapters import codec, envelope
+from pt2.ch12.src.allocation.adapters.inmemory import InMemoryRedis
 from pt2.ch12.src.allocation.domain import events
 
 
-async def init_redis_pool(redis_uri: Union[RedisDsn, str]):
+IN_MEMORY_URI = "memory://"
+
+REDIS = "redis"
+MEMORY = "memory"
+
+PUBSUB = "pubsub"
+STREAMS = "streams"
+# 스트림 항목에서 직렬화된 이벤트를 담는 필드 이름
+STREAM_FIELD = "data"
+
+
+async def init_redis_pool(
+        redis_uri: Union[RedisDsn, str],
+        backend: str = REDIS,
+        buffer_size: int = 10_000,
+):
+    if backend == MEMORY or str(redis_uri).startswith(IN_MEMORY_URI):
+        # 단일 노드나 벤치마크에서는 레디스 없이 프로세스 안에서 주고받는다
+        session = InMemoryRedis(pubsub_buffer=buffer_size)
+        yield session
+        await session.close()
+        return
+
     session = redis.from_url(
         redis_uri,
         encoding="utf-8",
@@ -20,15 +42,125 @@ async def init_redis_pool(redis_uri: Union[RedisDsn, str]):
 
 
 class AsyncRedis:
+    """ 이벤트를 레디스로 내보낸다.
+
+    - pubsub: ``PUBLISH`` 로 보낸다. 구독자가 없거나 느리면 메시지는 사라진다.
+    - streams: 채널 이름과 같은 스트림에 ``XADD`` 한다. ``stream_maxlen`` 근처에서
+      오래된 항목부터 잘라내고, 컨슈머 그룹이 읽고 ACK 할 때까지 남아있는다.
+
+    이벤트는 봉투(``envelope``)에 싸서 ``codec`` 백엔드로 한 번만 인코딩한다.
+    """
+
     def __init__(
             self,
             session: redis.Redis,
+            transport: str = PUBSUB,
+            stream_maxlen: int = 100_000,
+            codec_name: str = codec.JSON,
     ):
+        if transport not in (PUBSUB, STREAMS):
+            raise ValueError(f"unknown event transport {transport}")
+        codec.get_backend(codec_name)
+
         self._session = session
+        self._transport = transport
+        self._stream_maxlen = stream_maxlen
+        self._codec = codec_name
+
+    def encode(self, event: events.Event) -> bytes:
+        return envelope.encode(event, self._codec)
 
     async def publish(
             self,
             channel,
             event: events.Event,
     ):
-        await self._session.publish(channel, json.dumps(asdict(event)))
+        await self.publish_raw(channel, self.encode(event))
+
+    async def publish_many(
+            self,
+            messages: Iterable[Tuple[str, events.Event]],
+    ):
+        """ 여러 이벤트를 파이프라인 하나로 보낸다. 왕복은 한 번뿐이다. """
+        await self.publish_raw_many(
+            (channel, self.encode(event)) for channel, event in messages
+        )
+
+    async def publish_raw(self, channel: str, payload: bytes):
+        """ 이미 인코딩된 페이로드를 보낸다(스풀 재전송 등). """
+        await self._send(self._session, channel, payload)
+
+    async def publish_raw_many(self, messages: Iterable[Tuple[str, bytes]]):
+        async with self._session.pipeline(transaction=False) as pipe:
+            for channel, payload in messages:
+                self._send(pipe, channel, payload)
+            await pipe.execute()
+
+    def _send(self, target, channel: str, payload: bytes):
+        if self._transport == STREAMS:
+            return target.xadd(
+                channel,
+                {STREAM_FIELD: payload},
+                maxlen=self._stream_maxlen,
+                approximate=True,
+            )
+
+        return target.publish(channel, payload)
+
+
+class RedisReadModel:
+    """ 주문별 할당 내역을 ``allocations:{orderid}`` 해시(sku -> batchref)로 저장한다.
+
+    바꿀 때마다 ``allocations_version:{orderid}`` 도 같은 트랜잭션(MULTI)에서 올린다.
+    """
+
+    def __init__(
+            self,
+            session: redis.Redis,
+    ):
+        self._session = session
+
+    @staticmethod
+    def key(orderid: str) -> str:
+        return f"allocations:{orderid}"
+
+    @staticmethod
+    def version_key(orderid: str) -> str:
+        return f"allocations_version:{orderid}"
+
+    async def add(self, orderid: str, sku: str, batchref: str):
+        async with self._session.pipeline(transaction=True) as pipe:
+            pipe.hset(self.key(orderid), sku, batchref)
+            pipe.incr(self.version_key(orderid))
+            await pipe.execute()
+
+    async def remove(self, orderid: str, sku: str):
+        async with self._session.pipeline(transaction=True) as pipe:
+            pipe.hdel(self.key(orderid), sku)
+            pipe.incr(self.version_key(orderid))
+            await pipe.execute()
+
+    async def version(self, orderid: str) -> Optional[int]:
+        version = await self._session.get(self.version_key(orderid))
+        return int(version) if version is not None else None
+
+    async def allocations(self, orderid: str) -> List[Dict[str, str]]:
+        return self._rows(await self._session.hgetall(self.key(orderid)))
+
+    async def allocations_many(
+            self,
+            orderids: Sequence[str],
+    ) -> Dict[str, List[Dict[str, str]]]:
+        # 주문마다 HGETALL 을 보내지 않고 파이프라인 하나로 한 번에 왕복한다
+        async with self._session.pipeline(transaction=False) as pipe:
+            for orderid in orderids:
+                pipe.hgetall(self.key(orderid))
+            found = await pipe.execute()
+        return {orderid: self._rows(rows) for orderid, rows in zip(orderids, found)}
+
+    @staticmethod
+    def _rows(rows: Dict[str, str]) -> List[Dict[str, str]]:
+        return [
+            {"batchref": batchref, "sku": sku}
+            for sku, batchref in rows.items()
+        ]
@@ -0,0 +1,106 @@
+import asyncio
+import logging
+import time
+from typing import Callable, Optional
+
+from sqlalchemy import insert, select, update
+
+from pt2.ch12.src.allocation.adapters.orm import replication_heartbeat
+from pt2.ch12.src.allocation.adapters.postgres import AsyncSQLAlchemy
+
+
+logger = logging.getLogger(__name__)
+
+HEARTBEAT_ID = 1
+
+
+class ReplicaLagGuard:
+    """ 레플리카가 충분히 최신인지 판단한다.
+
+    프라이머리의 ``replication_heartbeat`` 에 주기적으로 시각을 기록하고,
+    레플리카에 복제된 값과의 차이를 지연으로 본다. DB 종류와 상관없이 동작하고
+    매 요청마다 재지 않도록 ``check_interval`` 동안 결과를 재사용한다.
+    """
+
+    def __init__(
+            self,
+            primary: AsyncSQLAlchemy,
+            replica: AsyncSQLAlchemy,
+            max_lag: float = 1.0,
+            check_interval: float = 1.0,
+            clock: Callable[[], float] = time.time,
+    ):
+        self._primary = primary
+        self._replica = replica
+        self._max_lag = max_lag
+        self._check_interval = check_interval
+        self._clock = clock
+        self._checked_at: Optional[float] = None
+        self._fresh = False
+        self._task: Optional[asyncio.Task] = None
+        self.lag: Optional[float] = None
+
+    async def beat(self):
+        async with self._primary.session() as session:
+            now = self._clock()
+            result = await session.execute(
+                update(replication_heartbeat)
+                .where(replication_heartbeat.c.id == HEARTBEAT_ID)
+                .values(beat_at=now)
+            )
+            if result.rowcount == 0:
+                await session.execute(
+                    insert(replication_heartbeat)
+                    .values(id=HEARTBEAT_ID, beat_at=now)
+                )
+            await session.commit()
+
+    async def replica_is_fresh(self) -> bool:
+        now = self._clock()
+        if self._checked_at is None or now - self._checked_at >= self._check_interval:
+            self._checked_at = now
+            try:
+                self.lag = await self._measure_lag()
+            except Exception as ex:
+                logger.warning(f'Could not measure replica lag... detail: {ex}')
+                self.lag = None
+            self._fresh = self.lag is not None and self.lag <= self._max_lag
+        return self._fresh
+
+    async def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _measure_lag(self) -> Optional[float]:
+        primary_beat = await self._read_beat(self._primary)
+        replica_beat = await self._read_beat(self._replica)
+        if primary_beat is None or replica_beat is None:
+            return None
+        return max(primary_beat - replica_beat, 0.0)
+
+    @staticmethod
+    async def _read_beat(db: AsyncSQLAlchemy) -> Optional[float]:
+        async with db.session() as session:
+            return (
+                await session.execute(
+                    select(replication_heartbeat.c.beat_at)
+                    .where(replication_heartbeat.c.id == HEARTBEAT_ID)
+                )
+            ).scalar_one_or_none()
+
+    async def _run(self):
+        while True:
+            try:
+                await self.beat()
+            except Exception as ex:
+                logger.exception(f'Exception writing replication heartbeat... detail: {ex}')
+            await asyncio.sleep(self._check_interval)
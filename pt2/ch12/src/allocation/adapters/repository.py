@@ -1,4 +1,4 @@
-from typing import List, Set, Protocol
+from typing import List, Optional, Set, Protocol
 
 from sqlalchemy import select, delete
 from sqlalchemy.ext.asyncio import AsyncSession
@@ -18,6 +18,9 @@ class AbstractRepository(Protocol):
     async def get_by_batchref(self, batchref) -> model.Product:
         raise NotImplementedError
 
+    async def version(self, sku) -> Optional[int]:
+        raise NotImplementedError
+
     async def list(self) -> List[model.Product]:
         raise NotImplementedError
 
@@ -48,6 +51,9 @@ class TrackingRepository:
             self.seen.add(product)
         return product
 
+    async def version(self, sku) -> Optional[int]:
+        return await self._repo.version(sku)
+
     async def list(self) -> List[model.Product]:
         return await self._repo.list()
 
@@ -86,6 +92,7 @@ class SqlAlchemyRepository(AbstractRepository):
                 await self.session.execute(
                     select(model.Product)
                     .join(model.Batch)
+                    .options(selectinload(model.Product.batches))
                     .filter(orm.batches.c.reference == batchref)
                 )
             )
@@ -93,6 +100,15 @@ class SqlAlchemyRepository(AbstractRepository):
             .one_or_none()
         )
 
+    async def version(self, sku: str) -> Optional[int]:
+        """ 애그리거트를 읽지 않고 ``version_number`` 만 본다. 없는 SKU 면 None. """
+        return (
+            await self.session.execute(
+                select(orm.products.c.version_number)
+                .where(orm.products.c.sku == sku)
+            )
+        ).scalar_one_or_none()
+
     async def list(self) -> List[model.Product]:
         return (
             (
@@ -0,0 +1,181 @@
+import asyncio
+import hashlib
+import logging
+import math
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Callable, Iterable, Optional
+
+from sqlalchemy import select
+
+from pt2.ch12.src.allocation.adapters.orm import products
+
+
+logger = logging.getLogger(__name__)
+
+
+class BloomFilter:
+    """ ``capacity`` 개를 넣었을 때 오탐률이 ``error_rate`` 가 되도록 크기를 잡는다. """
+
+    def __init__(self, capacity: int, error_rate: float = 0.01):
+        capacity = max(capacity, 1)
+        self._bits_count = max(8, math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self._hashes = max(1, round(self._bits_count / capacity * math.log(2)))
+        self._bits = bytearray(math.ceil(self._bits_count / 8))
+        self._count = 0
+
+    def __len__(self):
+        return self._count
+
+    def add(self, key: str):
+        for position in self._positions(key):
+            self._bits[position >> 3] |= 1 << (position & 7)
+        self._count += 1
+
+    def __contains__(self, key: str) -> bool:
+        return all(
+            self._bits[position >> 3] & (1 << (position & 7))
+            for position in self._positions(key)
+        )
+
+    def _positions(self, key: str):
+        # 해시 두 개를 섞어서 k 개의 위치를 만든다(Kirsch-Mitzenmacher)
+        digest = hashlib.blake2b(key.encode(), digest_size=16).digest()
+        first = int.from_bytes(digest[:8], "little")
+        second = int.from_bytes(digest[8:], "little") | 1
+        return [(first + i * second) % self._bits_count for i in range(self._hashes)]
+
+
+@dataclass
+class KnownSkuStats:
+    skus: int = 0
+    loads: int = 0
+    passed: int = 0
+    filtered: int = 0
+    discovered: int = 0
+    negative_hits: int = 0
+    misses: int = 0
+
+    def as_dict(self) -> dict:
+        return dict(
+            skus=self.skus,
+            loads=self.loads,
+            passed=self.passed,
+            filtered=self.filtered,
+            discovered=self.discovered,
+            negative_hits=self.negative_hits,
+            misses=self.misses,
+        )
+
+
+class KnownSkus:
+    """ 없는 SKU 를 애그리거트를 읽기 전에 걸러낸다.
+
+    ``products`` 의 SKU 를 블룸 필터에 올려두고, 필터에 있으면 애그리거트를 읽게 한다.
+    필터에 없는 SKU 는 다른 프로세스가 새로 고침 뒤에 만든 것일 수 있으니 ``products`` 에
+    SKU 만 가볍게 물어본다. 있으면 필터에 넣고, 없으면(필터의 오탐이 DB 에서 없던 것도)
+    ``negative_ttl`` 동안 기억해서 다시 묻지 않는다.
+    필터는 ``refresh_interval`` 마다 다시 올려서 지워진 SKU 를 털어낸다.
+    """
+
+    def __init__(
+            self,
+            session_factory,
+            capacity: int = 100_000,
+            error_rate: float = 0.01,
+            refresh_interval: float = 60.0,
+            negative_ttl: float = 5.0,
+            negative_maxsize: int = 10_000,
+            clock: Callable[[], float] = time.monotonic,
+    ):
+        self._session_factory = session_factory
+        self._capacity = capacity
+        self._error_rate = error_rate
+        self._refresh_interval = refresh_interval
+        self._negative_ttl = negative_ttl
+        self._negative_maxsize = negative_maxsize
+        self._clock = clock
+        self._filter: Optional[BloomFilter] = None
+        self._missing: "OrderedDict[str, float]" = OrderedDict()
+        self._task: Optional[asyncio.Task] = None
+        self.stats = KnownSkuStats()
+
+    async def might_exist(self, sku: str) -> bool:
+        """ False 면 없는 SKU 다. True 면 애그리거트를 읽어서 확인해야 한다. """
+        if self._filter is None:
+            return True
+
+        expires_at = self._missing.get(sku)
+        if expires_at is not None:
+            if expires_at > self._clock():
+                self.stats.negative_hits += 1
+                return False
+            del self._missing[sku]
+
+        if sku in self._filter:
+            self.stats.passed += 1
+            return True
+
+        self.stats.filtered += 1
+        if await self._lookup(sku):
+            self.stats.discovered += 1
+            self.add(sku)
+            return True
+        self.mark_missing(sku)
+        return False
+
+    def add(self, sku: str):
+        self._missing.pop(sku, None)
+        if self._filter is not None and sku not in self._filter:
+            self._filter.add(sku)
+            self.stats.skus = len(self._filter)
+
+    def mark_missing(self, sku: str):
+        self.stats.misses += 1
+        self._missing[sku] = self._clock() + self._negative_ttl
+        self._missing.move_to_end(sku)
+        while len(self._missing) > self._negative_maxsize:
+            self._missing.popitem(last=False)
+
+    async def load(self):
+        async with self._session_factory() as session:
+            skus = (await session.execute(select(products.c.sku))).scalars().all()
+        self._filter = self._build(skus)
+        self.stats.skus = len(self._filter)
+        self.stats.loads += 1
+
+    async def _lookup(self, sku: str) -> bool:
+        async with self._session_factory() as session:
+            found = await session.execute(select(products.c.sku).where(products.c.sku == sku))
+            return found.first() is not None
+
+    async def start(self):
+        await self.load()
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self._refresh_interval)
+            try:
+                await self.load()
+            except Exception as ex:
+                logger.exception(f'Exception loading known skus... detail: {ex}')
+
+    def _build(self, skus: Iterable[str]) -> BloomFilter:
+        skus = list(skus)
+        # 다음 새로 고침까지 늘어날 SKU 도 오탐률 안에 들도록 여유를 둔다
+        bloom = BloomFilter(max(self._capacity, len(skus) * 2), self._error_rate)
+        for sku in skus:
+            bloom.add(sku)
+        return bloom
@@ -0,0 +1,269 @@
+import asyncio
+import logging
+import os
+import struct
+import time
+from dataclasses import dataclass
+from typing import Callable, Iterable, List, Optional, Tuple
+
+from pt2.ch12.src.allocation.adapters.breaker import CircuitBreaker
+from pt2.ch12.src.allocation.adapters.redis import AsyncRedis
+from pt2.ch12.src.allocation.domain import events
+
+
+logger = logging.getLogger(__name__)
+
+Record = Tuple[str, bytes]
+
+
+class Spool:
+    """ 보내지 못한 (채널, 페이로드)를 순서대로 쌓아두는 추가 전용 파일.
+
+    레코드는 ``>HI`` 헤더(채널 길이, 페이로드 길이) 뒤에 채널과 페이로드가 붙는다.
+    어디까지 다시 보냈는지는 ``<path>.offset`` 에 남기고, 다 보내면 파일을 비운다.
+    쓰다가 죽어서 꼬리에 반쯤 쓰인 레코드가 남아 있으면 열 때 잘라낸다.
+    """
+
+    HEADER = struct.Struct(">HI")
+
+    def __init__(self, path: str, fsync: bool = False):
+        self._path = path
+        self._offset_path = f"{path}.offset"
+        self._fsync = fsync
+        self._offset = self._read_offset()
+        self._pending = self._recover()
+        self._file = open(path, "ab")
+
+    def __len__(self):
+        return self._pending
+
+    @property
+    def path(self) -> str:
+        return self._path
+
+    def append(self, records: Iterable[Record]):
+        written = 0
+        for channel, payload in records:
+            encoded = channel.encode()
+            self._file.write(self.HEADER.pack(len(encoded), len(payload)) + encoded + payload)
+            written += 1
+        self._file.flush()
+        if self._fsync:
+            os.fsync(self._file.fileno())
+        self._pending += written
+
+    def read(self, max_records: int) -> Tuple[List[Record], int]:
+        """ 아직 다시 보내지 않은 레코드를 앞에서부터 읽는다. 다음 오프셋도 돌려준다. """
+        with open(self._path, "rb") as f:
+            f.seek(self._offset)
+            records, offset = self._read_records(f, max_records)
+        return records, self._offset + offset
+
+    def commit(self, offset: int, count: int):
+        self._pending -= count
+        if self._pending <= 0:
+            self._pending = 0
+            # 오프셋을 먼저 0 으로 남긴다. 그 사이에 죽으면 보낸 레코드를 한 번 더 보낼 뿐
+            # 비운 파일에 새로 쌓인 레코드를 옛 오프셋 때문에 건너뛰지는 않는다
+            self._offset = 0
+            self._write_offset(0)
+            self._truncate()
+            return
+        self._offset = offset
+        self._write_offset(offset)
+
+    def close(self):
+        self._file.close()
+
+    def _recover(self) -> int:
+        if not os.path.exists(self._path):
+            return 0
+
+        if self._offset > os.path.getsize(self._path):
+            # 파일을 비운 뒤 오프셋을 적기 전에 죽었던 경우다. 남은 레코드는 모두 새것이다
+            logger.warning(f'Offset is past the end of {self._path}, replaying from the start')
+            self._offset = 0
+            self._write_offset(0)
+
+        with open(self._path, "rb") as f:
+            f.seek(self._offset)
+            records, consumed = self._read_records(f, None)
+        end = self._offset + consumed
+        if end < os.path.getsize(self._path):
+            logger.warning(f'Truncating partial record at the end of {self._path}')
+            os.truncate(self._path, end)
+        return len(records)
+
+    def _read_records(self, f, max_records: Optional[int]) -> Tuple[List[Record], int]:
+        records, consumed = [], 0
+        while max_records is None or len(records) < max_records:
+            header = f.read(self.HEADER.size)
+            if len(header) < self.HEADER.size:
+                break
+            channel_length, payload_length = self.HEADER.unpack(header)
+            body = f.read(channel_length + payload_length)
+            if len(body) < channel_length + payload_length:
+                break
+            records.append((body[:channel_length].decode(), body[channel_length:]))
+            consumed += self.HEADER.size + len(body)
+        return records, consumed
+
+    def _read_offset(self) -> int:
+        try:
+            with open(self._offset_path) as f:
+                return int(f.read() or 0)
+        except FileNotFoundError:
+            return 0
+
+    def _truncate(self):
+        self._file.truncate(0)
+        if self._fsync:
+            os.fsync(self._file.fileno())
+
+    def _write_offset(self, offset: int):
+        tmp = f"{self._offset_path}.tmp"
+        with open(tmp, "w") as f:
+            f.write(str(offset))
+            if self._fsync:
+                f.flush()
+                os.fsync(f.fileno())
+        os.replace(tmp, self._offset_path)
+
+
+@dataclass
+class SpoolStats:
+    published: int = 0
+    spooled: int = 0
+    replayed: int = 0
+
+    def as_dict(self) -> dict:
+        return dict(
+            published=self.published,
+            spooled=self.spooled,
+            replayed=self.replayed,
+        )
+
+
+class SpoolingPublisher:
+    """ 서킷 브레이커를 끼운 ``AsyncRedis``.
+
+    호출마다 ``timeout`` 을 걸고, 실패하거나 브레이커가 열려 있으면 기다리지 않고
+    스풀 파일에 적는다. 스풀에 남은 게 있는 동안은 새 이벤트도 스풀 뒤에 붙여서
+    순서를 지키고, 백그라운드 태스크가 레디스가 돌아오면 앞에서부터 다시 보낸다.
+    ``publish``/``publish_many`` 시그니처가 ``AsyncRedis`` 와 같아서
+    ``BatchingPublisher`` 아래에도 그대로 둘 수 있다.
+
+    타임아웃이 났지만 실제로는 전달된 호출은 스풀에서 한 번 더 나갈 수 있다.
+    받는 쪽은 봉투 ID로 걸러낸다.
+    """
+
+    def __init__(
+            self,
+            channel: AsyncRedis,
+            spool: Spool,
+            breaker: Optional[CircuitBreaker] = None,
+            timeout: float = 0.2,
+            replay_batch: int = 500,
+            replay_interval: float = 1.0,
+            clock: Callable[[], float] = time.monotonic,
+    ):
+        self._channel = channel
+        self._spool = spool
+        self._breaker = breaker or CircuitBreaker()
+        self._timeout = timeout
+        self._replay_batch = replay_batch
+        self._replay_interval = replay_interval
+        self._clock = clock
+        self._replaying = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+        self.stats = SpoolStats()
+
+    @property
+    def breaker(self) -> CircuitBreaker:
+        return self._breaker
+
+    def __len__(self):
+        return len(self._spool)
+
+    async def publish(
+            self,
+            channel,
+            event: events.Event,
+    ):
+        await self.publish_many([(channel, event)])
+
+    async def publish_many(
+            self,
+            messages: Iterable[Tuple[str, events.Event]],
+    ):
+        records = [(channel, self._channel.encode(event)) for channel, event in messages]
+        if not records:
+            return
+
+        if len(self._spool) or not self._breaker.allow():
+            self._to_spool(records)
+            return
+
+        if await self._send(records):
+            self.stats.published += len(records)
+        else:
+            self._to_spool(records)
+
+    async def replay(self) -> int:
+        """ 스풀에 쌓인 것을 앞에서부터 다시 보낸다. 보낸 레코드 수를 돌려준다. """
+        replayed = 0
+        async with self._replaying:
+            while len(self._spool) and self._breaker.allow():
+                records, offset = self._spool.read(self._replay_batch)
+                if not records:
+                    break
+                if not await self._send(records):
+                    break
+                self._spool.commit(offset, len(records))
+                replayed += len(records)
+        if replayed:
+            self.stats.replayed += replayed
+            logger.info(f'Replayed {replayed} spooled events, {len(self._spool)} left')
+        return replayed
+
+    async def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        # 남은 건 파일에 그대로 두고 다음에 뜰 때 다시 보낸다
+        self._spool.close()
+
+    async def _send(self, records: List[Record]) -> bool:
+        started = self._clock()
+        try:
+            await asyncio.wait_for(
+                self._channel.publish_raw_many(records),
+                timeout=self._timeout,
+            )
+        except Exception as ex:
+            self._breaker.record_failure()
+            logger.warning(f'Publishing {len(records)} events failed... detail: {ex!r}')
+            return False
+
+        self._breaker.record(self._clock() - started)
+        return True
+
+    def _to_spool(self, records: List[Record]):
+        self._spool.append(records)
+        self.stats.spooled += len(records)
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self._replay_interval)
+            try:
+                await self.replay()
+            except Exception as ex:
+                logger.exception(f'Exception replaying spool... detail: {ex}')
@@ -0,0 +1,260 @@
+import logging
+import os
+import socket
+import time
+from collections import defaultdict
+from dataclasses import dataclass
+from typing import Callable, Dict, Iterable, List, Sequence, Set
+
+import redis.asyncio as redis
+from redis.exceptions import ResponseError
+
+from pt2.ch12.src.allocation.adapters.redis import STREAM_FIELD
+
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class StreamMessage:
+    stream: str
+    id: str
+    fields: Dict[str, str]
+
+
+@dataclass(frozen=True)
+class PendingMessage:
+    # PEL 에서 이 메시지를 가지고 있는 컨슈머와 지금까지 전달된 횟수
+    consumer: str
+    deliveries: int
+
+
+def default_consumer_name() -> str:
+    return f"{socket.gethostname()}-{os.getpid()}"
+
+
+class StreamConsumer:
+    """ 컨슈머 그룹으로 레디스 스트림을 읽는다.
+
+    같은 그룹의 컨슈머끼리 메시지를 나눠 가지므로 API 와 상관없이 프로세스를 늘리면 된다.
+    ``ack`` 는 스트림별로 XACK 한 번씩, 파이프라인 하나로 보낸다.
+    ACK 되지 않은 채 ``claim_idle_ms`` 이상 지난 메시지(죽은 컨슈머 몫 등)는
+    ``claim_interval`` 마다 XAUTOCLAIM 으로 가져와서 다시 처리한다.
+    끝내 처리하지 못한 메시지는 ``dead_letter`` 로 ``dead_letter_stream`` 에 옮기고 ACK 한다.
+    """
+
+    def __init__(
+            self,
+            session: redis.Redis,
+            streams: Sequence[str],
+            group: str,
+            consumer: str,
+            batch_size: int = 100,
+            block_ms: int = 1000,
+            claim_idle_ms: int = 60_000,
+            claim_interval: float = 5.0,
+            dead_letter_stream: str = "dead_letters",
+            clock: Callable[[], float] = time.monotonic,
+    ):
+        self._session = session
+        self._streams = list(streams)
+        self._group = group
+        self._consumer = consumer
+        self._batch_size = batch_size
+        self._block_ms = block_ms
+        self._claim_idle_ms = claim_idle_ms
+        self._claim_interval = claim_interval
+        self._dead_letter_stream = dead_letter_stream
+        self._clock = clock
+        self._next_claim = clock()
+
+    @property
+    def consumer(self) -> str:
+        return self._consumer
+
+    async def start(self):
+        await self.ensure_groups()
+
+    async def close(self):
+        pass
+
+    async def ensure_groups(self):
+        for stream in self._streams:
+            try:
+                # 컨슈머보다 먼저 발행된 메시지도 놓치지 않도록 처음부터 읽는다
+                await self._session.xgroup_create(stream, self._group, id="0", mkstream=True)
+            except ResponseError as e:
+                if "BUSYGROUP" not in str(e):
+                    raise
+
+    async def read(self) -> List[StreamMessage]:
+        """ 오래 걸려 있는 메시지가 있으면 그것부터, 없으면 새 메시지를 읽는다. """
+        if self._clock() >= self._next_claim:
+            self._next_claim = self._clock() + self._claim_interval
+            claimed = await self.claim_stale()
+            if claimed:
+                return claimed
+
+        response = await self._session.xreadgroup(
+            self._group,
+            self._consumer,
+            {stream: ">" for stream in self._streams},
+            count=self._batch_size,
+            block=self._block_ms,
+        )
+        return [
+            StreamMessage(stream, message_id, fields)
+            for stream, entries in response or []
+            for message_id, fields in entries
+        ]
+
+    async def claim_stale(self) -> List[StreamMessage]:
+        claimed = []
+        for stream in self._streams:
+            _, entries, *_ = await self._session.xautoclaim(
+                stream,
+                self._group,
+                self._consumer,
+                min_idle_time=self._claim_idle_ms,
+                count=self._batch_size,
+            )
+            claimed.extend(
+                StreamMessage(stream, message_id, fields)
+                for message_id, fields in entries
+                # 잘려나간 항목은 필드가 비어서 온다
+                if fields
+            )
+        if claimed:
+            logger.warning(f'Reclaimed {len(claimed)} stale messages for {self._consumer}')
+        return claimed
+
+    async def ack(self, messages: Iterable[StreamMessage]):
+        ids: Dict[str, List[str]] = defaultdict(list)
+        for message in messages:
+            ids[message.stream].append(message.id)
+        if not ids:
+            return
+
+        async with self._session.pipeline(transaction=False) as pipe:
+            for stream, message_ids in ids.items():
+                pipe.xack(stream, self._group, *message_ids)
+            await pipe.execute()
+
+    async def pending(self, messages: Iterable[StreamMessage]) -> Dict[str, PendingMessage]:
+        """ 메시지 ID 별 PEL 항목. ACK 됐거나 PEL 에서 지워진 메시지는 빠진다. """
+        messages = list(messages)
+        if not messages:
+            return {}
+
+        async with self._session.pipeline(transaction=False) as pipe:
+            for message in messages:
+                pipe.xpending_range(message.stream, self._group, min=message.id, max=message.id, count=1)
+            found = await pipe.execute()
+        return {
+            entry["message_id"]: PendingMessage(entry["consumer"], entry["times_delivered"])
+            for entries in found
+            for entry in entries
+        }
+
+    async def redeliver(self, messages: Iterable[StreamMessage]) -> Set[str]:
+        """ 아직 이 컨슈머 몫인 메시지만 XCLAIM 으로 다시 받아 전달 횟수를 올린다. 그 ID 들을 돌려준다.
+
+        다른 컨슈머가 XAUTOCLAIM 으로 가져갔거나 이미 ACK 된 메시지는 빠진다.
+        """
+        messages = list(messages)
+        pending = await self.pending(messages)
+        ids: Dict[str, List[str]] = defaultdict(list)
+        for message in messages:
+            entry = pending.get(message.id)
+            if entry is not None and entry.consumer == self._consumer:
+                ids[message.stream].append(message.id)
+        if not ids:
+            return set()
+
+        async with self._session.pipeline(transaction=False) as pipe:
+            for stream, message_ids in ids.items():
+                pipe.xclaim(stream, self._group, self._consumer, min_idle_time=0, message_ids=message_ids)
+            await pipe.execute()
+        return {message_id for message_ids in ids.values() for message_id in message_ids}
+
+    async def dead_letter(self, message: StreamMessage, error: str):
+        """ 원래 필드에 출처와 오류를 붙여 데드 레터 스트림에 넣고, 같은 트랜잭션에서 ACK 한다. """
+        async with self._session.pipeline(transaction=True) as pipe:
+            pipe.xadd(self._dead_letter_stream, {
+                **message.fields,
+                "source_stream": message.stream,
+                "source_id": message.id,
+                "error": error,
+            })
+            pipe.xack(message.stream, self._group, message.id)
+            await pipe.execute()
+
+    async def report(self, metrics: dict):
+        await self._session.hset(
+            f"consumer_metrics:{self._group}:{self._consumer}",
+            mapping=metrics,
+        )
+
+
+class PubSubConsumer:
+    """ ``StreamConsumer`` 와 같은 모양으로 pub/sub 채널을 구독한다.
+
+    ACK 도 재전송도 없어서 처리하지 못한 메시지는 그대로 사라진다.
+    프로세스를 늘리면 모두가 같은 메시지를 받으므로 하나만 띄운다.
+    """
+
+    def __init__(
+            self,
+            session: redis.Redis,
+            channels: Sequence[str],
+            consumer: str,
+            batch_size: int = 100,
+            block_ms: int = 1000,
+    ):
+        self._session = session
+        self._channels = list(channels)
+        self._consumer = consumer
+        self._batch_size = batch_size
+        self._block_ms = block_ms
+        self._pubsub = None
+
+    @property
+    def consumer(self) -> str:
+        return self._consumer
+
+    async def start(self):
+        if self._pubsub is not None:
+            return
+        self._pubsub = self._session.pubsub()
+        await self._pubsub.subscribe(*self._channels)
+
+    async def close(self):
+        if self._pubsub is not None:
+            await self._pubsub.unsubscribe()
+            await self._pubsub.close()
+            self._pubsub = None
+
+    async def read(self) -> List[StreamMessage]:
+        """ 첫 메시지는 ``block_ms`` 까지 기다리고, 나머지는 이미 도착한 만큼만 모은다. """
+        messages = []
+        message = await self._pubsub.get_message(
+            ignore_subscribe_messages=True,
+            timeout=self._block_ms / 1000,
+        )
+        while message is not None:
+            messages.append(
+                StreamMessage(message["channel"], "", {STREAM_FIELD: message["data"]})
+            )
+            if len(messages) >= self._batch_size:
+                break
+            message = await self._pubsub.get_message(
+                ignore_subscribe_messages=True,
+                timeout=0,
+            )
+        return messages
+
+    async def ack(self, messages: Iterable[StreamMessage]):
+        pass
+
+    async def report(self, metrics: dict):
+        await self._session.hset(f"consumer_metrics:pubsub:{self._consumer}", mapping=metrics)
@@ -0,0 +1,178 @@
+import asyncio
+import json
+import logging
+from collections import deque
+from typing import (
+    AsyncIterable,
+    AsyncIterator,
+    Awaitable,
+    Callable,
+    Deque,
+    Dict,
+    List,
+    Optional,
+    Tuple,
+)
+
+from pydantic import ValidationError
+
+from pt2.ch12.src.allocation.domain import commands, model
+from pt2.ch12.src.allocation.entrypoints.schemas import OrderLineRequest
+from pt2.ch12.src.allocation.service_layer import handlers
+
+
+logger = logging.getLogger(__name__)
+
+ALLOCATED = "allocated"
+OUT_OF_STOCK = "out_of_stock"
+INVALID_SKU = "invalid_sku"
+INVALID = "invalid"
+ERROR = "error"
+
+# 이보다 긴 줄은 읽지 않고 invalid 로 돌려준다
+MAX_LINE_BYTES = 64 * 1024
+
+Allocate = Callable[[commands.Allocate], Awaitable[Optional[str]]]
+
+
+async def split_lines(
+        chunks: AsyncIterable[bytes],
+        max_line_bytes: int = MAX_LINE_BYTES,
+) -> AsyncIterator[Optional[bytes]]:
+    """ 청크 경계와 상관없이 줄 단위로 끊는다. 너무 긴 줄은 ``None`` 으로 알린다. """
+    buffer = b""
+    overflow = False
+    async for chunk in chunks:
+        buffer += chunk
+        *lines, buffer = buffer.split(b"\n")
+        for line in lines:
+            if overflow:
+                overflow = False
+                yield None
+            elif len(line) > max_line_bytes:
+                yield None
+            elif line.strip():
+                yield line
+        if len(buffer) > max_line_bytes:
+            # 줄이 끝날 때까지 버린다
+            buffer = b""
+            overflow = True
+    if overflow or len(buffer) > max_line_bytes:
+        yield None
+    elif buffer.strip():
+        yield buffer
+
+
+def parse_line(line: Optional[bytes]) -> commands.Allocate:
+    if line is None:
+        raise ValueError(f"line longer than {MAX_LINE_BYTES} bytes")
+    request = OrderLineRequest(**json.loads(line))
+    return commands.Allocate(
+        order_id=request.orderid,
+        sku=request.sku,
+        qty=request.qty,
+    )
+
+
+class BulkAllocator:
+    """ NDJSON 주문 라인을 읽는 대로 SKU 별 레인에 넣고 결과를 끝나는 순서대로 내보낸다.
+
+    같은 SKU 는 같은 ``Product`` 애그리게이트를 건드리므로 한 레인에서 차례로,
+    다른 SKU 끼리는 ``concurrency`` 개까지 나란히 할당한다.
+    결과를 아직 내보내지 못한 라인이 ``max_pending`` 개를 넘으면 입력을 그만 읽는다.
+    """
+
+    def __init__(
+            self,
+            allocate: Allocate,
+            concurrency: int = 16,
+            max_pending: int = 1_000,
+    ):
+        self._allocate = allocate
+        self._slots = asyncio.Semaphore(concurrency)
+        self._pending = asyncio.Semaphore(max_pending)
+        self._lanes: Dict[str, Deque[Tuple[int, commands.Allocate]]] = {}
+        self._lane_tasks: Dict[str, asyncio.Task] = {}
+        self._results: "asyncio.Queue[Optional[dict]]" = asyncio.Queue()
+
+    async def run(self, chunks: AsyncIterable[bytes]) -> AsyncIterator[List[dict]]:
+        """ 그 순간까지 끝난 결과를 묶어서 내보낸다. 각 결과에는 입력 줄 번호(``line``)가 붙는다. """
+        reader = asyncio.create_task(self._read(chunks))
+        try:
+            done = False
+            while not done:
+                batch = [await self._results.get()]
+                while not self._results.empty():
+                    batch.append(self._results.get_nowait())
+                if batch[-1] is None:
+                    # 읽기와 모든 레인이 끝났다
+                    batch.pop()
+                    done = True
+                if batch:
+                    yield self._released(batch)
+        finally:
+            # 클라이언트가 끊기면 남은 작업을 정리한다
+            reader.cancel()
+            for task in list(self._lane_tasks.values()):
+                task.cancel()
+
+    async def _read(self, chunks: AsyncIterable[bytes]):
+        try:
+            number = 0
+            async for line in split_lines(chunks):
+                number += 1
+                await self._pending.acquire()
+                try:
+                    command = parse_line(line)
+                except (ValueError, TypeError, ValidationError) as e:
+                    self._results.put_nowait(
+                        {"line": number, "status": INVALID, "detail": str(e)}
+                    )
+                    continue
+                self._dispatch(number, command)
+
+            while self._lane_tasks:
+                await asyncio.gather(*self._lane_tasks.values())
+        except Exception as ex:
+            logger.exception(f'Exception reading bulk allocations... detail: {ex}')
+        finally:
+            self._results.put_nowait(None)
+
+    def _dispatch(self, number: int, command: commands.Allocate):
+        lane = self._lanes.setdefault(command.sku, deque())
+        lane.append((number, command))
+        if command.sku not in self._lane_tasks:
+            self._lane_tasks[command.sku] = asyncio.create_task(self._run_lane(command.sku))
+
+    async def _run_lane(self, sku: str):
+        lane = self._lanes[sku]
+        try:
+            while lane:
+                number, command = lane.popleft()
+                async with self._slots:
+                    result = await self._allocate_one(command)
+                self._results.put_nowait({"line": number, **result})
+        finally:
+            del self._lanes[sku]
+            del self._lane_tasks[sku]
+
+    async def _allocate_one(self, command: commands.Allocate) -> dict:
+        line = {"orderid": command.order_id, "sku": command.sku}
+        try:
+            batchref = await self._allocate(command)
+        except handlers.InvalidSku as e:
+            return {**line, "status": INVALID_SKU, "detail": str(e)}
+        except model.OutOfStock as e:
+            return {**line, "status": OUT_OF_STOCK, "detail": str(e)}
+        except Exception as ex:
+            logger.exception(f'Exception allocating {command}... detail: {ex}')
+            return {**line, "status": ERROR}
+
+        if batchref is None:
+            return {**line, "status": OUT_OF_STOCK}
+        return {**line, "status": ALLOCATED, "batchref": batchref}
+
+    def _released(self, batch: List[dict]) -> List[dict]:
+        for _ in batch:
+            self._pending.release()
+        return batch
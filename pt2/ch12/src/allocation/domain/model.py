@@ -83,6 +83,18 @@ class Product:
         self.version_number = version_number
         self.messages = []    # type: # List[Message]
 
+    @property
+    def max_available_quantity(self) -> int:
+        """ 이보다 많은 수량은 어느 배치에도 할당할 수 없다. """
+        return max((batch.available_quantity for batch in self.batches), default=0)
+
+    def add_batch(
+            self,
+            batch: Batch,
+    ):
+        self.batches.append(batch)
+        self.version_number += 1
+
     def allocate(
             self,
             line: OrderLine,
@@ -108,7 +120,9 @@ class Product:
             line: OrderLine,
     ):
         for batch in self.batches:
-            batch.deallocate(line)
+            if line in batch.allocations:
+                batch.deallocate(line)
+                self.version_number += 1
 
     def get_allocation(
             self,
@@ -126,6 +140,7 @@ class Product:
     ):
         batch = self.get_allocation(batch_ref)
         batch.purchased_quantity = qty
+        self.version_number += 1
         while batch.available_quantity < 0:
             line = batch.deallocate_one()
             self.messages.append(
@@ -1 +1 @@
-from .schemas import OrderLineRequest, BatchRequest
+from .schemas import AllocationsQueryRequest, OrderLineRequest, BatchRequest
@@ -0,0 +1,187 @@
+import asyncio
+import json
+import logging
+import math
+import time
+from dataclasses import dataclass
+from typing import Callable, Optional
+
+from pt2.ch12.src.allocation.adapters.postgres import AsyncSQLAlchemy
+
+
+logger = logging.getLogger(__name__)
+
+# 커넥션 풀과 메시지 버스를 붙잡는 쓰기 요청. 나머지는 읽기로 본다
+WRITE_PATHS = frozenset({"/batches", "/allocate", "/allocate/bulk", "/deallocate"})
+# 과부하일 때 상태를 봐야 하므로 세지도 막지도 않는다.
+# /events 는 연결이 오래 이어지므로 읽기 자리를 차지하지 않게 뺀다(버퍼는 EventHub 가 제한한다)
+EXEMPT_PATHS = frozenset({"/metrics", "/events"})
+
+
+@dataclass
+class AdmissionStats:
+    inflight_commands: int = 0
+    inflight_reads: int = 0
+    pool_wait: float = 0.0
+    loop_lag: float = 0.0
+    degraded: bool = False
+    admitted: int = 0
+    shed_commands: int = 0
+    shed_reads: int = 0
+
+    def as_dict(self) -> dict:
+        return dict(
+            inflight_commands=self.inflight_commands,
+            inflight_reads=self.inflight_reads,
+            pool_wait=self.pool_wait,
+            loop_lag=self.loop_lag,
+            degraded=self.degraded,
+            admitted=self.admitted,
+            shed_commands=self.shed_commands,
+            shed_reads=self.shed_reads,
+        )
+
+
+class AdmissionController:
+    """ 포화 상태를 보고 요청을 받을지 바로 돌려보낼지 정한다.
+
+    ``sample_interval`` 마다 이벤트 루프 지연(잠든 시간이 얼마나 늦게 끝났는지)과
+    커넥션 풀에서 커넥션 하나를 받는 데 걸린 시간을 잰다. 둘 중 하나가 한도를 넘으면
+    degraded 로 보고 쓰기는 모두 돌려보내고 읽기만 받는다. 평소에도 처리 중인 쓰기가
+    ``max_inflight_commands`` 개, 읽기가 ``max_inflight_reads`` 개를 넘으면 돌려보낸다.
+    """
+
+    def __init__(
+            self,
+            db: AsyncSQLAlchemy,
+            max_inflight_commands: int = 64,
+            max_inflight_reads: int = 256,
+            max_pool_wait: float = 0.5,
+            max_loop_lag: float = 0.2,
+            sample_interval: float = 0.5,
+            retry_after: float = 1.0,
+            clock: Callable[[], float] = time.monotonic,
+    ):
+        self._db = db
+        self._max_inflight_commands = max_inflight_commands
+        self._max_inflight_reads = max_inflight_reads
+        self._max_pool_wait = max_pool_wait
+        self._max_loop_lag = max_loop_lag
+        self._sample_interval = sample_interval
+        self.retry_after = retry_after
+        self._clock = clock
+        self._task: Optional[asyncio.Task] = None
+        self.stats = AdmissionStats()
+
+    @property
+    def degraded(self) -> bool:
+        return self.stats.degraded
+
+    def admit(self, write: bool) -> bool:
+        """ 받으면 처리 중 개수를 올리고 True. 끝나면 ``release`` 를 불러야 한다. """
+        if write:
+            if self.degraded or self.stats.inflight_commands >= self._max_inflight_commands:
+                self.stats.shed_commands += 1
+                return False
+            self.stats.inflight_commands += 1
+        else:
+            if self.stats.inflight_reads >= self._max_inflight_reads:
+                self.stats.shed_reads += 1
+                return False
+            self.stats.inflight_reads += 1
+        self.stats.admitted += 1
+        return True
+
+    def release(self, write: bool):
+        if write:
+            self.stats.inflight_commands -= 1
+        else:
+            self.stats.inflight_reads -= 1
+
+    def observe(self, pool_wait: float, loop_lag: float):
+        self.stats.pool_wait = pool_wait
+        self.stats.loop_lag = loop_lag
+        degraded = pool_wait > self._max_pool_wait or loop_lag > self._max_loop_lag
+        if degraded != self.stats.degraded:
+            logger.warning(
+                f'Admission {"degraded" if degraded else "recovered"}... '
+                f'pool_wait: {pool_wait:.3f}s, loop_lag: {loop_lag:.3f}s'
+            )
+        self.stats.degraded = degraded
+
+    async def measure_pool_wait(self) -> float:
+        # 풀이 바닥나면 커넥션을 기다리느라 늦어진다. 한도의 두 배까지만 기다린다
+        started = self._clock()
+        try:
+            await asyncio.wait_for(self._checkout(), timeout=self._max_pool_wait * 2)
+        except asyncio.TimeoutError:
+            return self._max_pool_wait * 2
+        return self._clock() - started
+
+    async def _checkout(self):
+        async with self._db.engine.connect():
+            pass
+
+    async def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        while True:
+            started = self._clock()
+            await asyncio.sleep(self._sample_interval)
+            loop_lag = max(0.0, self._clock() - started - self._sample_interval)
+            try:
+                pool_wait = await self.measure_pool_wait()
+            except Exception as ex:
+                logger.exception(f'Exception measuring pool wait... detail: {ex}')
+                pool_wait = self._max_pool_wait * 2
+            self.observe(pool_wait, loop_lag)
+
+
+class AdmissionMiddleware:
+    """ ``AdmissionController`` 가 받지 않은 요청에 503 과 ``Retry-After`` 를 돌려준다.
+
+    스트리밍 응답(/allocate/bulk)을 그대로 흘려보내도록 ASGI 미들웨어로 둔다.
+    """
+
+    def __init__(self, app, controller: AdmissionController):
+        self.app = app
+        self.controller = controller
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] in EXEMPT_PATHS:
+            await self.app(scope, receive, send)
+            return
+
+        write = scope["path"] in WRITE_PATHS
+        if not self.controller.admit(write):
+            await self._reject(send)
+            return
+
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.controller.release(write)
+
+    async def _reject(self, send):
+        body = json.dumps({"detail": "Service overloaded, retry later"}).encode()
+        await send({
+            "type": "http.response.start",
+            "status": 503,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(body)).encode()),
+                (b"retry-after", str(math.ceil(self.controller.retry_after)).encode()),
+            ],
+        })
+        await send({"type": "http.response.body", "body": body})
@@ -1,37 +1,200 @@
+from typing import Any, Awaitable, Callable, List, Literal, Optional
+
 from dependency_injector.wiring import inject, Provide
-from fastapi import FastAPI, HTTPException, status, Depends
+from fastapi import FastAPI, Header, HTTPException, Query, Request, Response, status, Depends
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import StreamingResponse
 
 from pt2.ch12.config import Settings
-from pt2.ch12.container import Container
-from pt2.ch12.src.allocation import views
-from pt2.ch12.src.allocation.adapters import redis
+from pt2.ch12.container import Container, provide
+from pt2.ch12.src.allocation import bulk, exports, views
+from pt2.ch12.src.allocation.adapters import (
+    cache,
+    codec,
+    command_queue,
+    envelope,
+    hub,
+    idempotency,
+    projection,
+    publisher,
+    redis,
+    spool,
+)
 
 from pt2.ch12.src.allocation.domain import model, events, commands
-from pt2.ch12.src.allocation.entrypoints import BatchRequest, OrderLineRequest
+from pt2.ch12.src.allocation.entrypoints import (
+    AllocationsQueryRequest,
+    BatchRequest,
+    OrderLineRequest,
+)
+from pt2.ch12.src.allocation.entrypoints.admission import AdmissionMiddleware
+from pt2.ch12.src.allocation.entrypoints.responses import FastJSONResponse, RawJSONResponse
 from pt2.ch12.src.allocation.service_layer import unit_of_work, messagebus, handlers
 
 
 # TODO
 #   이걸 좀 어떻게 잘 할 방법 없나?
 # orm.start_mappers()
-app = FastAPI()
+app = FastAPI(default_response_class=FastJSONResponse)
 
 container = Container()
 container.config.from_pydantic(Settings())
 db = container.db()
+replica_db = container.replica_db() if container.config.data.DB_REPLICA_URI() else None
+admission = container.admission() if container.config.admission.ADMISSION_CONTROL() == "on" else None
 
 app.container = container
+if admission is not None:
+    app.add_middleware(AdmissionMiddleware, controller=admission)
+
+
+class DuplexStreamingResponse(StreamingResponse):
+    """ 요청 본문을 읽는 동안에 응답을 내보낸다.
+
+    ``StreamingResponse`` 는 연결 끊김을 보려고 ``receive`` 를 따로 읽어서
+    아직 읽지 않은 요청 본문을 가로챈다. 여기서는 본문을 읽는 쪽(``request.stream()``)이
+    끊김도 알아챈다.
+    """
+
+    async def __call__(self, scope, receive, send):
+        await self.stream_response(send)
+        if self.background is not None:
+            await self.background()
+
+
+async def batching_publisher() -> Optional[publisher.BatchingPublisher]:
+    if container.config.broker.PUBLISH_MODE() == "immediate":
+        return None
+
+    return await provide(container.publisher)
+
+
+async def spooling_publisher() -> Optional[spool.SpoolingPublisher]:
+    if container.config.broker.PUBLISH_RESILIENCE() != "spool":
+        return None
+
+    return await provide(container.spooling_publisher)
+
+
+async def handle_queued(command: commands.Command) -> List[Any]:
+    return await messagebus.handle(
+        command,
+        uow=unit_of_work.SqlAlchemyUnitOfWork(db.session_factory),
+        **await provide(container.bus_dependencies),
+    )
+
+
+def command_workers() -> Optional[command_queue.CommandWorkers]:
+    if container.config.commands.ALLOCATE_MODE() != "queued":
+        return None
+
+    return container.command_workers(handle=handle_queued)
+
+
+async def idempotent(
+        store: idempotency.IdempotencyStore,
+        key: Optional[str],
+        scope: str,
+        request: Any,
+        response: Response,
+        run: Callable[[], Awaitable[Any]],
+        status_code: int,
+):
+    """ ``Idempotency-Key`` 가 있으면 같은 키의 재시도에 처음 응답을 그대로 돌려준다.
+
+    ``run`` 은 JSON 으로 바꿀 수 있는 본문을 돌려준다. 응답은 여기서 바로 만들어서
+    FastAPI 의 응답 직렬화를 거치지 않는다.
+    """
+    def location() -> dict:
+        return {"location": response.headers["location"]} if "location" in response.headers else {}
+
+    if key is None:
+        body = await run()
+        return FastJSONResponse(body, status_code=status_code, headers=location())
+
+    async def execute() -> idempotency.StoredResponse:
+        try:
+            body = await run()
+        except HTTPException as e:
+            return idempotency.StoredResponse(e.status_code, {"detail": e.detail})
+        return idempotency.StoredResponse(status_code, jsonable_encoder(body), location())
+
+    try:
+        stored, replayed = await store.execute(
+            f"{scope}:{key}",
+            idempotency.fingerprint(jsonable_encoder(request)),
+            execute,
+        )
+    except idempotency.IdempotencyConflict as e:
+        raise HTTPException(
+            detail=str(e),
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+        ) from e
+    except idempotency.IdempotencyInProgress as e:
+        raise HTTPException(
+            detail=str(e),
+            status_code=status.HTTP_409_CONFLICT,
+        ) from e
+
+    headers = dict(stored.headers)
+    if replayed:
+        headers["Idempotent-Replayed"] = "true"
+    return FastJSONResponse(stored.body, status_code=stored.status_code, headers=headers)
+
+
+def read_only_uow() -> unit_of_work.SqlAlchemyUnitOfWork:
+    if replica_db is None:
+        return unit_of_work.SqlAlchemyUnitOfWork(db.session_factory)
+
+    return unit_of_work.ReadOnlyUnitOfWork(
+        replica_db.session_factory,
+        primary_session_factory=db.session_factory,
+        lag_guard=container.replica_lag_guard(),
+    )
+
+
+async def background_services() -> List[Any]:
+    """ ``start``/``close`` 로 관리하는 백그라운드 서비스. 시작한 순서의 반대로 닫는다. """
+    services = [
+        container.replica_lag_guard() if replica_db is not None else None,
+        admission,
+        container.known_skus(),
+        await provide(container.hub_feed),
+        container.projection(),
+        await spooling_publisher(),
+        await batching_publisher(),
+        command_workers(),
+        # 알림 워커가 다 보낸 뒤에 메일 연결을 닫는다
+        container.mailer() if container.notifier() is not None else None,
+        container.notifier(),
+    ]
+    return [service for service in services if service is not None]
 
 
 @app.on_event("startup")
 async def on_startup():
+    # 컨테이너가 만들어질 때는 이 모듈이 아직 import 중이라 엔드포인트가 와이어링되지 않는다
+    container.wire(modules=[__name__])
     await db.connect(echo=True)
     await db.create_database()
     db.init_session_factory()
+    if replica_db is not None:
+        await replica_db.connect()
+        replica_db.init_session_factory()
+    for service in await background_services():
+        start = getattr(service, "start", None)
+        if start is not None:
+            await start()
 
 
 @app.on_event("shutdown")
 async def on_shutdown():
+    # 남은 이벤트를 내보낸 뒤에 레디스/DB 연결을 닫는다
+    # 처리 중이던 커맨드는 running 으로 남았다가 claim_timeout 뒤에 다시 처리된다
+    for service in reversed(await background_services()):
+        await service.close()
+    if replica_db is not None:
+        await replica_db.disconnect()
     await db.disconnect()
 
 
@@ -42,18 +205,29 @@ async def on_shutdown():
 @inject
 async def add_batch_endpoint(
         batch: BatchRequest,
+        response: Response,
+        idempotency_key: Optional[str] = Header(None),
+        store: idempotency.IdempotencyStore = Depends(Provide[Container.idempotency_store]),
+        dependencies: dict = Depends(Provide[Container.bus_dependencies]),
 ):
-    event = commands.CreateBatch(
-        ref=batch.ref,
-        sku=batch.sku,
-        qty=batch.qty,
-        eta=batch.eta,
-    )
-    await messagebus.handle(
-        event,
-        uow=unit_of_work.SqlAlchemyUnitOfWork(db.session_factory),
+    async def run():
+        event = commands.CreateBatch(
+            ref=batch.ref,
+            sku=batch.sku,
+            qty=batch.qty,
+            eta=batch.eta,
+        )
+        await messagebus.handle(
+            event,
+            uow=unit_of_work.SqlAlchemyUnitOfWork(db.session_factory),
+            **dependencies,
+        )
+        return {'message': 'Batch added'}
+
+    return await idempotent(
+        store, idempotency_key, "batches", batch, response, run,
+        status_code=status.HTTP_201_CREATED,
     )
-    return {'message': 'Batch added'}
 
 
 @app.post(
@@ -63,43 +237,232 @@ async def add_batch_endpoint(
 @inject
 async def allocate_endpoint(
         order_line: OrderLineRequest,
-        channel: redis.AsyncRedis = Depends(Provide[Container.redis]),
+        response: Response,
+        idempotency_key: Optional[str] = Header(None),
+        store: idempotency.IdempotencyStore = Depends(Provide[Container.idempotency_store]),
+        queue: command_queue.CommandQueue = Depends(Provide[Container.command_queue]),
+        dependencies: dict = Depends(Provide[Container.bus_dependencies]),
 ):
-    try:
-        event = commands.Allocate(
-            order_id=order_line.orderid,
-            sku=order_line.sku,
-            qty=order_line.qty,
-        )
-        await messagebus.handle(
-            event,
+    async def run():
+        workers = command_workers()
+        if workers is not None:
+            # 큐에 넣기만 하고 돌아간다. 결과는 GET /commands/{id} 로 확인한다
+            command_id = await queue.enqueue(
+                commands.Allocate(
+                    order_id=order_line.orderid,
+                    sku=order_line.sku,
+                    qty=order_line.qty,
+                )
+            )
+            workers.notify()
+            response.headers["Location"] = f"/commands/{command_id}"
+            return {'message': 'accepted', 'command_id': command_id}
+
+        try:
+            event = commands.Allocate(
+                order_id=order_line.orderid,
+                sku=order_line.sku,
+                qty=order_line.qty,
+            )
+            await messagebus.handle(
+                event,
+                uow=unit_of_work.SqlAlchemyUnitOfWork(db.session_factory),
+                **dependencies,
+            )
+
+        except (model.OutOfStock, handlers.InvalidSku) as e:
+            raise HTTPException(
+                detail=str(e),
+                status_code=status.HTTP_400_BAD_REQUEST,
+            ) from e
+
+        else:
+            return {'message': 'allocated'}
+
+    return await idempotent(
+        store, idempotency_key, "allocate", order_line, response, run,
+        status_code=status.HTTP_202_ACCEPTED,
+    )
+
+
+@app.post(
+    "/allocate/bulk",
+)
+@inject
+async def bulk_allocate_endpoint(
+        request: Request,
+        dependencies: dict = Depends(Provide[Container.bus_dependencies]),
+):
+    """ NDJSON 으로 주문 라인을 받아 라인별 결과를 끝나는 대로 NDJSON 으로 돌려준다. """
+    async def allocate(command: commands.Allocate) -> Optional[str]:
+        results = await messagebus.handle(
+            command,
             uow=unit_of_work.SqlAlchemyUnitOfWork(db.session_factory),
-            channel=channel,
+            **dependencies,
         )
+        return results[0]
+
+    allocator = bulk.BulkAllocator(
+        allocate,
+        concurrency=container.config.bulk.BULK_ALLOCATE_CONCURRENCY(),
+        max_pending=container.config.bulk.BULK_ALLOCATE_MAX_PENDING(),
+    )
+
+    async def ndjson_lines():
+        async for results in allocator.run(request.stream()):
+            yield b"".join(codec.JsonBackend.dumps(result) + b"\n" for result in results)
 
-    except (model.OutOfStock, handlers.InvalidSku) as e:
+    return DuplexStreamingResponse(
+        ndjson_lines(),
+        media_type="application/x-ndjson",
+    )
+
+
+@app.get(
+    "/commands/{command_id}",
+)
+@inject
+async def command_status_endpoint(
+        command_id: str,
+        queue: command_queue.CommandQueue = Depends(Provide[Container.command_queue]),
+):
+    result = await queue.get(command_id)
+    if result is None:
         raise HTTPException(
-            detail=str(e),
-            status_code=status.HTTP_400_BAD_REQUEST,
-        ) from e
+            status_code=status.HTTP_404_NOT_FOUND,
+        )
 
-    else:
-        return {'message': 'allocated'}
+    return result
 
 
 @app.get(
     "/allocations/{order_id}"
 )
 @inject
-async def allocations_view_endpoint(order_id: str):
-    uow = unit_of_work.SqlAlchemyUnitOfWork(db.session_factory)
-    result = await views.allocations(order_id, uow)
+async def allocations_view_endpoint(
+        order_id: str,
+        if_none_match: Optional[str] = Header(None),
+        allocations_cache: cache.AllocationsCache = Depends(
+            Provide[Container.allocations_cache]
+        ),
+        read_model: Optional[redis.RedisReadModel] = Depends(
+            Provide[Container.read_model]
+        ),
+):
+    # 버전과 본문을 캐시의 한 항목에서 꺼내야 오래된 본문이 새 ETag 로 나가지 않는다
+    # 클라이언트가 가진 버전이면 본문은 읽지 않는다
+    version, result = await views.versioned_allocations(
+        order_id,
+        read_only_uow(),
+        cache=allocations_cache,
+        read_model=read_model,
+        unchanged=(
+            (lambda version: views.etag_matches(if_none_match, views.etag(version)))
+            if if_none_match else None
+        ),
+    )
+    headers = {}
+    if version is not None:
+        headers["ETag"] = views.etag(version)
+        if views.etag_matches(if_none_match, headers["ETag"]):
+            return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
     if not result:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
         )
 
-    return result
+    return RawJSONResponse(views.encode_allocations(result), headers=headers)
+
+
+@app.post(
+    "/allocations/query",
+)
+@inject
+async def allocations_query_endpoint(
+        query: AllocationsQueryRequest,
+        read_model: Optional[redis.RedisReadModel] = Depends(
+            Provide[Container.read_model]
+        ),
+):
+    uow = read_only_uow()
+
+    async def ndjson_lines():
+        lines = []
+        async for orderid, allocations in views.allocations_for_orders(
+                query.orderids,
+                uow,
+                read_model=read_model,
+        ):
+            lines.append(
+                codec.JsonBackend.dumps({"orderid": orderid, "allocations": allocations})
+            )
+            if len(lines) >= views.QUERY_CHUNK_SIZE:
+                yield b"\n".join(lines) + b"\n"
+                lines = []
+        if lines:
+            yield b"\n".join(lines) + b"\n"
+
+    return StreamingResponse(
+        ndjson_lines(),
+        media_type="application/x-ndjson",
+    )
+
+
+@app.get(
+    "/changes",
+)
+async def changes_endpoint(
+        after: int = Query(0, ge=0),
+        limit: int = Query(1_000, ge=1),
+        wait: float = Query(0.0, ge=0),
+):
+    """ ``after`` 커서 뒤의 읽기 모델 변경을 돌려준다. 응답의 ``next`` 를 다음 ``after`` 로 넘긴다.
+
+    ``wait`` 초 동안 새 변경을 기다릴 수 있다(long-poll). 변경이 없으면 빈 목록을 돌려준다.
+    """
+    rows = await views.changes(
+        after,
+        min(limit, container.config.changes.CHANGES_MAX_LIMIT()),
+        read_only_uow(),
+        wait=min(wait, container.config.changes.CHANGES_MAX_WAIT()),
+        poll_interval=container.config.changes.CHANGES_POLL_INTERVAL(),
+    )
+    return RawJSONResponse(views.encode_changes(rows, after))
+
+
+def export_response(query, name: str, fmt: str, gzip: bool):
+    async def body():
+        async with read_only_uow() as uow:
+            async for chunk in exports.export(uow.session, query, fmt=fmt, gzip=gzip):
+                yield chunk
+
+    filename = f"{name}.{fmt}.gz" if gzip else f"{name}.{fmt}"
+    return StreamingResponse(
+        body(),
+        media_type="application/gzip" if gzip else exports.MEDIA_TYPES[fmt],
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
+
+
+@app.get(
+    "/exports/allocations",
+)
+async def export_allocations_endpoint(
+        format: Literal["ndjson", "csv"] = exports.NDJSON,
+        gzip: bool = False,
+):
+    return export_response(exports.ALLOCATIONS_QUERY, "allocations", format, gzip)
+
+
+@app.get(
+    "/exports/stock",
+)
+async def export_stock_endpoint(
+        format: Literal["ndjson", "csv"] = exports.NDJSON,
+        gzip: bool = False,
+):
+    return export_response(exports.STOCK_QUERY, "stock", format, gzip)
 
 
 @app.post(
@@ -108,23 +471,145 @@ async def allocations_view_endpoint(order_id: str):
 )
 @inject
 async def deallocate_endpoint(
-        order_line: model.OrderLine,
+        order_line: OrderLineRequest,
+        response: Response,
+        idempotency_key: Optional[str] = Header(None),
+        store: idempotency.IdempotencyStore = Depends(Provide[Container.idempotency_store]),
+        dependencies: dict = Depends(Provide[Container.bus_dependencies]),
 ):
-    try:
-        event = commands.Deallocate(
-            order_id=order_line.orderid,
-            sku=order_line.sku,
-            qty=order_line.qty,
-        )
-        await messagebus.handle(
-            event, uow=unit_of_work.SqlAlchemyUnitOfWork(db.session_factory),
-        )
+    async def run():
+        try:
+            event = commands.Deallocate(
+                order_id=order_line.orderid,
+                sku=order_line.sku,
+                qty=order_line.qty,
+            )
+            await messagebus.handle(
+                event,
+                uow=unit_of_work.SqlAlchemyUnitOfWork(db.session_factory),
+                **dependencies,
+            )
+
+        except (model.OutOfStock, handlers.InvalidSku) as e:
+            raise HTTPException(
+                detail=str(e),
+                status_code=status.HTTP_400_BAD_REQUEST,
+            ) from e
+
+        else:
+            return {"message": "deallocation done."}
+
+    return await idempotent(
+        store, idempotency_key, "deallocate", order_line, response, run,
+        status_code=status.HTTP_200_OK,
+    )
 
-    except (model.OutOfStock, handlers.InvalidSku) as e:
-        raise HTTPException(
-            detail=str(e),
-            status_code=status.HTTP_400_BAD_REQUEST,
-        ) from e
 
-    else:
-        return {"message": "deallocation done."}
+def sse_frame(event: events.Event) -> bytes:
+    metadata = envelope.stamp(event)
+    return b"id: %s\nevent: %s\ndata: %s\n\n" % (
+        metadata.event_id.encode(),
+        metadata.type.encode(),
+        envelope.encode(event),
+    )
+
+
+@app.get(
+    "/events",
+)
+@inject
+async def events_endpoint(
+        sku: Optional[List[str]] = Query(None),
+        orderid: Optional[List[str]] = Query(None),
+        event_hub: hub.EventHub = Depends(Provide[Container.event_hub]),
+):
+    """ 할당 변경(Allocated/Deallocated/OutOfStock)을 SSE 로 흘려보낸다.
+
+    ``sku`` / ``orderid`` 로 거를 수 있다. 뒤처져서 끊기면 ``dropped`` 이벤트를 보내고 닫는다.
+    ``SSE_SOURCE=broker`` 면 다른 API 워커와 컨슈머의 변경도 받는다.
+    """
+    subscription = event_hub.subscribe(skus=sku, orderids=orderid)
+    heartbeat = container.config.stream.SSE_HEARTBEAT_INTERVAL()
+
+    async def frames():
+        try:
+            # 프록시가 연결을 버퍼링하거나 끊지 않도록 바로 한 번 보낸다
+            yield b": connected\n\n"
+            while True:
+                try:
+                    event = await subscription.get(timeout=heartbeat)
+                except hub.SlowConsumer:
+                    yield b"event: dropped\ndata: {}\n\n"
+                    return
+                yield b": keepalive\n\n" if event is None else sse_frame(event)
+        finally:
+            subscription.close()
+
+    return StreamingResponse(
+        frames(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@app.get(
+    "/metrics",
+)
+@inject
+async def metrics_endpoint(
+        allocations_cache: cache.AllocationsCache = Depends(
+            Provide[Container.allocations_cache]
+        ),
+        read_model_writer: Optional[projection.ReadModelWriter] = Depends(
+            Provide[Container.projection]
+        ),
+        event_hub: hub.EventHub = Depends(Provide[Container.event_hub]),
+):
+    event_publisher = await batching_publisher()
+    sender = await spooling_publisher()
+    workers = command_workers()
+    availability_cache = await provide(container.availability)
+    hub_feed = await provide(container.hub_feed)
+    return {
+        "allocations_cache": allocations_cache.stats.as_dict(),
+        "read_model_writer": (
+            read_model_writer.stats.as_dict()
+            if read_model_writer is not None else None
+        ),
+        "publisher": (
+            event_publisher.stats.as_dict()
+            if event_publisher is not None else None
+        ),
+        "idempotency": (await provide(container.idempotency_store)).stats.as_dict(),
+        "admission": admission.stats.as_dict() if admission is not None else None,
+        "event_hub": event_hub.stats.as_dict(),
+        "hub_feed": (
+            hub_feed.stats.as_dict()
+            if hub_feed is not None else None
+        ),
+        "availability": (
+            availability_cache.stats.as_dict()
+            if availability_cache is not None else None
+        ),
+        "known_skus": (
+            container.known_skus().stats.as_dict()
+            if container.known_skus() is not None else None
+        ),
+        "notifications": (
+            container.notifier().stats.as_dict()
+            if container.notifier() is not None else None
+        ),
+        "command_workers": (
+            workers.stats.as_dict()
+            if workers is not None else None
+        ),
+        "spool": (
+            dict(
+                **sender.stats.as_dict(),
+                pending=len(sender),
+                breaker=sender.breaker.state,
+                **sender.breaker.stats.as_dict(),
+            )
+            if sender is not None else None
+        ),
+    }
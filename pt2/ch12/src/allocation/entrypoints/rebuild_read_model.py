@@ -0,0 +1,51 @@
+""" allocations_view를 쓰기 모델로부터 다시 만든다.
+
+    python -m pt2.ch12.src.allocation.entrypoints.rebuild_read_model --workers 8
+"""
+import argparse
+import asyncio
+
+from pt2.ch12.config import Settings
+from pt2.ch12.src.allocation import rebuild
+from pt2.ch12.src.allocation.adapters.postgres import AsyncSQLAlchemy
+
+
+async def run(db_uri: str, workers: int, chunk_size: int) -> rebuild.RebuildReport:
+    db = AsyncSQLAlchemy(db_uri=db_uri)
+    await db.connect()
+    try:
+        return await rebuild.rebuild_allocations_view(
+            db.engine,
+            workers=workers,
+            chunk_size=chunk_size,
+        )
+    finally:
+        await db.disconnect()
+
+
+def main():
+    settings = Settings()
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=settings.projection.READ_MODEL_REBUILD_WORKERS,
+    )
+    parser.add_argument(
+        "--chunk-size",
+        type=int,
+        default=settings.projection.READ_MODEL_REBUILD_CHUNK_SIZE,
+    )
+    args = parser.parse_args()
+
+    report = asyncio.run(
+        run(settings.data.DB_URI, args.workers, args.chunk_size)
+    )
+    print(
+        f"rebuilt {report.rows:,} rows in {report.chunks} chunks"
+        f" ({report.seconds:.1f}s, {report.rows_per_second:,.0f} rows/s)"
+    )
+
+
+if __name__ == "__main__":
+    main()
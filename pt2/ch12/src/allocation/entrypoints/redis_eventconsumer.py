@@ -0,0 +1,500 @@
+""" 레디스로 들어온 외부 메시지를 커맨드로 바꿔 메시지 버스에 넘긴다.
+
+EVENT_TRANSPORT=streams 면 컨슈머 그룹으로 읽으므로 API 와 따로 프로세스 수를 늘릴 수 있다.
+pubsub 이면 채널을 구독한다(모든 프로세스가 같은 메시지를 받으니 하나만 띄운다).
+
+    python -m pt2.ch12.src.allocation.entrypoints.redis_eventconsumer --consumer worker-1
+"""
+import argparse
+import asyncio
+import functools
+import logging
+import signal
+import time
+from dataclasses import dataclass
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple, Union
+
+from pt2.ch12.config import Settings
+from pt2.ch12.container import Container, provide
+from pt2.ch12.src.allocation.adapters import codec, envelope, orm, publisher, spool
+from pt2.ch12.src.allocation.adapters.dedup import DedupStore
+from pt2.ch12.src.allocation.adapters.redis import STREAM_FIELD, STREAMS
+from pt2.ch12.src.allocation.adapters.streams import (
+    PubSubConsumer,
+    StreamConsumer,
+    StreamMessage,
+    default_consumer_name,
+)
+from pt2.ch12.src.allocation.domain import commands
+from pt2.ch12.src.allocation.service_layer import messagebus, unit_of_work
+
+
+logger = logging.getLogger(__name__)
+
+Consumer = Union[StreamConsumer, PubSubConsumer]
+
+COMMAND_DECODERS: Dict[str, Callable[[dict], commands.Command]] = {
+    "change_batch_quantity": lambda data: commands.ChangeBatchQuantity(
+        ref=data["batchref"],
+        qty=data["qty"],
+    ),
+}
+
+
+class InvalidMessage(Exception):
+    pass
+
+
+@dataclass
+class Inbound:
+    message: StreamMessage
+    command: commands.Command
+    # 같은 키끼리는 받은 순서대로 하나씩 처리한다
+    key: str
+    # 봉투의 이벤트 ID. 봉투가 없으면 스트림 항목 ID로 대신한다
+    event_id: Optional[str] = None
+
+
+@dataclass
+class ConsumerStats:
+    received: int = 0
+    handled: int = 0
+    failed: int = 0
+    dropped: int = 0
+    duplicates: int = 0
+    retries: int = 0
+    deferred: int = 0
+    redelivered: int = 0
+    taken_over: int = 0
+    dead_lettered: int = 0
+    batches: int = 0
+    in_flight: int = 0
+    last_lag: float = 0.0
+    max_lag: float = 0.0
+
+    def as_dict(self) -> dict:
+        return dict(
+            received=self.received,
+            handled=self.handled,
+            failed=self.failed,
+            dropped=self.dropped,
+            duplicates=self.duplicates,
+            retries=self.retries,
+            deferred=self.deferred,
+            redelivered=self.redelivered,
+            taken_over=self.taken_over,
+            dead_lettered=self.dead_lettered,
+            batches=self.batches,
+            in_flight=self.in_flight,
+            last_lag=self.last_lag,
+            max_lag=self.max_lag,
+        )
+
+
+def decode(message: StreamMessage) -> Inbound:
+    try:
+        metadata, data = envelope.unwrap(codec.JsonBackend.loads(message.fields[STREAM_FIELD]))
+        command = COMMAND_DECODERS[message.stream](data)
+        # 배치 변경 메시지에는 보통 SKU가 없어서 그때는 배치 단위로 순서를 지킨다
+        key = data.get("sku") or getattr(command, "sku", None) or getattr(command, "ref")
+    except (AttributeError, KeyError, TypeError, ValueError) as e:
+        raise InvalidMessage(f"cannot decode {message}") from e
+
+    if metadata is not None:
+        event_id = metadata.event_id
+    else:
+        event_id = f"{message.stream}:{message.id}" if message.id else None
+    return Inbound(message=message, command=command, key=str(key), event_id=event_id)
+
+
+def decode_batch(
+        messages: List[StreamMessage],
+) -> Tuple[List[Inbound], List[StreamMessage]]:
+    """ 읽어온 배치를 한번에 디코딩한다. 디코딩할 수 없는 메시지는 따로 돌려준다. """
+    decoded, invalid = [], []
+    for message in messages:
+        try:
+            decoded.append(decode(message))
+        except InvalidMessage as ex:
+            logger.exception(f'Dropping message... detail: {ex}')
+            invalid.append(message)
+    return decoded, invalid
+
+
+def message_lag(message: StreamMessage, now: float) -> float:
+    """ 스트림 ID 앞부분은 XADD 된 시각(ms)이다. pub/sub 메시지는 알 수 없다. """
+    if not message.id:
+        return 0.0
+    return max(now - int(message.id.split("-")[0]) / 1000, 0.0)
+
+
+def stream_id_order(message_id: str) -> Tuple[int, int]:
+    milliseconds, _, sequence = message_id.partition("-")
+    return int(milliseconds), int(sequence or 0)
+
+
+class EventConsumer:
+    """ 읽어온 배치를 키(SKU)별 레인으로 나눠 ``concurrency`` 개까지 나란히 처리한다.
+
+    한 레인 안에서는 순서대로 처리한다. 실패한 메시지는 ``retries`` 번까지 레인 안에서
+    다시 해보고, 그래도 실패하면 그 뒤 메시지와 함께 ACK 하지 않은 채 들고 있는다.
+    스트림이면 그 키를 막아두고, 이후 배치에서 온 같은 키의 새 메시지도 처리하지 않고 들고 있는다.
+    들고 있는 메시지는 ``redeliver_interval`` 마다 ID 순서대로 다시 처리하므로 키별 순서가 지켜진다.
+    다시 처리하기 전에 PEL 을 보고, 맨 앞 메시지를 다른 컨슈머가 가져갔거나 이미 ACK 됐으면
+    더는 기다리지 않는다. ``max_deliveries`` 번 전달되고도 실패한 메시지는 데드 레터로 옮긴다.
+    ``stop`` 이 설정되면 새로 읽지 않고 진행 중인 배치를 ``drain_timeout`` 까지 마무리한다.
+    ``dedup`` 을 주면 이미 처리한 이벤트 ID는 메시지 버스에 넘기지 않고 ACK 만 한다.
+    """
+
+    def __init__(
+            self,
+            consumer: Consumer,
+            handle: Callable[[commands.Command], Awaitable],
+            concurrency: int = 16,
+            drain_timeout: float = 30.0,
+            metrics_interval: float = 10.0,
+            dedup: Optional[DedupStore] = None,
+            retries: int = 0,
+            retry_backoff: float = 0.1,
+            max_deliveries: int = 5,
+            redeliver_interval: float = 1.0,
+            clock: Callable[[], float] = time.time,
+    ):
+        self._consumer = consumer
+        self._handle = handle
+        self._dedup = dedup
+        self._retries = retries
+        self._retry_backoff = retry_backoff
+        self._max_deliveries = max_deliveries
+        self._redeliver_interval = redeliver_interval
+        # 키별로 처리하지 못하고 들고 있는 메시지. 맨 앞 것부터 처리한다
+        self._blocked: Dict[str, List[Inbound]] = {}
+        self._next_redelivery = 0.0
+        self._slots = asyncio.Semaphore(concurrency)
+        self._drain_timeout = drain_timeout
+        self._metrics_interval = metrics_interval
+        self._clock = clock
+        self.stats = ConsumerStats()
+
+    async def run(self, stop: asyncio.Event):
+        await self._consumer.start()
+        reporter = asyncio.create_task(self._report_periodically())
+        stopping = asyncio.create_task(stop.wait())
+        try:
+            while not stop.is_set():
+                if self._blocked and self._clock() >= self._next_redelivery:
+                    batch = asyncio.create_task(self.redeliver())
+                else:
+                    reading = asyncio.create_task(self._consumer.read())
+                    await asyncio.wait({reading, stopping}, return_when=asyncio.FIRST_COMPLETED)
+                    if not reading.done():
+                        # 읽는 도중에 멈추면 받은 메시지는 ACK 되지 않았으니 나중에 다시 온다
+                        reading.cancel()
+                        break
+                    batch = asyncio.create_task(self.process(reading.result()))
+
+                await asyncio.wait({batch, stopping}, return_when=asyncio.FIRST_COMPLETED)
+                if not batch.done():
+                    await self._drain(batch)
+                    break
+                batch.result()
+            logger.info(f'Consumer {self._consumer.consumer} stopped, {self.stats.as_dict()}')
+        finally:
+            stopping.cancel()
+            reporter.cancel()
+            await self._consumer.close()
+
+    async def process(self, messages: List[StreamMessage]):
+        if not messages:
+            return
+
+        self.stats.batches += 1
+        self.stats.received += len(messages)
+        decoded, invalid = decode_batch(messages)
+        self.stats.dropped += len(invalid)
+
+        lanes: Dict[str, List[Inbound]] = {}
+        for inbound in decoded:
+            lanes.setdefault(inbound.key, []).append(inbound)
+
+        done = await asyncio.gather(*(self._run_lane(lane) for lane in lanes.values()))
+        await self._consumer.ack(invalid + [message for lane in done for message in lane])
+
+    async def redeliver(self):
+        """ 들고 있는 메시지를 키별로 맨 앞부터 다시 처리한다. """
+        self._next_redelivery = self._clock() + self._redeliver_interval
+        heads = [blocked[0].message for blocked in self._blocked.values()]
+        try:
+            mine = await self._consumer.redeliver(heads)
+        except Exception as ex:
+            logger.exception(f'Exception redelivering {len(heads)} blocked keys... detail: {ex}')
+            return
+
+        for blocked in list(self._blocked.values()):
+            head = blocked[0]
+            if head.message.id not in mine:
+                # 다른 컨슈머가 가져갔거나 이미 ACK 됐다. 그 메시지는 그쪽에서 처리한다
+                self.stats.taken_over += 1
+                logger.warning(f'Unblocking {head.key}, {head.message.id} is no longer pending here')
+                self._resolve(head)
+
+        lanes = [list(blocked) for blocked in self._blocked.values()]
+        self.stats.redelivered += sum(len(lane) for lane in lanes)
+        done = await asyncio.gather(*(self._run_lane(lane) for lane in lanes))
+        await self._consumer.ack([message for lane in done for message in lane])
+
+    async def _run_lane(self, lane: List[Inbound]) -> List[StreamMessage]:
+        done = []
+        async with self._slots:
+            for index, inbound in enumerate(lane):
+                if self._waits(inbound):
+                    self._defer(lane[index:])
+                    break
+
+                if not await self._claim(inbound):
+                    self.stats.duplicates += 1
+                    self._resolve(inbound)
+                    done.append(inbound.message)
+                    continue
+
+                self.stats.in_flight += 1
+                try:
+                    await self._handle_with_retries(inbound)
+                except Exception as ex:
+                    self.stats.failed += 1
+                    logger.exception(f'Exception handling {inbound.message}... detail: {ex}')
+                    await self._release(inbound)
+                    if await self._give_up(inbound, ex):
+                        self._resolve(inbound)
+                        continue
+                    self._defer(lane[index:])
+                    break
+                finally:
+                    self.stats.in_flight -= 1
+
+                self.stats.handled += 1
+                self._resolve(inbound)
+                self._record_lag(message_lag(inbound.message, self._clock()))
+                done.append(inbound.message)
+        return done
+
+    async def _handle_with_retries(self, inbound: Inbound):
+        for attempt in range(self._retries + 1):
+            try:
+                return await self._handle(inbound.command)
+            except Exception as ex:
+                if attempt == self._retries:
+                    raise
+                self.stats.retries += 1
+                logger.warning(f'Retrying {inbound.message}... detail: {ex}')
+                await asyncio.sleep(self._retry_backoff * 2 ** attempt)
+
+    async def _give_up(self, inbound: Inbound, ex: Exception) -> bool:
+        """ 더 붙잡지 않을 메시지면 True. PEL 에서 이미 다른 컨슈머 몫이 됐거나,
+        ``max_deliveries`` 번 전달되고도 실패해서 데드 레터로 옮긴 경우다. """
+        if not inbound.message.id:
+            return False
+        try:
+            pending = (await self._consumer.pending([inbound.message])).get(inbound.message.id)
+            if pending is None or pending.consumer != self._consumer.consumer:
+                self.stats.taken_over += 1
+                return True
+            if pending.deliveries < self._max_deliveries:
+                return False
+            await self._consumer.dead_letter(inbound.message, repr(ex))
+        except Exception as e:
+            logger.exception(f'Exception checking deliveries of {inbound.message}... detail: {e}')
+            return False
+
+        self.stats.dead_lettered += 1
+        logger.error(f'Dead-lettered {inbound.message} after {pending.deliveries} deliveries')
+        return True
+
+    def _waits(self, inbound: Inbound) -> bool:
+        """ 키가 막혀 있고 이 메시지가 그 키에서 다음 차례가 아니면 True. """
+        blocked = self._blocked.get(inbound.key)
+        return blocked is not None and blocked[0].message.id != inbound.message.id
+
+    def _defer(self, inbounds: List[Inbound]):
+        """ 처리하지 못한 메시지를 키에 걸어둔다. pub/sub 메시지는 다시 처리할 수 없으니 걸지 않는다. """
+        for inbound in inbounds:
+            if not inbound.message.id:
+                continue
+            blocked = self._blocked.setdefault(inbound.key, [])
+            if all(held.message.id != inbound.message.id for held in blocked):
+                self.stats.deferred += 1
+                blocked.append(inbound)
+                blocked.sort(key=lambda held: stream_id_order(held.message.id))
+
+    def _resolve(self, inbound: Inbound):
+        blocked = self._blocked.get(inbound.key)
+        if blocked and blocked[0].message.id == inbound.message.id:
+            blocked.pop(0)
+            if not blocked:
+                del self._blocked[inbound.key]
+
+    async def _claim(self, inbound: Inbound) -> bool:
+        if self._dedup is None or inbound.event_id is None:
+            return True
+        return await self._dedup.claim(inbound.event_id)
+
+    async def _release(self, inbound: Inbound):
+        if self._dedup is None or inbound.event_id is None:
+            return
+        try:
+            await self._dedup.release(inbound.event_id)
+        except Exception as ex:
+            logger.exception(f'Exception releasing {inbound.event_id}... detail: {ex}')
+
+    async def _drain(self, batch: asyncio.Task):
+        """ 진행 중인 배치를 기다린다. 시간이 지나면 취소하고, ACK 못 한 메시지는 다시 오게 둔다. """
+        try:
+            await asyncio.wait_for(batch, timeout=self._drain_timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f'Gave up draining after {self._drain_timeout}s')
+
+    async def _report_periodically(self):
+        while True:
+            await asyncio.sleep(self._metrics_interval)
+            metrics = self.stats.as_dict()
+            logger.info(f'Consumer {self._consumer.consumer}: {metrics}')
+            try:
+                await self._consumer.report(metrics)
+            except Exception as ex:
+                logger.exception(f'Exception reporting metrics... detail: {ex}')
+
+    def _record_lag(self, lag: float):
+        self.stats.last_lag = lag
+        self.stats.max_lag = max(self.stats.max_lag, lag)
+
+
+async def consume(
+        consumer: Consumer,
+        uow_factory: Callable[[], unit_of_work.AbstractUnitOfWork],
+        stop: asyncio.Event,
+        concurrency: int = 16,
+        drain_timeout: float = 30.0,
+        metrics_interval: float = 10.0,
+        dedup: Optional[DedupStore] = None,
+        retries: int = 0,
+        retry_backoff: float = 0.1,
+        max_deliveries: int = 5,
+        redeliver_interval: float = 1.0,
+        **dependencies,
+) -> ConsumerStats:
+    async def handle(command: commands.Command):
+        await messagebus.handle(command, uow=uow_factory(), **dependencies)
+
+    event_consumer = EventConsumer(
+        consumer,
+        handle,
+        concurrency=concurrency,
+        drain_timeout=drain_timeout,
+        metrics_interval=metrics_interval,
+        dedup=dedup,
+        retries=retries,
+        retry_backoff=retry_backoff,
+        max_deliveries=max_deliveries,
+        redeliver_interval=redeliver_interval,
+    )
+    await event_consumer.run(stop)
+    return event_consumer.stats
+
+
+async def run(consumer_name: str):
+    container = Container()
+    broker = container.config.broker
+    db = container.db()
+    await db.connect()
+    db.init_session_factory()
+
+    session = await provide(container.redis_pool)
+    if broker.EVENT_TRANSPORT() == STREAMS:
+        consumer = StreamConsumer(
+            session,
+            streams=list(COMMAND_DECODERS),
+            group=broker.CONSUMER_GROUP(),
+            consumer=consumer_name,
+            batch_size=broker.CONSUMER_BATCH_SIZE(),
+            block_ms=broker.CONSUMER_BLOCK_MS(),
+            claim_idle_ms=broker.CONSUMER_CLAIM_IDLE_MS(),
+            dead_letter_stream=broker.CONSUMER_DEAD_LETTER_STREAM(),
+        )
+    else:
+        consumer = PubSubConsumer(
+            session,
+            channels=list(COMMAND_DECODERS),
+            consumer=consumer_name,
+            batch_size=broker.CONSUMER_BATCH_SIZE(),
+            block_ms=broker.CONSUMER_BLOCK_MS(),
+        )
+
+    channel = await provide(container.event_channel)
+    sender = await provide(container.raw_channel)
+    # 컨슈머에는 SSE 구독자가 없으므로 피드로 보내기만 한다
+    hub_feed = await provide(functools.partial(container.hub_feed, relay=False))
+    # 시작한 순서의 반대로 닫는다
+    services = [
+        sender if isinstance(sender, spool.SpoolingPublisher) else None,
+        channel if isinstance(channel, publisher.BatchingPublisher) else None,
+        container.projection(),
+        container.mailer() if container.notifier() is not None else None,
+        container.notifier(),
+        container.known_skus(),
+        hub_feed,
+    ]
+    services = [service for service in services if service is not None]
+    for service in services:
+        start = getattr(service, "start", None)
+        if start is not None:
+            await start()
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(signum, stop.set)
+
+    logger.info(f'Consumer {consumer_name} started')
+    try:
+        await consume(
+            consumer,
+            lambda: unit_of_work.SqlAlchemyUnitOfWork(db.session_factory),
+            stop,
+            concurrency=broker.CONSUMER_CONCURRENCY(),
+            drain_timeout=broker.CONSUMER_DRAIN_TIMEOUT(),
+            metrics_interval=broker.CONSUMER_METRICS_INTERVAL(),
+            dedup=DedupStore(
+                window=broker.DEDUP_WINDOW(),
+                session=session if broker.DEDUP_SHARED() else None,
+                ttl=broker.DEDUP_TTL(),
+                prefix=f"dedup:{broker.CONSUMER_GROUP()}",
+            ),
+            retries=broker.CONSUMER_RETRIES(),
+            retry_backoff=broker.CONSUMER_RETRY_BACKOFF(),
+            max_deliveries=broker.CONSUMER_MAX_DELIVERIES(),
+            redeliver_interval=broker.CONSUMER_REDELIVER_INTERVAL(),
+            **await provide(container.bus_dependencies),
+        )
+    finally:
+        for service in reversed(services):
+            await service.close()
+        await db.disconnect()
+        await container.shutdown_resources()
+
+
+def main():
+    settings = Settings()
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--consumer",
+        default=settings.broker.CONSUMER_NAME or default_consumer_name(),
+    )
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    orm.start_mappers()
+    asyncio.run(run(args.consumer))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,22 @@
+from typing import Any
+
+from fastapi.responses import JSONResponse, Response
+
+from pt2.ch12.src.allocation.adapters import codec
+
+
+class FastJSONResponse(JSONResponse):
+    """ ``codec`` 의 JSON 백엔드(orjson 이 깔려 있으면 orjson)로 바로 렌더링한다.
+
+    엔드포인트가 이 응답을 직접 돌려주면 FastAPI 가 ``jsonable_encoder`` 로
+    내용을 한 번 더 훑지 않는다. 내용은 이미 JSON 으로 바꿀 수 있는 값이어야 한다.
+    """
+
+    def render(self, content: Any) -> bytes:
+        return codec.JsonBackend.dumps(content)
+
+
+class RawJSONResponse(Response):
+    """ 이미 인코딩한 JSON 바이트를 그대로 내보낸다. """
+
+    media_type = "application/json"
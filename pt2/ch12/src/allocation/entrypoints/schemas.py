@@ -1,7 +1,7 @@
 from datetime import date
-from typing import Optional
+from typing import List, Optional
 
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 
 
 class OrderLineRequest(BaseModel):
@@ -15,3 +15,7 @@ class BatchRequest(BaseModel):
     sku: str
     qty: int
     eta: Optional[date]
+
+
+class AllocationsQueryRequest(BaseModel):
+    orderids: List[str] = Field(..., max_items=100_000)
@@ -0,0 +1,91 @@
+import csv
+import io
+import json
+import zlib
+from typing import AsyncIterator, Callable, Iterable, Sequence
+
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.sql import text
+
+
+# 한번에 커서에서 당겨와 인코딩할 행 수. 메모리 사용량은 이 값에만 비례한다
+EXPORT_PARTITION_SIZE = 5_000
+
+NDJSON = "ndjson"
+CSV = "csv"
+
+MEDIA_TYPES = {
+    NDJSON: "application/x-ndjson",
+    CSV: "text/csv",
+}
+
+ALLOCATIONS_QUERY = text(
+    """
+    SELECT orderid, sku, batchref
+    FROM allocations_view
+    """
+)
+
+STOCK_QUERY = text(
+    """
+    SELECT b.reference, b.sku, b.eta, b.purchased_quantity,
+           COALESCE(SUM(ol.qty), 0) AS allocated_quantity,
+           b.purchased_quantity - COALESCE(SUM(ol.qty), 0) AS available_quantity
+    FROM batches AS b
+    LEFT JOIN allocations AS a ON a.batch_id = b.id
+    LEFT JOIN order_lines AS ol ON ol.id = a.orderline_id
+    GROUP BY b.id, b.reference, b.sku, b.eta, b.purchased_quantity
+    """
+)
+
+
+def encode_ndjson(columns: Sequence[str], rows: Iterable[Sequence]) -> bytes:
+    return "".join(
+        json.dumps(dict(zip(columns, row)), default=str) + "\n"
+        for row in rows
+    ).encode()
+
+
+def encode_csv(rows: Iterable[Sequence]) -> bytes:
+    buffer = io.StringIO()
+    csv.writer(buffer, lineterminator="\n").writerows(rows)
+    return buffer.getvalue().encode()
+
+
+async def export(
+        session: AsyncSession,
+        query,
+        fmt: str = NDJSON,
+        gzip: bool = False,
+        partition_size: int = EXPORT_PARTITION_SIZE,
+) -> AsyncIterator[bytes]:
+    """ 서버 사이드 커서로 ``partition_size`` 행씩 읽어 인코딩한 조각을 차례로 내보낸다. """
+    if fmt not in MEDIA_TYPES:
+        raise ValueError(f"unknown export format {fmt}")
+
+    result = await session.stream(
+        query.execution_options(yield_per=partition_size),
+    )
+    columns = list(result.keys())
+
+    if fmt == NDJSON:
+        encode: Callable[[Sequence], bytes] = lambda rows: encode_ndjson(columns, rows)
+    else:
+        encode = encode_csv
+
+    compressor = zlib.compressobj(wbits=31) if gzip else None
+
+    if fmt == CSV:
+        header = encode_csv([columns])
+        yield compressor.compress(header) if compressor else header
+
+    async for partition in result.partitions(partition_size):
+        chunk = encode(partition)
+        if compressor is not None:
+            chunk = compressor.compress(chunk)
+            if not chunk:
+                continue
+        yield chunk
+
+    if compressor is not None:
+        yield compressor.flush()
@@ -0,0 +1,182 @@
+import asyncio
+import logging
+import time
+from dataclasses import dataclass
+from typing import List, Optional, Tuple
+
+from sqlalchemy import MetaData, Table, insert, select, text
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncEngine
+
+from pt2.ch12.src.allocation.adapters.orm import (
+    allocations,
+    allocations_view,
+    batches,
+    order_lines,
+)
+
+
+logger = logging.getLogger(__name__)
+
+SHADOW_TABLE = "allocations_view_rebuild"
+RETIRED_TABLE = "allocations_view_retired"
+COLUMNS = [column.name for column in allocations_view.columns]
+
+shadow = Table(
+    SHADOW_TABLE,
+    MetaData(),
+    *(column.copy() for column in allocations_view.columns),
+)
+
+KeyRange = Tuple[int, Optional[int]]
+
+
+@dataclass
+class RebuildReport:
+    rows: int
+    chunks: int
+    seconds: float
+
+    @property
+    def rows_per_second(self) -> float:
+        return self.rows / self.seconds if self.seconds else 0.0
+
+
+async def rebuild_allocations_view(
+        engine: AsyncEngine,
+        workers: int = 4,
+        chunk_size: int = 50_000,
+) -> RebuildReport:
+    """ 쓰기 모델(batches/allocations/order_lines)에서 allocations_view를 다시 만든다.
+
+    allocations.id 기준 키셋 페이지로 구간을 나눠 여러 워커가 나란히 섀도 테이블에
+    대량으로 넣고(Postgres는 COPY), 마지막에 한 트랜잭션에서 테이블을 바꿔 끼운다.
+    다시 만드는 동안 지워진 할당은 섀도 테이블에 남을 수 있으니 쓰기가 적을 때 돌린다.
+    """
+    started = time.perf_counter()
+    await _create_shadow(engine)
+
+    ranges: asyncio.Queue = asyncio.Queue(maxsize=workers * 2)
+    counts: List[int] = []
+
+    async def produce() -> int:
+        produced = await _produce_ranges(engine, ranges, chunk_size)
+        for _ in range(workers):
+            await ranges.put(None)
+        return produced
+
+    tasks = [asyncio.create_task(produce())] + [
+        asyncio.create_task(_worker(engine, ranges, counts))
+        for _ in range(workers)
+    ]
+    try:
+        chunks, *_ = await asyncio.gather(*tasks)
+    except BaseException:
+        # 워커 하나가 죽으면 생산자가 가득 찬 큐에서 영영 기다리지 않도록 모두 멈춘다
+        for task in tasks:
+            task.cancel()
+        raise
+
+    await _swap_in_shadow(engine)
+
+    report = RebuildReport(
+        rows=sum(counts),
+        chunks=chunks,
+        seconds=time.perf_counter() - started,
+    )
+    logger.info(
+        f'Rebuilt allocations_view: {report.rows} rows in {report.chunks} chunks,'
+        f' {report.rows_per_second:.0f} rows/s'
+    )
+    return report
+
+
+async def _create_shadow(engine: AsyncEngine):
+    async with engine.begin() as conn:
+        await conn.run_sync(shadow.drop, checkfirst=True)
+        await conn.run_sync(shadow.create)
+
+
+async def _produce_ranges(
+        engine: AsyncEngine,
+        ranges: asyncio.Queue,
+        chunk_size: int,
+) -> int:
+    """ ``(after, upto]`` 구간을 만든다. 다음 경계는 인덱스를 타고 chunk_size 만큼 건너뛰어 찾는다. """
+    chunks = 0
+    after = 0
+    async with engine.connect() as conn:
+        while True:
+            upto = (
+                await conn.execute(
+                    select(allocations.c.id)
+                    .where(allocations.c.id > after)
+                    .order_by(allocations.c.id)
+                    .offset(chunk_size - 1)
+                    .limit(1)
+                )
+            ).scalar_one_or_none()
+
+            chunks += 1
+            await ranges.put((after, upto))
+            if upto is None:
+                return chunks
+            after = upto
+
+
+async def _worker(engine: AsyncEngine, ranges: asyncio.Queue, counts: List[int]):
+    while True:
+        key_range: Optional[KeyRange] = await ranges.get()
+        if key_range is None:
+            return
+
+        async with engine.begin() as conn:
+            rows = (await conn.execute(_source_query(*key_range))).all()
+            if rows:
+                await _bulk_insert(conn, rows)
+        counts.append(len(rows))
+
+
+def _source_query(after: int, upto: Optional[int]):
+    query = (
+        select(
+            order_lines.c.orderid,
+            order_lines.c.sku,
+            batches.c.reference.label("batchref"),
+        )
+        .select_from(
+            allocations
+            .join(order_lines, allocations.c.orderline_id == order_lines.c.id)
+            .join(batches, allocations.c.batch_id == batches.c.id)
+        )
+        .where(allocations.c.id > after)
+    )
+    if upto is not None:
+        query = query.where(allocations.c.id <= upto)
+    return query
+
+
+async def _bulk_insert(conn: AsyncConnection, rows):
+    if conn.dialect.name == "postgresql":
+        raw = await conn.get_raw_connection()
+        await raw.driver_connection.copy_records_to_table(
+            SHADOW_TABLE,
+            records=[tuple(row) for row in rows],
+            columns=COLUMNS,
+        )
+        return
+
+    await conn.execute(insert(shadow), [dict(row._mapping) for row in rows])
+
+
+async def _swap_in_shadow(engine: AsyncEngine):
+    async with engine.begin() as conn:
+        if conn.dialect.name == "sqlite":
+            # pysqlite는 DDL 앞에 BEGIN을 넣지 않아서 직접 열어야 이름 바꾸기가 한 트랜잭션이 된다
+            await conn.exec_driver_sql("BEGIN")
+        await conn.execute(text(f"DROP TABLE IF EXISTS {RETIRED_TABLE}"))
+        await conn.execute(text(f"ALTER TABLE allocations_view RENAME TO {RETIRED_TABLE}"))
+        await conn.execute(text(f"ALTER TABLE {SHADOW_TABLE} RENAME TO allocations_view"))
+        await conn.execute(text(f"DROP TABLE {RETIRED_TABLE}"))
+        # 내용이 바뀌었을 수 있으니 클라이언트가 들고 있는 ETag 를 모두 무효로 만든다
+        await conn.execute(text("UPDATE allocations_view_versions SET version = version + 1"))
+
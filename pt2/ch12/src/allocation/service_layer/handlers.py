@@ -1,13 +1,18 @@
 from __future__ import annotations
 
-from dataclasses import asdict
-from typing import TYPE_CHECKING
+from typing import Optional, Tuple, TYPE_CHECKING
 
 from sqlalchemy import text
 
 from pt2.ch12.src.allocation.adapters import (
+    availability as sku_availability,
+    cache as read_cache,
     email,
+    hub as event_hub,
+    notifications,
+    projection as read_projection,
     redis,
+    skus,
 )
 from pt2.ch12.src.allocation.domain import (
     commands,
@@ -24,9 +29,28 @@ class InvalidSku(Exception):
     ...
 
 
+async def check_sku(sku: str, known_skus: Optional[skus.KnownSkus]):
+    # 없는 것이 확실한 SKU 는 애그리거트를 읽지 않고 돌려보낸다
+    if known_skus is not None and not await known_skus.might_exist(sku):
+        raise InvalidSku(f'Invalid sku {sku}')
+
+
+def summarize(product: model.Product) -> Tuple[int, int]:
+    # 커밋하면 애그리거트 속성이 만료되므로 커밋 전에 읽어둔다
+    return product.version_number, product.max_available_quantity
+
+
+def unknown_sku(sku: str, known_skus: Optional[skus.KnownSkus]) -> InvalidSku:
+    if known_skus is not None:
+        known_skus.mark_missing(sku)
+    return InvalidSku(f'Invalid sku {sku}')
+
+
 async def add_batch(
         command: commands.CreateBatch,
         uow: unit_of_work.AbstractUnitOfWork,
+        known_skus: Optional[skus.KnownSkus] = None,
+        availability: Optional[sku_availability.AvailabilityCache] = None,
 ):
     async with uow:
         product = await uow.products.get(sku=command.sku)
@@ -35,7 +59,7 @@ async def add_batch(
             product = model.Product(sku=command.sku, batches=[])
             await uow.products.add(product)
 
-        product.batches.append(
+        product.add_batch(
             model.Batch(
                 reference=command.ref,
                 sku=command.sku,
@@ -43,23 +67,46 @@ async def add_batch(
                 eta=command.eta,
             )
         )
+        summary = summarize(product)
         await uow.commit()
 
+    if known_skus is not None:
+        known_skus.add(command.sku)
+    if availability is not None:
+        await availability.update(command.sku, *summary)
+
 
 async def allocate(
         command: commands.Allocate,
         uow: unit_of_work.AbstractUnitOfWork,
+        known_skus: Optional[skus.KnownSkus] = None,
+        availability: Optional[sku_availability.AvailabilityCache] = None,
 ) -> str:
     line = model.OrderLine(command.order_id, command.sku, command.qty)
+    await check_sku(line.sku, known_skus)
 
     async with uow:
+        # 돌려보낼 것 같을 때만 버전을 DB 에 물어서 요약이 지금 것인지 확인한다
+        if availability is not None and await availability.might_reject(line.sku, line.qty):
+            version = await uow.products.version(line.sku)
+            if version is None:
+                raise unknown_sku(line.sku, known_skus)
+            if await availability.rejects(line.sku, version, line.qty):
+                # 애그리거트를 읽지 않고, 배치가 없는 Product 로 같은 OutOfStock 을 낸다
+                product = model.Product(sku=line.sku, batches=[], version_number=version)
+                uow.products.seen.add(product)
+                return product.allocate(line)
+
         product = await uow.products.get(sku=line.sku)
         if product is None:
-            raise InvalidSku(f'Invalid sku {line.sku}')
+            raise unknown_sku(line.sku, known_skus)
 
         batchref = product.allocate(line)
+        summary = summarize(product)
         await uow.commit()
 
+    if availability is not None:
+        await availability.update(command.sku, *summary)
     return batchref
 
 
@@ -69,14 +116,25 @@ async def reallocate(
 ):
     async with uow:
         product = await uow.products.get(sku=event.sku)
-        product.messages.append(commands.Allocate(**asdict(event)))
+        product.messages.append(
+            commands.Allocate(
+                order_id=event.orderid,
+                sku=event.sku,
+                qty=event.qty,
+            )
+        )
         await uow.commit()
 
 
 async def send_out_of_stock_notification(
         event: events.OutOfStock,
         uow: unit_of_work.AbstractUnitOfWork,
+        notifier: Optional[notifications.OutOfStockNotifier] = None,
 ):
+    if notifier is not None:
+        notifier.notify(event.sku)
+        return
+
     await email.send_mail(
         'stock_admin@made.com',
         f'out of stock for {event.sku}',
@@ -86,28 +144,41 @@ async def send_out_of_stock_notification(
 async def deallocate(
         command: commands.Deallocate,
         uow: unit_of_work.AbstractUnitOfWork,
+        known_skus: Optional[skus.KnownSkus] = None,
+        availability: Optional[sku_availability.AvailabilityCache] = None,
 ):
     line = model.OrderLine(command.order_id, command.sku, command.qty)
+    await check_sku(line.sku, known_skus)
 
     async with uow:
         product = await uow.products.get(sku=line.sku)
 
         if product is None:
-            raise InvalidSku(f'Invalid sku {line.sku}')
+            raise unknown_sku(line.sku, known_skus)
 
         product.deallocate(line)
+        summary = summarize(product)
         await uow.commit()
 
+    if availability is not None:
+        await availability.update(command.sku, *summary)
+
 
 async def change_batch_quantity(
         command: commands.ChangeBatchQuantity,
         uow: unit_of_work.AbstractUnitOfWork,
+        availability: Optional[sku_availability.AvailabilityCache] = None,
 ):
     async with uow:
         product = await uow.products.get_by_batchref(batchref=command.ref)
         product.change_batch_quantity(command.ref, command.qty)
+        sku = product.sku
+        summary = summarize(product)
         await uow.commit()
 
+    if availability is not None:
+        await availability.update(sku, *summary)
+
 
 async def publish_allocate_event(
         event: events.Allocated,
@@ -120,7 +191,13 @@ async def publish_allocate_event(
 async def add_allocation_to_read_model(
         event: events.Allocated,
         uow: unit_of_work.SqlAlchemyUnitOfWork,
+        cache: Optional[read_cache.AllocationsCache] = None,
+        projection: Optional[read_projection.ReadModelWriter] = None,
 ):
+    if projection is not None:
+        await projection.add(event.orderid, event.sku, event.batchref)
+        return
+
     async with uow:
         await uow.session.execute(
             text(
@@ -135,13 +212,27 @@ async def add_allocation_to_read_model(
                 batchref=event.batchref,
             )
         )
+        await read_projection.bump_versions(uow.session, [event.orderid])
+        await read_projection.record_changes(uow.session, [(
+            read_projection.INSERT,
+            dict(orderid=event.orderid, sku=event.sku, batchref=event.batchref),
+        )])
         await uow.commit()
 
+    if cache is not None:
+        cache.invalidate(event.orderid)
+
 
 async def remove_allocation_from_read_model(
         event: events.Deallocated,
         uow: unit_of_work.SqlAlchemyUnitOfWork,
+        cache: Optional[read_cache.AllocationsCache] = None,
+        projection: Optional[read_projection.ReadModelWriter] = None,
 ):
+    if projection is not None:
+        await projection.remove(event.orderid, event.sku)
+        return
+
     async with uow:
         await uow.session.execute(
             text(
@@ -153,4 +244,54 @@ async def remove_allocation_from_read_model(
                 sku=event.sku,
             )
         )
+        await read_projection.bump_versions(uow.session, [event.orderid])
+        await read_projection.record_changes(uow.session, [(
+            read_projection.DELETE,
+            dict(orderid=event.orderid, sku=event.sku),
+        )])
         await uow.commit()
+
+    if cache is not None:
+        cache.invalidate(event.orderid)
+
+
+async def notify_subscribers(
+        event: events.Event,
+        hub: Optional[event_hub.EventHub] = None,
+        hub_feed: Optional[event_hub.BrokerFeed] = None,
+):
+    # 피드가 있으면 이 프로세스의 허브도 피드를 거쳐 받으므로 직접 넣지 않는다.
+    # 피드는 큐에 넣기만 하므로 브로커가 느려도 메시지 버스를 붙잡지 않는다
+    if hub_feed is not None:
+        hub_feed.broadcast(event)
+        return
+    if hub is None:
+        return
+
+    hub.publish(event)
+
+
+async def add_allocation_to_redis_read_model(
+        event: events.Allocated,
+        read_model: Optional[redis.RedisReadModel] = None,
+        cache: Optional[read_cache.AllocationsCache] = None,
+):
+    if read_model is None:
+        return
+
+    await read_model.add(event.orderid, event.sku, event.batchref)
+    if cache is not None:
+        cache.invalidate(event.orderid)
+
+
+async def remove_allocation_from_redis_read_model(
+        event: events.Deallocated,
+        read_model: Optional[redis.RedisReadModel] = None,
+        cache: Optional[read_cache.AllocationsCache] = None,
+):
+    if read_model is None:
+        return
+
+    await read_model.remove(event.orderid, event.sku)
+    if cache is not None:
+        cache.invalidate(event.orderid)
@@ -1,7 +1,9 @@
 from __future__ import annotations
 
+import inspect
 import logging
 from typing import (
+    Any,
     Callable,
     Dict,
     List,
@@ -29,12 +31,19 @@ class MessageBus:
         events.Allocated: [
             handlers.publish_allocate_event,
             handlers.add_allocation_to_read_model,
+            handlers.add_allocation_to_redis_read_model,
+            handlers.notify_subscribers,
         ],
         events.Deallocated: [
             handlers.remove_allocation_from_read_model,
+            handlers.remove_allocation_from_redis_read_model,
+            handlers.notify_subscribers,
             handlers.reallocate,
         ],
-        events.OutOfStock: [handlers.send_out_of_stock_notification],
+        events.OutOfStock: [
+            handlers.send_out_of_stock_notification,
+            handlers.notify_subscribers,
+        ],
     }   # type: Dict[Type[events.Event], List[Callable]]
     COMMAND_HANDLERS = {
         commands.Allocate: handlers.allocate,
@@ -44,33 +53,66 @@ class MessageBus:
     }   # type: Dict[Type[commands.Command], Callable]
 
 
+def inject_dependencies(
+        handler: Callable,
+        dependencies: Dict[str, Any],
+) -> Dict[str, Any]:
+    """ 핸들러 시그니처에 있는 이름의 의존성만 골라서 넘긴다. """
+    params = inspect.signature(handler).parameters
+    return {
+        name: dependency
+        for name, dependency in dependencies.items()
+        if name in params
+    }
+
+
 async def handle(
         message: Message,
         uow: unit_of_work.AbstractUnitOfWork,
         channel: Optional[redis.AsyncRedis, None] = None,
-):
+        **dependencies,
+) -> List[Any]:
+    """ 메시지와 그로부터 이어지는 이벤트를 모두 처리하고, 커맨드 핸들러의 반환값을 모아 돌려준다. """
+    dependencies = dict(uow=uow, channel=channel, **dependencies)
     queue: List[Message] = [message]
+    results: List[Any] = []
     while queue:
         message = queue.pop(0)
 
         if isinstance(message, events.Event):
-            await handle_event(message, queue, uow, channel)
+            await handle_event(message, queue, uow, dependencies)
         elif isinstance(message, commands.Command):
-            await handle_command(message, queue, uow)
+            results.append(await handle_command(message, queue, uow, dependencies))
         else:
             raise Exception(f'{message} was not a Command or Event')
 
+    # 성공했을 때만 버퍼를 비운다. 실패했으면 비우다 난 예외가 원래 예외(InvalidSku 등)를
+    # 덮지 않도록 그냥 올려보낸다. 버퍼는 다른 요청과 함께 쓰므로 버리지 않고,
+    # 앞서 커밋한 단계의 변경은 다음 flush 에 나간다
+    await after_handle(dependencies)
+    return results
+
+
+async def after_handle(dependencies: Dict[str, Any]):
+    """ 연쇄 처리가 성공하면 ``after_handle`` 을 가진 의존성(버퍼 등)에게 알린다. """
+    for dependency in dependencies.values():
+        hook = getattr(dependency, "after_handle", None)
+        if hook is not None:
+            await hook()
+
 
 async def handle_command(
         command: commands.Command,
         queue: List[Message],
         uow: unit_of_work.AbstractUnitOfWork,
+        dependencies: Dict[str, Any],
 ):
     logger.debug(f'Handling command {command}')
     try:
         handler = MessageBus.COMMAND_HANDLERS[type(command)]
-        await handler(command, uow)
+        result = await handler(command, **inject_dependencies(handler, dependencies))
         queue.extend(uow.collect_new_events())
+        return result
     except Exception as ex:
         logger.exception(f'Exception handling {command}... detail: {ex}')
         raise
@@ -80,12 +122,12 @@ async def handle_event(
         event: events.Event,
         queue: List[Message],
         uow: unit_of_work.AbstractUnitOfWork,
-        channel: redis.AsyncRedis,
+        dependencies: Dict[str, Any],
 ):
     for handler in MessageBus.EVENT_HANDLERS[type(event)]:
         try:
             logger.debug(f'Handling event {event} with {handler}')
-            await handler(event, uow, channel)
+            await handler(event, **inject_dependencies(handler, dependencies))
             queue.extend(uow.collect_new_events())
         except Exception as ex:
             logger.exception(f'Exception handling {event}... detail: {ex}')
@@ -1,11 +1,18 @@
 from __future__ import annotations
 
 import abc
-from typing import Protocol
+from typing import Optional, Protocol, TYPE_CHECKING
 
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from pt2.ch12.src.allocation.adapters import repository
+from pt2.ch12.src.allocation.adapters import envelope, repository
+
+if TYPE_CHECKING:
+    from pt2.ch12.src.allocation.adapters.replica import ReplicaLagGuard
+
+
+class ReadOnlyError(Exception):
+    ...
 
 
 class AbstractUnitOfWork(Protocol):
@@ -28,7 +35,18 @@ class AbstractUnitOfWork(Protocol):
     def collect_new_events(self):
         for product in self.products.seen:
             while product.messages:
-                yield product.messages.pop(0)
+                event = product.messages.pop(0)
+                envelope.stamp(event)
+                yield event
+
+    def stamp_new_events(self):
+        """ 쌓인 이벤트에 ID와 애그리거트 버전을 찍는다.
+
+        커밋하면 애그리거트 속성이 만료되어 버전을 읽을 수 없으니 커밋 전에 부른다.
+        """
+        for product in self.products.seen:
+            for event in product.messages:
+                envelope.stamp(event, aggregate_version=product.version_number)
 
 
 class SqlAlchemyUnitOfWork(AbstractUnitOfWork):
@@ -50,7 +68,42 @@ class SqlAlchemyUnitOfWork(AbstractUnitOfWork):
         await self.session.close()
 
     async def commit(self):
+        self.stamp_new_events()
         await self.session.commit()
 
     async def rollback(self):
         await self.session.rollback()
+
+
+class ReadOnlyUnitOfWork(SqlAlchemyUnitOfWork):
+    """ 조회 전용 UoW. 레플리카를 쓰되, 지연이 크면 프라이머리로 돌아간다. """
+
+    def __init__(
+            self,
+            session_factory,
+            primary_session_factory=None,
+            lag_guard: Optional[ReplicaLagGuard] = None,
+    ):
+        super().__init__(session_factory)
+        self._primary_session_factory = primary_session_factory
+        self._lag_guard = lag_guard
+        self.on_replica = True
+
+    async def __aenter__(self) -> AbstractUnitOfWork:
+        self.on_replica = (
+            self._lag_guard is None
+            or self._primary_session_factory is None
+            or await self._lag_guard.replica_is_fresh()
+        )
+        factory = (
+            self._session_factory
+            if self.on_replica else self._primary_session_factory
+        )
+        self.session: AsyncSession = factory()
+        self.products = repository.TrackingRepository(
+            repository.SqlAlchemyRepository(self.session)
+        )
+        return self
+
+    async def commit(self):
+        raise ReadOnlyError("read-only unit of work cannot commit")
@@ -1,21 +1,274 @@
+import asyncio
+import time
+from collections import defaultdict
+from typing import AsyncIterator, Callable, Dict, List, Optional, Sequence, Tuple
+
+from pt2.ch12.src.allocation.adapters import cache as read_cache, codec, redis
 from pt2.ch12.src.allocation.service_layer import unit_of_work
-from sqlalchemy.sql import text
+from sqlalchemy.sql import bindparam, text
+
+
+# IN 절 하나에 넣을 주문 수. 너무 크면 쿼리 플랜/바인드 파라미터 제한에 걸린다
+QUERY_CHUNK_SIZE = 500
+
+CHANGE_COLUMNS = ("seq", "op", "orderid", "sku", "batchref", "changed_at")
 
 
 async def allocations(
         orderid: str,
         uow: unit_of_work.SqlAlchemyUnitOfWork,
+        cache: Optional[read_cache.AllocationsCache] = None,
+        read_model: Optional[redis.RedisReadModel] = None,
+):
+    if cache is not None:
+        _, rows = await versioned_allocations(orderid, uow, cache=cache, read_model=read_model)
+        return rows
+
+    return await _load_allocations(orderid, uow, read_model)
+
+
+async def versioned_allocations(
+        orderid: str,
+        uow: unit_of_work.SqlAlchemyUnitOfWork,
+        cache: Optional[read_cache.AllocationsCache] = None,
+        read_model: Optional[redis.RedisReadModel] = None,
+        unchanged: Optional[Callable[[int], bool]] = None,
+) -> Tuple[Optional[int], Optional[list]]:
+    """ 주문의 ``(버전, 할당 목록)``.
+
+    버전을 먼저 읽어야 버전이 본문보다 새것이 되지 않는다. 둘은 한 UoW 에서 읽으므로
+    레플리카와 프라이머리에서 하나씩 읽히는 일이 없다. 캐시에는 둘을 한 항목으로 넣으므로
+    캐시가 오래됐어도 ETag 와 본문은 같은 시점의 것이고, 캐시 히트면 버전도 다시 묻지 않는다.
+
+    ``unchanged(버전)`` 이 True 면(클라이언트가 그 버전을 갖고 있으면) 캐시 미스여도
+    목록은 읽지 않고 ``(버전, None)`` 을 돌려준다.
+    """
+    if cache is None:
+        return await _load_versioned_allocations(orderid, uow, read_model, unchanged)
+
+    cached = cache.get(orderid)
+    if cached is not None:
+        return cached
+
+    if unchanged is not None:
+        version = await allocations_version(orderid, uow, read_model=read_model)
+        if version is not None and unchanged(version):
+            return version, None
+
+    async def load():
+        return await _load_versioned_allocations(orderid, uow, read_model)
+
+    return await cache.get_or_load(orderid, load)
+
+
+async def allocations_version(
+        orderid: str,
+        uow: unit_of_work.SqlAlchemyUnitOfWork,
+        read_model: Optional[redis.RedisReadModel] = None,
+) -> Optional[int]:
+    """ 주문의 읽기 모델이 바뀐 횟수. 한 번도 바뀐 적이 없으면 None. """
+    if read_model is not None:
+        return await read_model.version(orderid)
+
+    async with uow:
+        return await _select_version(orderid, uow)
+
+
+def etag(version: int) -> str:
+    return f'"{version}"'
+
+
+def etag_matches(if_none_match: Optional[str], tag: str) -> bool:
+    """ ``If-None-Match`` 는 약한 비교를 쓰므로 ``W/`` 접두사는 떼고 본다. """
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    return any(
+        candidate.strip().removeprefix("W/") == tag
+        for candidate in if_none_match.split(",")
+    )
+
+
+def encode_allocations(rows) -> bytes:
+    """ 행(``RowMapping`` 이나 읽기 모델의 dict)을 응답 본문 바이트로 바로 바꾼다.
+
+    ``jsonable_encoder`` 가 행마다 타입을 살피며 dict 로 바꾸는 과정을 건너뛴다.
+    """
+    return codec.JsonBackend.dumps(
+        [{"batchref": row["batchref"], "sku": row["sku"]} for row in rows]
+    )
+
+
+async def _load_allocations(
+        orderid: str,
+        uow: unit_of_work.SqlAlchemyUnitOfWork,
+        read_model: Optional[redis.RedisReadModel] = None,
+):
+    if read_model is not None:
+        return await read_model.allocations(orderid)
+    return await _select_allocations(orderid, uow)
+
+
+async def _load_versioned_allocations(
+        orderid: str,
+        uow: unit_of_work.SqlAlchemyUnitOfWork,
+        read_model: Optional[redis.RedisReadModel] = None,
+        unchanged: Optional[Callable[[int], bool]] = None,
+) -> Tuple[Optional[int], Optional[list]]:
+    if read_model is not None:
+        version = await read_model.version(orderid)
+        if version is not None and unchanged is not None and unchanged(version):
+            return version, None
+        return version, await read_model.allocations(orderid)
+
+    async with uow:
+        await _begin_snapshot(uow)
+        version = await _select_version(orderid, uow)
+        if version is not None and unchanged is not None and unchanged(version):
+            return version, None
+        return version, await _select_rows(orderid, uow)
+
+
+async def _begin_snapshot(uow: unit_of_work.SqlAlchemyUnitOfWork):
+    # Postgres 의 READ COMMITTED 는 구문마다 스냅숏을 새로 잡는다.
+    # 버전과 목록이 같은 시점을 보도록 트랜잭션을 REPEATABLE READ 로 연다
+    if uow.session.bind.dialect.name == "postgresql":
+        await uow.session.connection(
+            execution_options={"isolation_level": "REPEATABLE READ"},
+        )
+
+
+async def _select_version(
+        orderid: str,
+        uow: unit_of_work.SqlAlchemyUnitOfWork,
+) -> Optional[int]:
+    return (await uow.session.execute(
+        text(
+            """
+            SELECT version
+            FROM allocations_view_versions
+            WHERE orderid = :orderid
+            """
+        ),
+        dict(orderid=orderid),
+    )).scalar()
+
+
+async def _select_allocations(
+        orderid: str,
+        uow: unit_of_work.SqlAlchemyUnitOfWork,
 ):
+    async with uow:
+        return await _select_rows(orderid, uow)
+
+
+async def _select_rows(
+        orderid: str,
+        uow: unit_of_work.SqlAlchemyUnitOfWork,
+):
+    results = await uow.session.execute(
+        text(
+            """
+            SELECT batchref, sku
+            FROM allocations_view
+            WHERE orderid = :orderid
+            """
+        ),
+        dict(orderid=orderid),
+    )
+    return results.mappings().all()
+
+
+async def allocations_for_orders(
+        orderids: Sequence[str],
+        uow: unit_of_work.SqlAlchemyUnitOfWork,
+        read_model: Optional[redis.RedisReadModel] = None,
+        chunk_size: int = QUERY_CHUNK_SIZE,
+) -> AsyncIterator[Tuple[str, List[dict]]]:
+    """ 여러 주문의 할당 내역을 청크 단위의 ``IN`` 쿼리로 읽어 주문 순서대로 돌려준다. """
+    orderids = list(dict.fromkeys(orderids))
+    for start in range(0, len(orderids), chunk_size):
+        chunk = orderids[start:start + chunk_size]
+        if read_model is not None:
+            found = await read_model.allocations_many(chunk)
+        else:
+            found = await _select_allocations_many(chunk, uow)
+
+        for orderid in chunk:
+            yield orderid, found.get(orderid, [])
+
+
+async def _select_allocations_many(
+        orderids: Sequence[str],
+        uow: unit_of_work.SqlAlchemyUnitOfWork,
+) -> Dict[str, List[dict]]:
     async with uow:
         results = await uow.session.execute(
             text(
                 """
-                SELECT batchref, sku
+                SELECT orderid, batchref, sku
                 FROM allocations_view
-                WHERE orderid = :orderid
+                WHERE orderid IN :orderids
+                """
+            ).bindparams(bindparam("orderids", expanding=True)),
+            dict(orderids=list(orderids)),
+        )
+
+    found = defaultdict(list)
+    for row in results.mappings():
+        found[row["orderid"]].append(
+            {"batchref": row["batchref"], "sku": row["sku"]}
+        )
+    return found
+
+
+async def changes(
+        after: int,
+        limit: int,
+        uow: unit_of_work.SqlAlchemyUnitOfWork,
+        wait: float = 0.0,
+        poll_interval: float = 0.5,
+):
+    """ ``after`` 다음 seq 부터 ``limit`` 개의 변경을 seq 순서대로 돌려준다.
+
+    ``wait`` 를 주면 새 변경이 없을 때 그 시간 동안 ``poll_interval`` 마다 다시 본다(long-poll).
+    """
+    deadline = time.monotonic() + wait
+    while True:
+        rows = await _select_changes(after, limit, uow)
+        remaining = deadline - time.monotonic()
+        if rows or remaining <= 0:
+            return rows
+        await asyncio.sleep(min(poll_interval, remaining))
+
+
+def encode_changes(rows, after: int) -> bytes:
+    """ 변경 목록과 다음 요청에 넘길 커서(``next``)를 응답 본문 바이트로 바꾼다. """
+    return codec.JsonBackend.dumps({
+        "changes": [{column: row[column] for column in CHANGE_COLUMNS} for row in rows],
+        "next": rows[-1]["seq"] if rows else after,
+    })
+
+
+async def _select_changes(
+        after: int,
+        limit: int,
+        uow: unit_of_work.SqlAlchemyUnitOfWork,
+):
+    # seq 는 기본키라서 인덱스 구간 스캔으로 읽는다
+    async with uow:
+        results = await uow.session.execute(
+            text(
+                """
+                SELECT seq, op, orderid, sku, batchref, changed_at
+                FROM allocation_changes
+                WHERE seq > :after
+                ORDER BY seq
+                LIMIT :limit
                 """
             ),
-            dict(orderid=orderid),
+            dict(after=after, limit=limit),
         )
 
     return results.mappings().all()
@@ -26,6 +26,21 @@ def event_loop(request) -> Generator:  # noqa: indirect usage
     loop.close()
 
 
+class FakeClock:
+    """ 테스트가 ``now`` 를 직접 옮기는 시계. """
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock() -> FakeClock:
+    return FakeClock()
+
+
 @pytest.fixture(scope="session", name="rdbms")
 def make_container():
     from pt2.ch12.container import Container
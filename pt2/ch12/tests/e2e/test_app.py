@@ -1,10 +1,11 @@
+import json
 from dataclasses import asdict
 
 import pytest
 from fastapi import status
 
 from pt2.ch12.src.allocation.domain.model import OrderLine
-from pt2.ch12.tests.e2e.api_client import post_to_add_batch
+from pt2.ch12.tests.e2e.api_client import post_to_add_batch, post_to_allocate
 from pt2.ch12.tests.e2e.conftest import (
     random_sku,
     random_batchref,
@@ -98,3 +99,142 @@ async def test_should_raise_out_of_stock_when_deleted_unknown_batch(
     )
 
     assert res.status_code == status.HTTP_400_BAD_REQUEST
+
+
+@pytest.mark.asyncio
+async def test_repeated_allocation_reads_are_served_from_cache(client):
+    orderid, sku, batch = random_orderid(), random_sku(), random_batchref()
+    await post_to_add_batch(client, batch, sku, 100, None)
+    await post_to_allocate(client, orderid, sku, 3)
+
+    before = (await client.get("/metrics")).json()["allocations_cache"]
+    for _ in range(3):
+        res = await client.get(f"/allocations/{orderid}")
+        assert res.json() == [{"batchref": batch, "sku": sku}]
+    after = (await client.get("/metrics")).json()["allocations_cache"]
+
+    assert after["loads"] - before["loads"] == 1
+    assert after["hits"] - before["hits"] == 2
+
+
+@pytest.mark.asyncio
+async def test_query_many_allocations_streams_one_line_per_order(client):
+    sku, batch = random_sku(), random_batchref()
+    orderids = [random_orderid(i) for i in range(3)]
+    await post_to_add_batch(client, batch, sku, 100, None)
+    for orderid in orderids[:2]:
+        await post_to_allocate(client, orderid, sku, 1)
+
+    res = await client.post("/allocations/query", json={"orderids": orderids})
+
+    assert res.status_code == status.HTTP_200_OK
+    assert res.headers["content-type"] == "application/x-ndjson"
+    assert [json.loads(line) for line in res.text.splitlines()] == [
+        {"orderid": orderids[0], "allocations": [{"batchref": batch, "sku": sku}]},
+        {"orderid": orderids[1], "allocations": [{"batchref": batch, "sku": sku}]},
+        {"orderid": orderids[2], "allocations": []},
+    ]
+
+
+@pytest.mark.asyncio
+async def test_allocations_export_is_streamed_as_an_attachment(client):
+    orderid, sku, batch = random_orderid(), random_sku(), random_batchref()
+    await post_to_add_batch(client, batch, sku, 100, None)
+    await post_to_allocate(client, orderid, sku, 1)
+
+    res = await client.get("/exports/allocations", params={"format": "csv"})
+
+    assert res.status_code == status.HTTP_200_OK
+    assert res.headers["content-disposition"] == 'attachment; filename="allocations.csv"'
+    assert f"{orderid},{sku},{batch}" in res.text.splitlines()
+
+
+@pytest.mark.asyncio
+async def test_bulk_allocate_reports_a_result_per_line(client):
+    sku, batch = random_sku(), random_batchref()
+    orderids = [random_orderid(i) for i in range(3)]
+    await post_to_add_batch(client, batch, sku, 2, None)
+    lines = [
+        {"orderid": orderids[0], "sku": sku, "qty": 1},
+        {"orderid": orderids[1], "sku": sku, "qty": 5},
+        {"orderid": orderids[2], "sku": "DONTEXIST-111", "qty": 1},
+    ]
+
+    res = await client.post(
+        "/allocate/bulk",
+        content="".join(json.dumps(line) + "\n" for line in lines) + "{broken\n",
+        headers={"content-type": "application/x-ndjson"},
+    )
+
+    assert res.status_code == status.HTTP_200_OK
+    results = sorted(
+        (json.loads(line) for line in res.text.splitlines()),
+        key=lambda result: result["line"],
+    )
+    assert [result["status"] for result in results] == [
+        "allocated", "out_of_stock", "invalid_sku", "invalid",
+    ]
+    assert results[0]["batchref"] == batch
+
+
+@pytest.mark.asyncio
+async def test_retried_allocation_with_idempotency_key_is_replayed(client):
+    sku, batch, orderid = random_sku(), random_batchref(), random_orderid()
+    await post_to_add_batch(client, batch, sku, 10, None)
+    line = {"orderid": orderid, "sku": sku, "qty": 3}
+    headers = {"Idempotency-Key": f"allocate-{orderid}"}
+
+    first = await client.post("/allocate", json=line, headers=headers)
+    retried = await client.post("/allocate", json=line, headers=headers)
+    changed = await client.post("/allocate", json={**line, "qty": 4}, headers=headers)
+
+    assert first.status_code == retried.status_code == status.HTTP_202_ACCEPTED
+    assert retried.json() == first.json()
+    assert "idempotent-replayed" not in first.headers
+    assert retried.headers["idempotent-replayed"] == "true"
+    assert changed.status_code == status.HTTP_422_UNPROCESSABLE_ENTITY
+
+    res = await client.get(f"/allocations/{orderid}")
+    assert res.json() == [{"sku": sku, "batchref": batch}]
+
+
+@pytest.mark.asyncio
+async def test_unchanged_allocations_are_answered_with_304(client):
+    sku, othersku, batch, orderid = random_sku(), random_sku("other"), random_batchref(), random_orderid()
+    await post_to_add_batch(client, batch, sku, 100, None)
+    await post_to_add_batch(client, batch + "-other", othersku, 100, None)
+    await post_to_allocate(client, orderid, sku, 1)
+
+    first = await client.get(f"/allocations/{orderid}")
+    etag = first.headers["etag"]
+    unchanged = await client.get(f"/allocations/{orderid}", headers={"If-None-Match": etag})
+    await post_to_allocate(client, orderid, othersku, 1)
+    changed = await client.get(f"/allocations/{orderid}", headers={"If-None-Match": etag})
+
+    assert unchanged.status_code == status.HTTP_304_NOT_MODIFIED
+    assert unchanged.headers["etag"] == etag
+    assert unchanged.content == b""
+    assert changed.status_code == status.HTTP_200_OK
+    assert changed.headers["etag"] != etag
+    assert len(changed.json()) == 2
+
+
+@pytest.mark.asyncio
+async def test_change_feed_resumes_from_the_returned_cursor(client):
+    sku, batch, orderid = random_sku(), random_batchref(), random_orderid()
+    await post_to_add_batch(client, batch, sku, 100, None)
+    start = 0
+    while True:
+        page = (await client.get("/changes", params={"after": start})).json()
+        if not page["changes"]:
+            break
+        start = page["next"]
+
+    await post_to_allocate(client, orderid, sku, 1)
+    page = (await client.get("/changes", params={"after": start, "wait": 1})).json()
+    empty = (await client.get("/changes", params={"after": page["next"]})).json()
+
+    assert [(c["op"], c["orderid"], c["batchref"]) for c in page["changes"]] == [
+        ("insert", orderid, batch),
+    ]
+    assert empty == {"changes": [], "next": page["next"]}
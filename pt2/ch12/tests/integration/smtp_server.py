@@ -0,0 +1,47 @@
+import asyncio
+from email import message_from_bytes
+from email.message import Message
+from typing import List
+
+
+class SmtpStandIn:
+    """ 받은 메일을 메모리에 쌓아두기만 하는 로컬 SMTP 서버(디버깅용 대역). """
+
+    def __init__(self):
+        self.messages: List[Message] = []
+        self.connections = 0
+        self.port = None
+        self._server = None
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._session, "127.0.0.1", 0)
+        self.port = self._server.sockets[0].getsockname()[1]
+
+    async def close(self):
+        self._server.close()
+        await self._server.wait_closed()
+
+    async def _session(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.connections += 1
+        writer.write(b"220 localhost SMTP stand-in\r\n")
+        while line := await reader.readline():
+            verb = line[:4].upper()
+            if verb in (b"EHLO", b"HELO"):
+                writer.write(b"250 localhost\r\n")
+            elif verb == b"DATA":
+                writer.write(b"354 End data with <CR><LF>.<CR><LF>\r\n")
+                await writer.drain()
+                lines = []
+                while (data := await reader.readline()) not in (b".\r\n", b""):
+                    lines.append(data)
+                self.messages.append(message_from_bytes(b"".join(lines)))
+                writer.write(b"250 OK: queued\r\n")
+            elif verb == b"QUIT":
+                writer.write(b"221 Bye\r\n")
+                await writer.drain()
+                break
+            else:
+                # MAIL, RCPT, RSET, NOOP
+                writer.write(b"250 OK\r\n")
+            await writer.drain()
+        writer.close()
@@ -0,0 +1,73 @@
+import pytest
+
+from pt2.ch12.src.allocation.adapters import repository
+from pt2.ch12.src.allocation.adapters.availability import AvailabilityCache
+from pt2.ch12.src.allocation.domain import commands, events
+from pt2.ch12.src.allocation.service_layer import messagebus, unit_of_work
+
+
+@pytest.fixture
+def out_of_stock_events(monkeypatch):
+    seen = []
+
+    async def record(event, uow):
+        seen.append(event)
+
+    monkeypatch.setitem(messagebus.MessageBus.EVENT_HANDLERS, events.OutOfStock, [record])
+    return seen
+
+
+@pytest.mark.asyncio
+async def test_sold_out_skus_are_rejected_without_loading_the_aggregate(
+        sqlite_session_factory,
+        out_of_stock_events,
+        monkeypatch,
+):
+    uow = unit_of_work.SqlAlchemyUnitOfWork(sqlite_session_factory)
+    availability = AvailabilityCache()
+    await messagebus.handle(commands.CreateBatch("b1", "LAMP", 10, None), uow, availability=availability)
+    await messagebus.handle(commands.Allocate("o1", "LAMP", 8), uow, availability=availability)
+
+    async def must_not_load(self, sku):
+        raise AssertionError("aggregate was loaded")
+
+    monkeypatch.setattr(repository.SqlAlchemyRepository, "get", must_not_load)
+    assert await messagebus.handle(commands.Allocate("o2", "LAMP", 3), uow, availability=availability) == [None]
+
+    assert out_of_stock_events == [events.OutOfStock("LAMP")]
+    assert availability.stats.rejections == 1
+
+
+@pytest.mark.asyncio
+async def test_a_stale_summary_only_sends_the_request_down_the_slow_path(sqlite_session_factory):
+    uow = unit_of_work.SqlAlchemyUnitOfWork(sqlite_session_factory)
+    availability = AvailabilityCache()
+    await messagebus.handle(commands.CreateBatch("b1", "LAMP", 10, None), uow, availability=availability)
+    await messagebus.handle(commands.Allocate("o1", "LAMP", 10), uow, availability=availability)
+    assert await availability.max_available("LAMP", 2) == 0
+
+    # 다른 프로세스처럼 요약을 고치지 않고 재고를 늘리고 주문을 풀어준다
+    await messagebus.handle(commands.CreateBatch("b2", "LAMP", 5, None), uow)
+    await messagebus.handle(commands.Deallocate("o1", "LAMP", 10), uow)
+
+    [batchref] = await messagebus.handle(commands.Allocate("o2", "LAMP", 10), uow, availability=availability)
+
+    assert batchref == "b1"
+    assert availability.stats.rejections == 0
+    assert availability.stats.misses == 1
+
+
+@pytest.mark.asyncio
+async def test_allocations_that_fit_do_not_ask_for_the_version(sqlite_session_factory, monkeypatch):
+    uow = unit_of_work.SqlAlchemyUnitOfWork(sqlite_session_factory)
+    availability = AvailabilityCache()
+    await messagebus.handle(commands.CreateBatch("b1", "LAMP", 10, None), uow, availability=availability)
+
+    async def must_not_ask(self, sku):
+        raise AssertionError("version was read")
+
+    monkeypatch.setattr(repository.SqlAlchemyRepository, "version", must_not_ask)
+    assert await messagebus.handle(commands.Allocate("o1", "LAMP", 4), uow, availability=availability) == ["b1"]
+    assert await messagebus.handle(commands.Allocate("o2", "LAMP", 6), uow, availability=availability) == ["b1"]
+
+    assert availability.stats.passes == 2
@@ -0,0 +1,144 @@
+import asyncio
+
+import pytest
+
+from pt2.ch12.src.allocation.adapters.command_queue import (
+    DONE,
+    FAILED,
+    PENDING,
+    RUNNING,
+    CommandQueue,
+    CommandWorkers,
+)
+from pt2.ch12.src.allocation.domain import commands
+from pt2.ch12.src.allocation.service_layer import messagebus, unit_of_work
+
+
+@pytest.mark.asyncio
+async def test_commands_are_claimed_once_in_arrival_order(sqlite_session_factory, clock):
+    queue = CommandQueue(sqlite_session_factory, clock=clock)
+    first = await queue.enqueue(commands.Allocate("o1", "LAMP", 1))
+    clock.now += 1
+    second = await queue.enqueue(commands.Allocate("o2", "LAMP", 1))
+
+    [claimed] = await queue.claim()
+    assert claimed.id == first
+    assert claimed.command == commands.Allocate("o1", "LAMP", 1)
+    assert claimed.attempts == 1
+
+    [claimed] = await queue.claim()
+    assert claimed.id == second
+    assert await queue.claim() == []
+    assert (await queue.get(first))["status"] == RUNNING
+
+
+@pytest.mark.asyncio
+async def test_commands_left_running_by_a_dead_worker_are_claimed_again(sqlite_session_factory, clock):
+    queue = CommandQueue(sqlite_session_factory, claim_timeout=60, clock=clock)
+    command_id = await queue.enqueue(commands.Allocate("o1", "LAMP", 1))
+    await queue.claim()
+
+    clock.now += 30
+    assert await queue.claim() == []
+
+    clock.now += 31
+    [claimed] = await queue.claim()
+    assert claimed.id == command_id
+    assert claimed.attempts == 2
+
+
+@pytest.mark.asyncio
+async def test_workers_run_queued_commands_through_the_message_bus(sqlite_session_factory):
+    uow = unit_of_work.SqlAlchemyUnitOfWork(sqlite_session_factory)
+    await messagebus.handle(commands.CreateBatch("b1", "LAMP", 10, None), uow)
+    queue = CommandQueue(sqlite_session_factory)
+
+    async def handle(command):
+        return await messagebus.handle(command, unit_of_work.SqlAlchemyUnitOfWork(sqlite_session_factory))
+
+    workers = CommandWorkers(queue, handle)
+    allocated = await queue.enqueue(commands.Allocate("o1", "LAMP", 3))
+    invalid = await queue.enqueue(commands.Allocate("o2", "NOPE", 1))
+    out_of_stock = await queue.enqueue(commands.Allocate("o3", "LAMP", 20))
+    assert await workers.run_once()
+    assert await workers.run_once()
+    assert await workers.run_once()
+    assert not await workers.run_once()
+
+    status = await queue.get(allocated)
+    assert (status["status"], status["result"], status["error"]) == (DONE, "b1", None)
+    status = await queue.get(invalid)
+    assert status["status"] == FAILED
+    assert status["error"] == "Invalid sku NOPE"
+    status = await queue.get(out_of_stock)
+    assert (status["status"], status["error"]) == (FAILED, "Out of stock for sku LAMP")
+    assert workers.stats.failed == 2
+
+
+class WatchedQueue(CommandQueue):
+    """ 빈 큐를 확인한 뒤에 알려준다. 그 다음부터 워커는 ``notify`` 를 기다린다. """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.idle = asyncio.Event()
+
+    async def claim(self, limit: int = 1):
+        claimed = await super().claim(limit)
+        if not claimed:
+            self.idle.set()
+        return claimed
+
+
+@pytest.mark.asyncio
+async def test_started_workers_pick_up_notified_commands_and_stop_cleanly(sqlite_session_factory):
+    uow = unit_of_work.SqlAlchemyUnitOfWork(sqlite_session_factory)
+    await messagebus.handle(commands.CreateBatch("b1", "LAMP", 10, None), uow)
+    queue = WatchedQueue(sqlite_session_factory)
+
+    async def handle(command):
+        return await messagebus.handle(command, unit_of_work.SqlAlchemyUnitOfWork(sqlite_session_factory))
+
+    # 인메모리 sqlite 는 커넥션 하나를 나눠 쓰므로 워커가 쿼리하는 동안 넣으면 서로의
+    # 트랜잭션을 덮는다. 워커가 빈 큐를 보고 쉬는 동안에 넣고, 폴링은 시험이 끝날 때까지
+    # 돌아오지 않으므로 notify 로 깨워야 처리된다
+    workers = CommandWorkers(queue, handle, workers=1, poll_interval=60)
+    await workers.start()
+    await queue.idle.wait()
+    ids = [await queue.enqueue(commands.Allocate(f"o{i}", "LAMP", 1)) for i in range(3)]
+    for _ in ids:
+        workers.notify()
+
+    async def finished():
+        while workers.stats.done < 3:
+            await asyncio.sleep(0.01)
+
+    await asyncio.wait_for(finished(), timeout=5)
+    # 처리 중에 취소하지 않으므로 커넥션(과 인메모리 테이블)이 그대로 남는다
+    await workers.close()
+
+    for command_id in ids:
+        assert (await queue.get(command_id))["status"] == DONE
+    assert workers.stats.enqueued == 3
+
+
+@pytest.mark.asyncio
+async def test_transient_errors_are_retried_up_to_max_attempts(sqlite_session_factory):
+    queue = CommandQueue(sqlite_session_factory)
+    attempts = []
+
+    async def handle(command):
+        attempts.append(command)
+        raise ConnectionError("database went away")
+
+    workers = CommandWorkers(queue, handle, max_attempts=2)
+    command_id = await queue.enqueue(commands.Allocate("o1", "LAMP", 1))
+
+    assert await workers.run_once()
+    assert (await queue.get(command_id))["status"] == PENDING
+    assert await workers.run_once()
+    assert not await workers.run_once()
+
+    status = await queue.get(command_id)
+    assert status["status"] == FAILED
+    assert status["attempts"] == 2
+    assert workers.stats.retried == 1
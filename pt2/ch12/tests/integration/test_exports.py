@@ -0,0 +1,64 @@
+import csv
+import gzip
+import io
+import json
+
+import pytest
+
+from pt2.ch12.src.allocation import exports
+from pt2.ch12.src.allocation.domain import commands
+from pt2.ch12.src.allocation.service_layer import messagebus, unit_of_work
+
+
+async def collect(chunks):
+    return [chunk async for chunk in chunks]
+
+
+async def given_some_allocations(session_factory):
+    uow = unit_of_work.SqlAlchemyUnitOfWork(session_factory)
+    await messagebus.handle(commands.CreateBatch("b1", "sku1", 100, None), uow)
+    await messagebus.handle(commands.CreateBatch("b2", "sku2", 50, None), uow)
+    for i in range(5):
+        await messagebus.handle(commands.Allocate(f"o{i}", "sku1", 10), uow)
+
+
+@pytest.mark.asyncio
+async def test_allocations_are_exported_as_ndjson_in_partitions(sqlite_session_factory):
+    await given_some_allocations(sqlite_session_factory)
+
+    async with sqlite_session_factory() as session:
+        chunks = await collect(
+            exports.export(session, exports.ALLOCATIONS_QUERY, partition_size=2)
+        )
+
+    assert len(chunks) == 3
+    rows = [json.loads(line) for line in b"".join(chunks).decode().splitlines()]
+    assert sorted(row["orderid"] for row in rows) == [f"o{i}" for i in range(5)]
+    assert rows[0] == {"orderid": "o0", "sku": "sku1", "batchref": "b1"}
+
+
+@pytest.mark.asyncio
+async def test_stock_is_exported_as_gzipped_csv(sqlite_session_factory):
+    await given_some_allocations(sqlite_session_factory)
+
+    async with sqlite_session_factory() as session:
+        chunks = await collect(
+            exports.export(session, exports.STOCK_QUERY, fmt=exports.CSV, gzip=True)
+        )
+
+    rows = list(csv.reader(io.StringIO(gzip.decompress(b"".join(chunks)).decode())))
+    assert rows[0] == [
+        "reference", "sku", "eta", "purchased_quantity",
+        "allocated_quantity", "available_quantity",
+    ]
+    assert sorted(rows[1:]) == [
+        ["b1", "sku1", "", "100", "50", "50"],
+        ["b2", "sku2", "", "50", "0", "50"],
+    ]
+
+
+@pytest.mark.asyncio
+async def test_unknown_format_is_rejected(sqlite_session_factory):
+    async with sqlite_session_factory() as session:
+        with pytest.raises(ValueError):
+            await collect(exports.export(session, exports.ALLOCATIONS_QUERY, fmt="xml"))
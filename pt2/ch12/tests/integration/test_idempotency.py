@@ -0,0 +1,48 @@
+import pytest
+
+from pt2.ch12.src.allocation.adapters.idempotency import (
+    IdempotencyInProgress,
+    IdempotencyStore,
+    StoredResponse,
+)
+
+
+@pytest.mark.asyncio
+async def test_responses_are_shared_between_stores_through_the_database(sqlite_session_factory):
+    calls = []
+
+    async def run():
+        calls.append(1)
+        return StoredResponse(202, {"message": "allocated"}, {"location": "/commands/1"})
+
+    first = IdempotencyStore(session_factory=sqlite_session_factory)
+    other_process = IdempotencyStore(session_factory=sqlite_session_factory)
+
+    await first.execute("allocate:k1", "fp", run)
+    response, replayed = await other_process.execute("allocate:k1", "fp", run)
+
+    assert replayed
+    assert response == StoredResponse(202, {"message": "allocated"}, {"location": "/commands/1"})
+    assert len(calls) == 1
+
+
+@pytest.mark.asyncio
+async def test_a_key_reserved_by_a_running_request_is_in_progress_until_the_lock_times_out(
+        sqlite_session_factory,
+        clock,
+):
+    crashed = IdempotencyStore(session_factory=sqlite_session_factory, lock_timeout=30, clock=clock)
+    other_process = IdempotencyStore(session_factory=sqlite_session_factory, lock_timeout=30, clock=clock)
+
+    # 응답을 저장하기 전에 프로세스가 죽은 상황. 예약만 남는다
+    assert await crashed._reserve("allocate:k1", "fp") is None
+
+    async def run():
+        return StoredResponse(202, {"message": "allocated"})
+
+    with pytest.raises(IdempotencyInProgress):
+        await other_process.execute("allocate:k1", "fp", run)
+
+    clock.now += 31
+    response, replayed = await other_process.execute("allocate:k1", "fp", run)
+    assert (response.status_code, replayed) == (202, False)
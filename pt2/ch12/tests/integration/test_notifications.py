@@ -0,0 +1,47 @@
+import asyncio
+
+import pytest
+import pytest_asyncio
+
+from pt2.ch12.src.allocation.adapters.email import SmtpMailer
+from pt2.ch12.src.allocation.adapters.notifications import OutOfStockNotifier
+from pt2.ch12.tests.integration.smtp_server import SmtpStandIn
+
+
+@pytest_asyncio.fixture
+async def smtp_server():
+    server = SmtpStandIn()
+    await server.start()
+    yield server
+    await server.close()
+
+
+@pytest.mark.asyncio
+async def test_mailer_reuses_pooled_connections(smtp_server):
+    mailer = SmtpMailer("127.0.0.1", smtp_server.port, "allocation@made.com", pool_size=2)
+
+    await asyncio.gather(*(
+        mailer.send("admin@made.com", f"subject {i}", "body") for i in range(6)
+    ))
+    await mailer.close()
+
+    assert sorted(m["Subject"] for m in smtp_server.messages) == [f"subject {i}" for i in range(6)]
+    assert smtp_server.connections <= 2
+
+
+@pytest.mark.asyncio
+async def test_out_of_stock_digest_is_delivered_over_smtp(smtp_server):
+    mailer = SmtpMailer("127.0.0.1", smtp_server.port, "allocation@made.com")
+    notifier = OutOfStockNotifier(mailer, "stock_admin@made.com", digest_interval=60)
+    await notifier.start()
+    for _ in range(1_000):
+        notifier.notify("LAMP")
+    notifier.notify("TABLE")
+
+    await notifier.close()
+    await mailer.close()
+
+    [message] = smtp_server.messages
+    assert message["To"] == "stock_admin@made.com"
+    assert message["Subject"] == "out of stock for 2 skus"
+    assert notifier.stats.sent == 1
@@ -0,0 +1,145 @@
+import asyncio
+
+import pytest
+from sqlalchemy import text
+
+from pt2.ch12.src.allocation import views
+from pt2.ch12.src.allocation.adapters.cache import AllocationsCache
+from pt2.ch12.src.allocation.adapters.projection import ReadModelWriter
+from pt2.ch12.src.allocation.domain import commands
+from pt2.ch12.src.allocation.service_layer import messagebus, unit_of_work
+
+
+async def read_model_rows(session_factory):
+    async with session_factory() as session:
+        rows = await session.execute(
+            text("SELECT orderid, sku, batchref FROM allocations_view ORDER BY orderid, sku")
+        )
+        return list(rows)
+
+
+@pytest.mark.asyncio
+async def test_sync_writer_flushes_once_per_handle_cascade(sqlite_session_factory):
+    writer = ReadModelWriter(sqlite_session_factory, consistency="sync")
+    uow = unit_of_work.SqlAlchemyUnitOfWork(sqlite_session_factory)
+    await messagebus.handle(commands.CreateBatch("b1", "sku1", 50, None), uow)
+    await messagebus.handle(commands.Allocate("o1", "sku1", 10), uow, projection=writer)
+
+    assert len(writer) == 0
+    assert writer.stats.flushes == 1
+    assert await views.allocations("o1", uow) == [{"sku": "sku1", "batchref": "b1"}]
+
+
+@pytest.mark.asyncio
+async def test_failed_sync_flush_keeps_the_command_successful(sqlite_session_factory, monkeypatch):
+    writer = ReadModelWriter(sqlite_session_factory, consistency="sync")
+    uow = unit_of_work.SqlAlchemyUnitOfWork(sqlite_session_factory)
+    await messagebus.handle(commands.CreateBatch("b1", "sku1", 50, None), uow)
+
+    async def broken(pending):
+        raise RuntimeError("db down")
+
+    monkeypatch.setattr(writer, "_write", broken)
+    results = await messagebus.handle(commands.Allocate("o1", "sku1", 10), uow, projection=writer)
+
+    assert results == ["b1"]
+    assert len(writer) == 1
+
+    monkeypatch.undo()
+    await writer.flush()
+    assert await read_model_rows(sqlite_session_factory) == [("o1", "sku1", "b1")]
+
+
+@pytest.mark.asyncio
+async def test_buffered_mutations_are_written_as_multi_row_statements(sqlite_session_factory):
+    writer = ReadModelWriter(sqlite_session_factory, max_batch=1000)
+    for i in range(700):
+        await writer.add(f"o{i:03}", "sku1", "b1")
+    await writer.remove("o000", "sku1")
+    await writer.remove("o001", "sku1")
+    await writer.add("o000", "sku1", "b2")
+
+    await writer.flush()
+
+    rows = await read_model_rows(sqlite_session_factory)
+    assert len(rows) == 699
+    assert rows[0] == ("o000", "sku1", "b2")
+    assert writer.stats.last_flush_size == 703
+    assert writer.stats.flushes == 1
+
+
+@pytest.mark.asyncio
+async def test_writer_flushes_when_batch_is_full(sqlite_session_factory):
+    writer = ReadModelWriter(sqlite_session_factory, max_batch=3)
+    for i in range(7):
+        await writer.add(f"o{i}", "sku1", "b1")
+
+    assert writer.stats.flushes == 2
+    assert len(writer) == 1
+
+
+@pytest.mark.asyncio
+async def test_async_writer_flushes_in_background(sqlite_session_factory):
+    cache = AllocationsCache()
+    writer = ReadModelWriter(
+        sqlite_session_factory,
+        consistency="async",
+        max_delay=0.01,
+        cache=cache,
+    )
+    await writer.start()
+    try:
+        await writer.add("o1", "sku1", "b1")
+        await writer.after_handle()
+        assert len(writer) == 1
+
+        await asyncio.sleep(0.05)
+        assert len(writer) == 0
+        assert writer.stats.last_lag > 0
+    finally:
+        await writer.close()
+
+    assert await read_model_rows(sqlite_session_factory) == [("o1", "sku1", "b1")]
+
+
+@pytest.mark.asyncio
+async def test_close_flushes_pending_mutations(sqlite_session_factory):
+    writer = ReadModelWriter(sqlite_session_factory, consistency="async", max_delay=60)
+    await writer.start()
+    await writer.add("o1", "sku1", "b1")
+
+    await writer.close()
+
+    assert await read_model_rows(sqlite_session_factory) == [("o1", "sku1", "b1")]
+
+
+@pytest.mark.asyncio
+async def test_each_flush_bumps_the_version_of_the_orders_it_touched(sqlite_session_factory):
+    writer = ReadModelWriter(sqlite_session_factory)
+    uow = unit_of_work.SqlAlchemyUnitOfWork(sqlite_session_factory)
+    await writer.add("o1", "sku1", "b1")
+    await writer.add("o1", "sku2", "b1")
+    await writer.add("o2", "sku1", "b1")
+    await writer.flush()
+    await writer.remove("o1", "sku1")
+    await writer.flush()
+
+    assert await views.allocations_version("o1", uow) == 2
+    assert await views.allocations_version("o2", uow) == 1
+
+
+@pytest.mark.asyncio
+async def test_each_flush_appends_its_mutations_to_the_change_log(sqlite_session_factory):
+    writer = ReadModelWriter(sqlite_session_factory)
+    uow = unit_of_work.SqlAlchemyUnitOfWork(sqlite_session_factory)
+    await writer.add("o1", "sku1", "b1")
+    await writer.remove("o1", "sku1")
+    await writer.add("o1", "sku1", "b2")
+    await writer.flush()
+
+    rows = await views.changes(0, 10, uow)
+
+    assert [row["seq"] for row in rows] == sorted(row["seq"] for row in rows)
+    assert [(row["op"], row["batchref"]) for row in rows] == [
+        ("insert", "b1"), ("delete", None), ("insert", "b2"),
+    ]
@@ -0,0 +1,56 @@
+import pytest
+import pytest_asyncio
+from sqlalchemy import text
+
+from pt2.ch12.src.allocation import rebuild
+from pt2.ch12.src.allocation.adapters.postgres import AsyncSQLAlchemy
+from pt2.ch12.src.allocation.domain import commands
+from pt2.ch12.src.allocation.service_layer import messagebus, unit_of_work
+
+
+@pytest_asyncio.fixture
+async def file_db(tmp_path):
+    db = AsyncSQLAlchemy(db_uri=f"sqlite+aiosqlite:///{tmp_path / 'rebuild.sqlite3'}")
+    await db.connect()
+    await db.create_database()
+    db.init_session_factory()
+    yield db
+    await db.disconnect()
+
+
+async def view_rows(db):
+    async with db.engine.connect() as conn:
+        rows = await conn.execute(
+            text("SELECT orderid, sku, batchref FROM allocations_view ORDER BY orderid")
+        )
+        return list(rows)
+
+
+@pytest.mark.asyncio
+async def test_rebuild_restores_drifted_read_model(file_db):
+    uow = unit_of_work.SqlAlchemyUnitOfWork(file_db.session_factory)
+    await messagebus.handle(commands.CreateBatch("b1", "sku1", 1000, None), uow)
+    for i in range(25):
+        await messagebus.handle(commands.Allocate(f"o{i:02}", "sku1", 1), uow)
+    expected = await view_rows(file_db)
+
+    async with file_db.engine.begin() as conn:
+        await conn.execute(text("DELETE FROM allocations_view WHERE orderid < 'o10'"))
+        await conn.execute(
+            text("INSERT INTO allocations_view VALUES ('ghost', 'sku1', 'b1')")
+        )
+
+    report = await rebuild.rebuild_allocations_view(file_db.engine, workers=3, chunk_size=4)
+
+    assert await view_rows(file_db) == expected
+    assert report.rows == 25
+    assert report.chunks == 7
+    assert report.rows_per_second > 0
+
+
+@pytest.mark.asyncio
+async def test_rebuild_of_empty_write_model_leaves_empty_view(file_db):
+    report = await rebuild.rebuild_allocations_view(file_db.engine, workers=2, chunk_size=10)
+
+    assert await view_rows(file_db) == []
+    assert report.rows == 0
@@ -0,0 +1,136 @@
+import pytest
+import pytest_asyncio
+from sqlalchemy import text
+
+from pt2.ch12.src.allocation import views
+from pt2.ch12.src.allocation.adapters.postgres import AsyncSQLAlchemy
+from pt2.ch12.src.allocation.adapters.replica import ReplicaLagGuard
+from pt2.ch12.src.allocation.service_layer import unit_of_work
+
+
+async def make_db(path):
+    db = AsyncSQLAlchemy(db_uri=f"sqlite+aiosqlite:///{path}")
+    await db.connect()
+    await db.create_database()
+    db.init_session_factory()
+    return db
+
+
+async def insert_view_row(db, orderid, batchref):
+    async with db.session() as session:
+        await session.execute(
+            text(
+                "INSERT INTO allocations_view (orderid, sku, batchref)"
+                " VALUES (:orderid, 'sku1', :batchref)"
+            ),
+            dict(orderid=orderid, batchref=batchref),
+        )
+        await session.commit()
+
+
+async def replicate_heartbeat(primary, replica):
+    async with primary.session() as session:
+        [[beat_at]] = await session.execute(
+            text("SELECT beat_at FROM replication_heartbeat")
+        )
+    async with replica.session() as session:
+        await session.execute(text("DELETE FROM replication_heartbeat"))
+        await session.execute(
+            text("INSERT INTO replication_heartbeat (id, beat_at) VALUES (1, :beat_at)"),
+            dict(beat_at=beat_at),
+        )
+        await session.commit()
+
+
+@pytest_asyncio.fixture
+async def primary_and_replica(tmp_path):
+    primary = await make_db(tmp_path / "primary.sqlite3")
+    replica = await make_db(tmp_path / "replica.sqlite3")
+    await insert_view_row(primary, "o1", "from-primary")
+    await insert_view_row(replica, "o1", "from-replica")
+    yield primary, replica
+    await primary.disconnect()
+    await replica.disconnect()
+
+
+def read_only_uow(primary, replica, guard):
+    return unit_of_work.ReadOnlyUnitOfWork(
+        replica.session_factory,
+        primary_session_factory=primary.session_factory,
+        lag_guard=guard,
+    )
+
+
+@pytest.mark.asyncio
+async def test_reads_go_to_replica_while_it_keeps_up(primary_and_replica, clock):
+    primary, replica = primary_and_replica
+    guard = ReplicaLagGuard(primary, replica, max_lag=1.0, check_interval=0, clock=clock)
+    await guard.beat()
+    await replicate_heartbeat(primary, replica)
+
+    uow = read_only_uow(primary, replica, guard)
+    assert await views.allocations("o1", uow) == [
+        {"batchref": "from-replica", "sku": "sku1"},
+    ]
+    assert uow.on_replica
+    assert guard.lag == 0
+
+
+@pytest.mark.asyncio
+async def test_reads_fall_back_to_primary_when_replica_lags(primary_and_replica, clock):
+    primary, replica = primary_and_replica
+    guard = ReplicaLagGuard(primary, replica, max_lag=1.0, check_interval=0, clock=clock)
+    await guard.beat()
+    await replicate_heartbeat(primary, replica)
+    clock.now += 5
+    await guard.beat()
+
+    uow = read_only_uow(primary, replica, guard)
+    assert await views.allocations("o1", uow) == [
+        {"batchref": "from-primary", "sku": "sku1"},
+    ]
+    assert not uow.on_replica
+    assert guard.lag == 5
+
+
+@pytest.mark.asyncio
+async def test_version_and_rows_are_read_from_the_same_database(primary_and_replica):
+    primary, replica = primary_and_replica
+    for db, version in ((primary, 2), (replica, 1)):
+        async with db.session() as session:
+            await session.execute(
+                text("INSERT INTO allocations_view_versions (orderid, version) VALUES ('o1', :version)"),
+                dict(version=version),
+            )
+            await session.commit()
+
+    class FlappingGuard:
+        """ 처음에는 레플리카가 따라왔다고 하고, 그다음부터는 뒤처졌다고 한다. """
+        fresh = True
+
+        async def replica_is_fresh(self):
+            fresh, self.fresh = self.fresh, False
+            return fresh
+
+    uow = read_only_uow(primary, replica, FlappingGuard())
+    assert await views.versioned_allocations("o1", uow) == (
+        1, [{"batchref": "from-replica", "sku": "sku1"}],
+    )
+
+
+@pytest.mark.asyncio
+async def test_replica_without_heartbeat_is_not_trusted(primary_and_replica):
+    primary, replica = primary_and_replica
+    guard = ReplicaLagGuard(primary, replica, check_interval=0)
+    await guard.beat()
+
+    assert await guard.replica_is_fresh() is False
+
+
+@pytest.mark.asyncio
+async def test_read_only_uow_refuses_to_commit(primary_and_replica):
+    primary, replica = primary_and_replica
+
+    with pytest.raises(unit_of_work.ReadOnlyError):
+        async with unit_of_work.ReadOnlyUnitOfWork(replica.session_factory) as uow:
+            await uow.commit()
@@ -0,0 +1,72 @@
+import pytest
+
+from pt2.ch12.src.allocation.adapters.skus import KnownSkus
+from pt2.ch12.src.allocation.domain import commands
+from pt2.ch12.src.allocation.service_layer import handlers, messagebus, unit_of_work
+
+
+@pytest.mark.asyncio
+async def test_unknown_skus_are_rejected_without_reading_the_aggregate(sqlite_session_factory):
+    uow = unit_of_work.SqlAlchemyUnitOfWork(sqlite_session_factory)
+    await messagebus.handle(commands.CreateBatch("b1", "LAMP", 10, None), uow)
+    known_skus = KnownSkus(sqlite_session_factory)
+    await known_skus.load()
+
+    with pytest.raises(handlers.InvalidSku):
+        await messagebus.handle(commands.Allocate("o1", "NONEXISTENT", 1), uow, known_skus=known_skus)
+    [batchref] = await messagebus.handle(commands.Allocate("o1", "LAMP", 1), uow, known_skus=known_skus)
+
+    assert batchref == "b1"
+    assert known_skus.stats.skus == 1
+    assert known_skus.stats.filtered == 1
+    assert known_skus.stats.misses == 1
+    assert known_skus.stats.passed == 1
+
+
+@pytest.mark.asyncio
+async def test_skus_created_by_another_process_are_found_before_the_refresh(
+        sqlite_session_factory,
+):
+    uow = unit_of_work.SqlAlchemyUnitOfWork(sqlite_session_factory)
+    known_skus = KnownSkus(sqlite_session_factory)
+    await known_skus.load()
+
+    # 다른 프로세스가 만든 것처럼 이 KnownSkus 에는 알리지 않는다
+    await messagebus.handle(commands.CreateBatch("b1", "LAMP", 10, None), uow)
+
+    assert await messagebus.handle(commands.Allocate("o1", "LAMP", 1), uow, known_skus=known_skus) == ["b1"]
+    assert await messagebus.handle(commands.Allocate("o2", "LAMP", 1), uow, known_skus=known_skus) == ["b1"]
+    assert known_skus.stats.filtered == 1
+    assert known_skus.stats.discovered == 1
+    assert known_skus.stats.passed == 1
+
+
+@pytest.mark.asyncio
+async def test_new_batches_make_their_sku_known(sqlite_session_factory):
+    uow = unit_of_work.SqlAlchemyUnitOfWork(sqlite_session_factory)
+    known_skus = KnownSkus(sqlite_session_factory)
+    await known_skus.load()
+    assert not await known_skus.might_exist("LAMP")
+
+    await messagebus.handle(commands.CreateBatch("b1", "LAMP", 10, None), uow, known_skus=known_skus)
+
+    assert await known_skus.might_exist("LAMP")
+    assert await messagebus.handle(commands.Allocate("o1", "LAMP", 1), uow, known_skus=known_skus) == ["b1"]
+
+
+@pytest.mark.asyncio
+async def test_skus_missing_from_the_database_are_remembered_for_a_while(sqlite_session_factory, clock):
+    uow = unit_of_work.SqlAlchemyUnitOfWork(sqlite_session_factory)
+    known_skus = KnownSkus(sqlite_session_factory, negative_ttl=5, clock=clock)
+    await known_skus.load()
+    # 필터의 오탐처럼 필터에는 있지만 DB 에는 없는 SKU
+    known_skus.add("GHOST")
+
+    for _ in range(3):
+        with pytest.raises(handlers.InvalidSku):
+            await messagebus.handle(commands.Allocate("o1", "GHOST", 1), uow, known_skus=known_skus)
+    assert known_skus.stats.misses == 1
+    assert known_skus.stats.negative_hits == 2
+
+    clock.now = 6
+    assert await known_skus.might_exist("GHOST")
@@ -1,8 +1,14 @@
+import asyncio
+import json
 from datetime import date
 
 import pytest
+from sqlalchemy import event
 
 from pt2.ch12.src.allocation import views
+from pt2.ch12.src.allocation.adapters import redis
+from pt2.ch12.src.allocation.adapters.cache import AllocationsCache
+from pt2.ch12.src.allocation.adapters.inmemory import InMemoryRedis
 from pt2.ch12.src.allocation.domain import commands
 from pt2.ch12.src.allocation.service_layer import (
     messagebus,
@@ -60,3 +66,213 @@ async def test_deallocation(sqlite_session_factory):
     assert await views.allocations("o1", uow) == [
         {"sku": "sku1", "batchref": "b2"},
     ]
+
+
+@pytest.mark.asyncio
+async def test_allocations_view_cache_is_invalidated_by_read_model_handlers(
+        sqlite_session_factory,
+):
+    cache = AllocationsCache(maxsize=10, ttl=60)
+    uow = unit_of_work.SqlAlchemyUnitOfWork(sqlite_session_factory)
+    await messagebus.handle(commands.CreateBatch("b1", "sku1", 50, None), uow)
+
+    assert await views.allocations("o1", uow, cache=cache) == []
+
+    await messagebus.handle(commands.Allocate("o1", "sku1", 10), uow, cache=cache)
+
+    assert await views.allocations("o1", uow, cache=cache) == [
+        {"sku": "sku1", "batchref": "b1"},
+    ]
+    assert await views.allocations("o1", uow, cache=cache) == [
+        {"sku": "sku1", "batchref": "b1"},
+    ]
+    assert cache.stats.invalidations == 1
+    assert cache.stats.hits == 1
+
+
+@pytest.mark.asyncio
+async def test_cached_allocations_keep_version_and_rows_together(sqlite_session_factory):
+    cache = AllocationsCache(maxsize=10, ttl=60)
+    uow = unit_of_work.SqlAlchemyUnitOfWork(sqlite_session_factory)
+    await messagebus.handle(commands.CreateBatch("b1", "sku1", 50, None), uow)
+    await messagebus.handle(commands.CreateBatch("b2", "sku2", 50, None), uow)
+    await messagebus.handle(commands.Allocate("o1", "sku1", 10), uow)
+
+    assert await views.versioned_allocations("o1", uow, cache=cache) == (
+        1, [{"sku": "sku1", "batchref": "b1"}],
+    )
+
+    # 다른 프로세스가 바꾼 것처럼 이 캐시는 무효화되지 않는다
+    await messagebus.handle(commands.Allocate("o1", "sku2", 10), uow)
+
+    assert await views.versioned_allocations("o1", uow, cache=cache) == (
+        1, [{"sku": "sku1", "batchref": "b1"}],
+    )
+    assert cache.stats.hits == 1
+
+    cache.invalidate("o1")
+    version, rows = await views.versioned_allocations("o1", uow, cache=cache)
+    assert version == 2
+    assert sorted(row["sku"] for row in rows) == ["sku1", "sku2"]
+
+
+@pytest.mark.asyncio
+async def test_matching_version_skips_the_rows_query_on_a_cache_miss(
+        sqlite_session_factory, in_memory_db,
+):
+    cache = AllocationsCache(maxsize=10, ttl=60)
+    uow = unit_of_work.SqlAlchemyUnitOfWork(sqlite_session_factory)
+    await messagebus.handle(commands.CreateBatch("b1", "sku1", 50, None), uow)
+    await messagebus.handle(commands.Allocate("o1", "sku1", 10), uow)
+
+    statements = []
+
+    def record(conn, cursor, statement, *args):
+        statements.append(" ".join(statement.split()))
+
+    event.listen(in_memory_db.sync_engine, "before_cursor_execute", record)
+    try:
+        assert await views.versioned_allocations(
+            "o1", uow, cache=cache, unchanged=lambda version: version == 1,
+        ) == (1, None)
+    finally:
+        event.remove(in_memory_db.sync_engine, "before_cursor_execute", record)
+
+    assert statements == [
+        "SELECT version FROM allocations_view_versions WHERE orderid = ?",
+    ]
+    assert len(cache) == 0
+
+    version, rows = await views.versioned_allocations(
+        "o1", uow, cache=cache, unchanged=lambda version: version == 0,
+    )
+    assert (version, rows) == (1, [{"sku": "sku1", "batchref": "b1"}])
+    assert len(cache) == 1
+
+
+@pytest.mark.asyncio
+async def test_allocations_view_served_from_redis_read_model(sqlite_session_factory):
+    read_model = redis.RedisReadModel(InMemoryRedis())
+    uow = unit_of_work.SqlAlchemyUnitOfWork(sqlite_session_factory)
+    await messagebus.handle(commands.CreateBatch("b1", "sku1", 50, None), uow)
+    await messagebus.handle(commands.CreateBatch("b2", "sku1", 50, today), uow)
+    await messagebus.handle(
+        commands.Allocate("o1", "sku1", 40),
+        uow,
+        read_model=read_model,
+    )
+    await messagebus.handle(
+        commands.ChangeBatchQuantity("b1", 10),
+        uow,
+        read_model=read_model,
+    )
+
+    assert await views.allocations("o1", uow, read_model=read_model) == [
+        {"sku": "sku1", "batchref": "b2"},
+    ]
+
+
+@pytest.mark.asyncio
+async def test_allocations_for_many_orders_are_read_in_chunks(sqlite_session_factory):
+    uow = unit_of_work.SqlAlchemyUnitOfWork(sqlite_session_factory)
+    await messagebus.handle(commands.CreateBatch("b1", "sku1", 100, None), uow)
+    await messagebus.handle(commands.CreateBatch("b2", "sku2", 100, None), uow)
+    await messagebus.handle(commands.Allocate("o1", "sku1", 10), uow)
+    await messagebus.handle(commands.Allocate("o1", "sku2", 10), uow)
+    await messagebus.handle(commands.Allocate("o3", "sku2", 10), uow)
+
+    results = [
+        (orderid, sorted(allocations, key=lambda a: a["sku"]))
+        async for orderid, allocations in views.allocations_for_orders(
+            ["o3", "o1", "o2", "o1"], uow, chunk_size=2,
+        )
+    ]
+
+    assert results == [
+        ("o3", [{"batchref": "b2", "sku": "sku2"}]),
+        ("o1", [{"batchref": "b1", "sku": "sku1"}, {"batchref": "b2", "sku": "sku2"}]),
+        ("o2", []),
+    ]
+
+
+@pytest.mark.asyncio
+async def test_allocation_rows_are_encoded_straight_to_json_bytes(sqlite_session_factory):
+    uow = unit_of_work.SqlAlchemyUnitOfWork(sqlite_session_factory)
+    await messagebus.handle(commands.CreateBatch("b1", "sku1", 50, None), uow)
+    await messagebus.handle(commands.Allocate("o1", "sku1", 10), uow)
+
+    rows = await views.allocations("o1", uow)
+
+    assert json.loads(views.encode_allocations(rows)) == [{"batchref": "b1", "sku": "sku1"}]
+    assert views.encode_allocations([]) == b"[]"
+
+
+@pytest.mark.asyncio
+async def test_read_model_handlers_bump_the_order_version(sqlite_session_factory):
+    uow = unit_of_work.SqlAlchemyUnitOfWork(sqlite_session_factory)
+    await messagebus.handle(commands.CreateBatch("b1", "sku1", 50, None), uow)
+    await messagebus.handle(commands.CreateBatch("b2", "sku2", 50, None), uow)
+    assert await views.allocations_version("o1", uow) is None
+
+    await messagebus.handle(commands.Allocate("o1", "sku1", 10), uow)
+    await messagebus.handle(commands.Allocate("o1", "sku2", 10), uow)
+    assert await views.allocations_version("o1", uow) == 2
+
+    # 재할당은 Deallocated 와 Allocated 를 모두 내므로 두 번 오른다
+    await messagebus.handle(commands.ChangeBatchQuantity("b1", 5), uow)
+    assert await views.allocations_version("o1", uow) == 3
+    assert await views.allocations_version("other", uow) is None
+
+
+@pytest.mark.asyncio
+async def test_redis_read_model_keeps_its_own_version(sqlite_session_factory):
+    read_model = redis.RedisReadModel(InMemoryRedis())
+    uow = unit_of_work.SqlAlchemyUnitOfWork(sqlite_session_factory)
+
+    await read_model.add("o1", "sku1", "b1")
+    await read_model.remove("o1", "sku1")
+
+    assert await views.allocations_version("o1", uow, read_model=read_model) == 2
+    assert await views.allocations_version("o2", uow, read_model=read_model) is None
+
+
+def test_if_none_match_uses_weak_comparison():
+    assert views.etag_matches('"3"', '"3"')
+    assert views.etag_matches('"1", W/"3"', '"3"')
+    assert views.etag_matches("*", '"3"')
+    assert not views.etag_matches('"2"', '"3"')
+    assert not views.etag_matches(None, '"3"')
+
+
+@pytest.mark.asyncio
+async def test_changes_are_paged_by_cursor(sqlite_session_factory):
+    uow = unit_of_work.SqlAlchemyUnitOfWork(sqlite_session_factory)
+    await messagebus.handle(commands.CreateBatch("b1", "sku1", 50, None), uow)
+    await messagebus.handle(commands.CreateBatch("b2", "sku1", 50, today), uow)
+    await messagebus.handle(commands.Allocate("o1", "sku1", 40), uow)
+    await messagebus.handle(commands.ChangeBatchQuantity("b1", 10), uow)
+
+    first = await views.changes(0, 2, uow)
+    page = json.loads(views.encode_changes(first, 0))
+    rest = await views.changes(page["next"], 2, uow)
+
+    assert [(c["op"], c["batchref"]) for c in page["changes"]] == [("insert", "b1"), ("delete", None)]
+    assert [(row["op"], row["batchref"]) for row in rest] == [("insert", "b2")]
+    assert json.loads(views.encode_changes([], rest[-1]["seq"])) == {"changes": [], "next": rest[-1]["seq"]}
+
+
+@pytest.mark.asyncio
+async def test_long_poll_returns_once_a_change_is_written(sqlite_session_factory):
+    uow = unit_of_work.SqlAlchemyUnitOfWork(sqlite_session_factory)
+    await messagebus.handle(commands.CreateBatch("b1", "sku1", 50, None), uow)
+
+    assert await views.changes(0, 10, uow, wait=0.05, poll_interval=0.01) == []
+
+    # 기다리는 쪽은 따로 세션을 연다
+    reader = unit_of_work.SqlAlchemyUnitOfWork(sqlite_session_factory)
+    waiting = asyncio.create_task(views.changes(0, 10, reader, wait=5, poll_interval=0.01))
+    await asyncio.sleep(0.03)
+    await messagebus.handle(commands.Allocate("o1", "sku1", 10), uow)
+
+    rows = await asyncio.wait_for(waiting, timeout=1)
+    assert [row["orderid"] for row in rows] == ["o1"]
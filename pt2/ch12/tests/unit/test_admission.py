@@ -0,0 +1,112 @@
+import asyncio
+
+import pytest
+from fastapi import FastAPI
+from httpx import AsyncClient
+
+from pt2.ch12.src.allocation.entrypoints.admission import (
+    AdmissionController,
+    AdmissionMiddleware,
+)
+
+
+class FakeEngine:
+    def __init__(self, wait: float = 0.0):
+        self.wait = wait
+
+    def connect(self):
+        engine = self
+
+        class Connection:
+            async def __aenter__(self):
+                await asyncio.sleep(engine.wait)
+
+            async def __aexit__(self, *args):
+                pass
+
+        return Connection()
+
+
+class FakeDB:
+    def __init__(self, wait: float = 0.0):
+        self.engine = FakeEngine(wait)
+
+
+def make_app(controller: AdmissionController, release: asyncio.Event):
+    app = FastAPI()
+    app.add_middleware(AdmissionMiddleware, controller=controller)
+
+    @app.post("/allocate")
+    async def allocate():
+        await release.wait()
+        return {"message": "allocated"}
+
+    @app.get("/allocations/{orderid}")
+    async def allocations(orderid: str):
+        return []
+
+    @app.get("/metrics")
+    async def metrics():
+        return controller.stats.as_dict()
+
+    return app
+
+
+def test_writes_beyond_the_inflight_limit_are_shed():
+    controller = AdmissionController(FakeDB(), max_inflight_commands=2)
+
+    assert controller.admit(write=True)
+    assert controller.admit(write=True)
+    assert not controller.admit(write=True)
+    assert controller.admit(write=False)
+
+    controller.release(write=True)
+    assert controller.admit(write=True)
+    assert controller.stats.shed_commands == 1
+
+
+def test_when_degraded_only_reads_are_admitted():
+    controller = AdmissionController(FakeDB(), max_pool_wait=0.5, max_loop_lag=0.2)
+
+    controller.observe(pool_wait=0.8, loop_lag=0.0)
+    assert controller.degraded
+    assert not controller.admit(write=True)
+    assert controller.admit(write=False)
+
+    controller.observe(pool_wait=0.1, loop_lag=0.3)
+    assert controller.degraded
+
+    controller.observe(pool_wait=0.1, loop_lag=0.0)
+    assert not controller.degraded
+    assert controller.admit(write=True)
+
+
+@pytest.mark.asyncio
+async def test_pool_wait_is_capped_when_no_connection_becomes_free():
+    controller = AdmissionController(FakeDB(wait=10), max_pool_wait=0.01)
+
+    assert await controller.measure_pool_wait() == pytest.approx(0.02)
+
+
+@pytest.mark.asyncio
+async def test_overloaded_writes_get_503_with_retry_after_while_reads_are_served():
+    controller = AdmissionController(FakeDB(), max_inflight_commands=1, retry_after=2.5)
+    release = asyncio.Event()
+
+    async with AsyncClient(app=make_app(controller, release), base_url="http://test") as client:
+        running = asyncio.create_task(client.post("/allocate"))
+        while controller.stats.inflight_commands == 0:
+            await asyncio.sleep(0)
+
+        shed = await client.post("/allocate")
+        read = await client.get("/allocations/o1")
+        metrics = await client.get("/metrics")
+        release.set()
+        done = await running
+
+    assert shed.status_code == 503
+    assert shed.headers["retry-after"] == "3"
+    assert read.status_code == 200
+    assert metrics.json()["shed_commands"] == 1
+    assert done.status_code == 200
+    assert controller.stats.inflight_commands == 0
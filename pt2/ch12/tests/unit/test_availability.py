@@ -0,0 +1,53 @@
+import pytest
+
+from pt2.ch12.src.allocation.adapters.availability import AvailabilityCache
+from pt2.ch12.src.allocation.adapters.inmemory import InMemoryRedis
+
+
+@pytest.mark.asyncio
+async def test_only_a_summary_of_the_current_version_rejects():
+    availability = AvailabilityCache()
+    await availability.update("LAMP", 3, 5)
+
+    assert await availability.rejects("LAMP", 3, 6)
+    assert not await availability.rejects("LAMP", 3, 5)
+    # 다른 프로세스가 바꿨으면 버전이 달라서 느린 길로 간다
+    assert not await availability.rejects("LAMP", 4, 6)
+    assert not await availability.rejects("TABLE", 1, 6)
+    assert availability.stats.as_dict() == dict(
+        rejections=1, passes=1, misses=2, updates=1, redis_hits=0, redis_errors=0,
+    )
+
+
+@pytest.mark.asyncio
+async def test_a_late_summary_of_an_older_version_is_ignored():
+    availability = AvailabilityCache()
+    await availability.update("LAMP", 4, 0)
+    await availability.update("LAMP", 3, 10)
+
+    assert await availability.max_available("LAMP", 4) == 0
+
+
+@pytest.mark.asyncio
+async def test_summaries_are_shared_through_redis():
+    session = InMemoryRedis()
+    writer = AvailabilityCache(session=session)
+    reader = AvailabilityCache(session=session)
+    await writer.update("LAMP", 3, 5)
+
+    assert await reader.rejects("LAMP", 3, 6)
+    assert await reader.max_available("LAMP", 2) is None
+    assert reader.stats.redis_hits == 1
+    assert len(reader) == 1
+
+
+@pytest.mark.asyncio
+async def test_might_reject_looks_at_the_latest_summary_of_any_version():
+    session = InMemoryRedis()
+    await AvailabilityCache(session=session).update("LAMP", 3, 5)
+    availability = AvailabilityCache(session=session)
+
+    assert await availability.might_reject("LAMP", 6)
+    assert not await availability.might_reject("LAMP", 5)
+    assert not await availability.might_reject("TABLE", 1)
+    assert availability.stats.redis_hits == 1
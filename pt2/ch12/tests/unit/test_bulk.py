@@ -0,0 +1,126 @@
+import asyncio
+import json
+
+import pytest
+
+from pt2.ch12.src.allocation import bulk
+from pt2.ch12.src.allocation.domain import commands
+from pt2.ch12.src.allocation.service_layer import messagebus
+from pt2.ch12.tests.unit.test_handlers import FakeUnitOfWork
+
+
+async def chunked(payload: bytes, size: int):
+    for i in range(0, len(payload), size):
+        yield payload[i:i + size]
+        await asyncio.sleep(0)
+
+
+def ndjson(*lines) -> bytes:
+    return b"".join(
+        (line if isinstance(line, bytes) else json.dumps(line).encode()) + b"\n"
+        for line in lines
+    )
+
+
+async def collect(allocator: bulk.BulkAllocator, payload: bytes, size: int = 7) -> list:
+    results = []
+    async for batch in allocator.run(chunked(payload, size)):
+        results.extend(batch)
+    return sorted(results, key=lambda result: result["line"])
+
+
+@pytest.mark.asyncio
+async def test_lines_split_across_chunks_are_reassembled():
+    payload = b'{"a": 1}\n\n{"b": 2}\n{"c": 3}'
+
+    lines = [line async for line in bulk.split_lines(chunked(payload, 3))]
+
+    assert lines == [b'{"a": 1}', b'{"b": 2}', b'{"c": 3}']
+
+
+@pytest.mark.asyncio
+async def test_overlong_lines_are_reported_without_buffering_them():
+    payload = b"x" * 20 + b"\n" + b'{"ok": 1}\n'
+
+    lines = [line async for line in bulk.split_lines(chunked(payload, 4), max_line_bytes=10)]
+
+    assert lines == [None, b'{"ok": 1}']
+
+
+@pytest.mark.asyncio
+async def test_allocates_through_the_message_bus_and_reports_every_line():
+    uow = FakeUnitOfWork()
+    await messagebus.handle(commands.CreateBatch("b1", "LAMP", 10, None), uow)
+
+    async def allocate(command):
+        return (await messagebus.handle(command, uow))[0]
+
+    results = await collect(
+        bulk.BulkAllocator(allocate),
+        ndjson(
+            {"orderid": "o1", "sku": "LAMP", "qty": 6},
+            {"orderid": "o2", "sku": "LAMP", "qty": 6},
+            {"orderid": "o3", "sku": "NOPE", "qty": 1},
+            b"not json",
+            {"orderid": "o5", "sku": "LAMP"},
+        ),
+    )
+
+    assert [(r["line"], r["status"]) for r in results] == [
+        (1, bulk.ALLOCATED),
+        (2, bulk.OUT_OF_STOCK),
+        (3, bulk.INVALID_SKU),
+        (4, bulk.INVALID),
+        (5, bulk.INVALID),
+    ]
+    assert results[0]["batchref"] == "b1"
+
+
+@pytest.mark.asyncio
+async def test_keeps_order_per_sku_and_bounds_concurrency():
+    handled, running, peak = [], 0, 0
+
+    async def allocate(command: commands.Allocate):
+        nonlocal running, peak
+        running += 1
+        peak = max(peak, running)
+        await asyncio.sleep(0.001)
+        handled.append(command)
+        running -= 1
+        return "b1"
+
+    results = await collect(
+        bulk.BulkAllocator(allocate, concurrency=2),
+        ndjson(*[
+            {"orderid": f"o{i}", "sku": f"sku{i % 3}", "qty": 1}
+            for i in range(12)
+        ]),
+    )
+
+    assert len(results) == 12
+    assert peak == 2
+    for sku in range(3):
+        same_sku = [int(c.order_id[1:]) for c in handled if c.sku == f"sku{sku}"]
+        assert same_sku == sorted(same_sku)
+
+
+@pytest.mark.asyncio
+async def test_results_stream_out_before_the_input_ends():
+    more_input = asyncio.Event()
+
+    async def slow_client():
+        yield ndjson({"orderid": "o1", "sku": "LAMP", "qty": 1})
+        await more_input.wait()
+        yield ndjson({"orderid": "o2", "sku": "LAMP", "qty": 1})
+
+    async def allocate(command):
+        return "b1"
+
+    batches = bulk.BulkAllocator(allocate).run(slow_client())
+
+    first = await asyncio.wait_for(batches.__anext__(), timeout=1)
+    assert [r["orderid"] for r in first] == ["o1"]
+
+    more_input.set()
+    rest = [r async for batch in batches for r in batch]
+    assert [r["orderid"] for r in rest] == ["o2"]
@@ -0,0 +1,140 @@
+import asyncio
+
+import pytest
+
+from pt2.ch12.src.allocation.adapters.cache import AllocationsCache
+
+
+def loader_returning(value, calls):
+    async def load():
+        calls.append(value)
+        await asyncio.sleep(0)
+        return value
+    return load
+
+
+@pytest.mark.asyncio
+async def test_second_lookup_is_a_hit():
+    cache = AllocationsCache(maxsize=10, ttl=10)
+    calls = []
+
+    assert await cache.get_or_load("o1", loader_returning(["a"], calls)) == ["a"]
+    assert await cache.get_or_load("o1", loader_returning(["b"], calls)) == ["a"]
+
+    assert calls == [["a"]]
+    assert cache.stats.hits == 1
+    assert cache.stats.misses == 1
+    assert cache.stats.hit_ratio == 0.5
+
+
+@pytest.mark.asyncio
+async def test_entries_expire_after_ttl(clock):
+    cache = AllocationsCache(maxsize=10, ttl=5, clock=clock)
+    calls = []
+
+    await cache.get_or_load("o1", loader_returning(["a"], calls))
+    clock.now = 5.1
+    assert await cache.get_or_load("o1", loader_returning(["b"], calls)) == ["b"]
+
+    assert cache.stats.expirations == 1
+
+
+@pytest.mark.asyncio
+async def test_least_recently_used_entry_is_evicted():
+    cache = AllocationsCache(maxsize=2, ttl=10)
+    calls = []
+
+    await cache.get_or_load("o1", loader_returning(1, calls))
+    await cache.get_or_load("o2", loader_returning(2, calls))
+    await cache.get_or_load("o1", loader_returning(1, calls))
+    await cache.get_or_load("o3", loader_returning(3, calls))
+
+    assert len(cache) == 2
+    assert cache.stats.evictions == 1
+    await cache.get_or_load("o2", loader_returning(22, calls))
+    assert calls[-1] == 22
+
+
+@pytest.mark.asyncio
+async def test_concurrent_misses_are_coalesced():
+    cache = AllocationsCache(maxsize=10, ttl=10)
+    release = asyncio.Event()
+    calls = []
+
+    async def slow_load():
+        calls.append(1)
+        await release.wait()
+        return ["a"]
+
+    tasks = [
+        asyncio.create_task(cache.get_or_load("o1", slow_load))
+        for _ in range(5)
+    ]
+    await asyncio.sleep(0)
+    release.set()
+
+    assert await asyncio.gather(*tasks) == [["a"]] * 5
+    assert calls == [1]
+    assert cache.stats.coalesced == 4
+
+
+@pytest.mark.asyncio
+async def test_waiters_take_over_when_the_loading_request_is_cancelled():
+    cache = AllocationsCache(maxsize=10, ttl=10)
+    release = asyncio.Event()
+    calls = []
+
+    async def slow_load():
+        calls.append(1)
+        await release.wait()
+        return ["a"]
+
+    leader = asyncio.create_task(cache.get_or_load("o1", slow_load))
+    await asyncio.sleep(0)
+    waiters = [
+        asyncio.create_task(cache.get_or_load("o1", slow_load))
+        for _ in range(2)
+    ]
+    await asyncio.sleep(0)
+
+    leader.cancel()
+    for _ in range(3):
+        await asyncio.sleep(0)
+    release.set()
+
+    assert await asyncio.gather(*waiters) == [["a"]] * 2
+    assert leader.cancelled()
+    assert calls == [1, 1]
+
+
+@pytest.mark.asyncio
+async def test_invalidation_during_load_does_not_cache_stale_result():
+    cache = AllocationsCache(maxsize=10, ttl=10)
+    release = asyncio.Event()
+
+    async def stale_load():
+        await release.wait()
+        return ["stale"]
+
+    task = asyncio.create_task(cache.get_or_load("o1", stale_load))
+    await asyncio.sleep(0)
+    cache.invalidate("o1")
+    release.set()
+    assert await task == ["stale"]
+
+    calls = []
+    assert await cache.get_or_load("o1", loader_returning(["fresh"], calls)) == ["fresh"]
+
+
+@pytest.mark.asyncio
+async def test_loader_errors_are_not_cached():
+    cache = AllocationsCache(maxsize=10, ttl=10)
+
+    async def broken():
+        raise RuntimeError("db down")
+
+    with pytest.raises(RuntimeError):
+        await cache.get_or_load("o1", broken)
+
+    calls = []
+    assert await cache.get_or_load("o1", loader_returning(["a"], calls)) == ["a"]
@@ -0,0 +1,70 @@
+import json
+from dataclasses import asdict
+from datetime import date
+
+import pytest
+from pydantic import ValidationError
+
+from pt2.ch12.config import MessageBrokerSettings
+from pt2.ch12.src.allocation.adapters import codec
+from pt2.ch12.src.allocation.domain import commands, events
+
+
+SAMPLES = [
+    events.Allocated(orderid="o1", sku="LAMP", qty=3, batchref="b1"),
+    events.Deallocated(orderid="o1", sku="LAMP", qty=3),
+    events.OutOfStock(sku="LAMP"),
+    commands.Allocate(order_id="o1", sku="LAMP", qty=3),
+    commands.Deallocate(order_id="o1", sku="LAMP", qty=3),
+    commands.CreateBatch(ref="b1", sku="LAMP", qty=100, eta=date(2023, 1, 2)),
+    commands.CreateBatch(ref="b2", sku="LAMP", qty=100),
+    commands.ChangeBatchQuantity(ref="b1", qty=50),
+]
+
+
+def test_every_message_type_is_registered():
+    assert {type(sample).__name__ for sample in SAMPLES} == set(codec.MESSAGE_TYPES)
+
+
+@pytest.mark.parametrize("message", SAMPLES, ids=lambda m: type(m).__name__)
+def test_json_round_trip(message):
+    raw = codec.encode(message)
+
+    assert codec.decode(type(message), raw) == message
+    assert json.loads(raw) == json.loads(json.dumps(asdict(message), default=str))
+
+
+@pytest.mark.parametrize("message", SAMPLES, ids=lambda m: type(m).__name__)
+def test_msgpack_round_trip(message):
+    pytest.importorskip("msgpack")
+
+    assert codec.decode(type(message), codec.encode(message, codec.MSGPACK), codec.MSGPACK) == message
+
+
+def test_missing_optional_fields_use_the_default():
+    assert codec.from_dict(
+        commands.CreateBatch, {"ref": "b1", "sku": "LAMP", "qty": 1}
+    ) == commands.CreateBatch(ref="b1", sku="LAMP", qty=1, eta=None)
+
+
+def test_encodes_each_message_once_per_backend(monkeypatch):
+    event = events.Allocated(orderid="o1", sku="LAMP", qty=3, batchref="b1")
+    first = codec.encode(event)
+
+    monkeypatch.setattr(codec, "to_dict", lambda message: pytest.fail("encoded twice"))
+    assert codec.encode(event) is first
+    # 캐시는 데이터클래스 필드가 아니라서 비교나 asdict 에 나타나지 않는다
+    assert event == events.Allocated(orderid="o1", sku="LAMP", qty=3, batchref="b1")
+    assert "_encoded" not in asdict(event)
+
+
+def test_unknown_backend_is_rejected():
+    with pytest.raises(ValueError):
+        codec.encode(events.OutOfStock(sku="LAMP"), "xml")
+
+
+def test_broker_settings_reject_a_binary_event_codec():
+    # 브로커를 거친 페이로드는 문자열로 돌아오므로 msgpack 은 설정에서 막는다
+    with pytest.raises(ValidationError, match="EVENT_CODEC=msgpack"):
+        MessageBrokerSettings(EVENT_CODEC="msgpack")
+    assert MessageBrokerSettings(EVENT_CODEC="json").EVENT_CODEC == "json"
@@ -0,0 +1,85 @@
+import json
+from types import SimpleNamespace
+
+import pytest
+
+from pt2.ch12.src.allocation.adapters import envelope
+from pt2.ch12.src.allocation.adapters.dedup import DedupStore
+from pt2.ch12.src.allocation.adapters.inmemory import InMemoryRedis
+from pt2.ch12.src.allocation.domain import events, model
+from pt2.ch12.src.allocation.service_layer import unit_of_work
+
+
+class StubUnitOfWork(unit_of_work.AbstractUnitOfWork):
+    def __init__(self, *products):
+        self.products = SimpleNamespace(seen=set(products))
+
+    async def commit(self):
+        pass
+
+    async def rollback(self):
+        pass
+
+
+def test_envelope_carries_id_type_version_and_timestamp():
+    event = events.Allocated(orderid="o1", sku="LAMP", qty=1, batchref="b1")
+    envelope.stamp(event, aggregate_version=3)
+
+    wrapped = json.loads(envelope.encode(event))
+
+    assert wrapped["type"] == "Allocated"
+    assert wrapped["schema"] == envelope.SCHEMA_VERSION
+    assert wrapped["aggregate_version"] == 3
+    assert wrapped["occurred_at"] > 0
+    assert wrapped["data"] == {"orderid": "o1", "sku": "LAMP", "qty": 1, "batchref": "b1"}
+
+    decoded = envelope.decode(envelope.encode(event))
+    assert decoded == event
+    assert envelope.stamp(decoded).event_id == wrapped["id"]
+
+
+def test_event_id_is_fixed_once_stamped():
+    event = events.OutOfStock(sku="LAMP")
+
+    first = envelope.stamp(event, aggregate_version=1)
+    assert envelope.stamp(event, aggregate_version=2) is first
+
+
+def test_collected_events_are_stamped_with_the_aggregate_version():
+    product = model.Product("LAMP", [model.Batch("b1", "LAMP", 10, eta=None)], version_number=4)
+    product.allocate(model.OrderLine("o1", "LAMP", 1))
+    uow = StubUnitOfWork(product)
+
+    uow.stamp_new_events()
+    [event] = list(uow.collect_new_events())
+
+    assert envelope.stamp(event).aggregate_version == 5
+
+
+def test_bare_payloads_are_not_envelopes():
+    assert envelope.unwrap({"batchref": "b1", "qty": 1}) == (None, {"batchref": "b1", "qty": 1})
+
+
+@pytest.mark.asyncio
+async def test_dedup_store_remembers_a_bounded_window():
+    store = DedupStore(window=2)
+
+    assert await store.claim("a")
+    assert not await store.claim("a")
+    assert await store.claim("b")
+    assert await store.claim("c")
+    # "a" 는 창 밖으로 밀려났다
+    assert await store.claim("a")
+    assert store.stats.duplicates == 1
+
+
+@pytest.mark.asyncio
+async def test_dedup_store_is_shared_through_redis_and_can_be_released():
+    session = InMemoryRedis()
+    first, second = DedupStore(session=session), DedupStore(session=session)
+
+    assert await first.claim("e1")
+    assert not await second.claim("e1")
+
+    await first.release("e1")
+    assert await DedupStore(session=session).claim("e1")
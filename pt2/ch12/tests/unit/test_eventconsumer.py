@@ -0,0 +1,328 @@
+import asyncio
+import json
+
+import pytest
+
+from pt2.ch12.src.allocation.adapters import redis
+from pt2.ch12.src.allocation.adapters.dedup import DedupStore
+from pt2.ch12.src.allocation.adapters.inmemory import InMemoryRedis
+from pt2.ch12.src.allocation.adapters.streams import StreamConsumer
+from pt2.ch12.src.allocation.domain import commands
+from pt2.ch12.src.allocation.entrypoints.redis_eventconsumer import EventConsumer
+
+
+STREAM = "change_batch_quantity"
+
+
+async def make_consumer(*payloads) -> StreamConsumer:
+    session = InMemoryRedis()
+    for payload in payloads:
+        await session.xadd(STREAM, {redis.STREAM_FIELD: json.dumps(payload)})
+    return StreamConsumer(
+        session,
+        streams=[STREAM],
+        group="allocation",
+        consumer="c1",
+        block_ms=10,
+    )
+
+
+def pending(consumer: StreamConsumer) -> int:
+    return len(consumer._session._streams[STREAM].groups["allocation"].pending)
+
+
+@pytest.mark.asyncio
+async def test_keeps_order_per_sku_and_bounds_concurrency():
+    consumer = await make_consumer(*[
+        {"batchref": f"b{i}", "qty": i, "sku": f"sku{i % 3}"}
+        for i in range(12)
+    ])
+    handled, running, peak = [], 0, 0
+
+    async def handle(command: commands.ChangeBatchQuantity):
+        nonlocal running, peak
+        running += 1
+        peak = max(peak, running)
+        await asyncio.sleep(0.001)
+        handled.append(command.qty)
+        running -= 1
+
+    stop = asyncio.Event()
+    event_consumer = EventConsumer(consumer, handle, concurrency=2)
+    task = asyncio.create_task(event_consumer.run(stop))
+    while event_consumer.stats.handled < 12:
+        await asyncio.sleep(0.001)
+    stop.set()
+    await asyncio.wait_for(task, timeout=1)
+
+    assert peak == 2
+    for sku in range(3):
+        same_sku = [qty for qty in handled if qty % 3 == sku]
+        assert same_sku == sorted(same_sku)
+    assert pending(consumer) == 0
+
+
+@pytest.mark.asyncio
+async def test_failure_stops_the_lane_and_leaves_the_rest_pending():
+    consumer = await make_consumer(
+        {"batchref": "b1", "qty": 1, "sku": "LAMP"},
+        {"batchref": "fails", "qty": 2, "sku": "LAMP"},
+        {"batchref": "b3", "qty": 3, "sku": "LAMP"},
+        {"batchref": "b4", "qty": 4, "sku": "TABLE"},
+    )
+    handled = []
+
+    async def handle(command: commands.ChangeBatchQuantity):
+        if command.ref == "fails":
+            raise RuntimeError("boom")
+        handled.append(command.ref)
+
+    event_consumer = EventConsumer(consumer, handle)
+    await consumer.start()
+    await event_consumer.process(await consumer.read())
+
+    assert handled == ["b1", "b4"]
+    assert event_consumer.stats.failed == 1
+    assert pending(consumer) == 2
+
+
+@pytest.mark.asyncio
+async def test_newer_messages_wait_until_the_failed_ones_are_redelivered():
+    consumer = await make_consumer(
+        {"batchref": "fails", "qty": 1, "sku": "LAMP"},
+        {"batchref": "b2", "qty": 2, "sku": "LAMP"},
+    )
+    handled, broken = [], True
+
+    async def handle(command: commands.ChangeBatchQuantity):
+        if command.ref == "fails" and broken:
+            raise RuntimeError("boom")
+        handled.append(command.ref)
+
+    event_consumer = EventConsumer(consumer, handle)
+    await consumer.start()
+    first = await consumer.read()
+    await event_consumer.process(first)
+
+    # 다음 배치의 같은 SKU 메시지는 앞의 실패가 다시 올 때까지 처리하지 않는다
+    await consumer._session.xadd(STREAM, {redis.STREAM_FIELD: json.dumps(
+        {"batchref": "b3", "qty": 3, "sku": "LAMP"}
+    )})
+    later = await consumer.read()
+    await event_consumer.process(later)
+    assert handled == []
+    assert pending(consumer) == 3
+
+    broken = False
+    await event_consumer.process(first)
+    await event_consumer.process(later)
+
+    assert handled == ["fails", "b2", "b3"]
+    assert event_consumer.stats.deferred == 3
+    assert pending(consumer) == 0
+
+
+@pytest.mark.asyncio
+async def test_failures_are_retried_in_the_lane_before_giving_up():
+    consumer = await make_consumer(
+        {"batchref": "flaky", "qty": 1, "sku": "LAMP"},
+        {"batchref": "b2", "qty": 2, "sku": "LAMP"},
+    )
+    attempts = []
+
+    async def handle(command: commands.ChangeBatchQuantity):
+        attempts.append(command.ref)
+        if attempts.count("flaky") < 3:
+            raise RuntimeError("boom")
+
+    event_consumer = EventConsumer(consumer, handle, retries=2, retry_backoff=0)
+    await consumer.start()
+    await event_consumer.process(await consumer.read())
+
+    assert attempts == ["flaky", "flaky", "flaky", "b2"]
+    assert event_consumer.stats.retries == 2
+    assert event_consumer.stats.failed == 0
+    assert pending(consumer) == 0
+
+
+@pytest.mark.asyncio
+async def test_stop_drains_the_batch_in_flight():
+    consumer = await make_consumer(
+        {"batchref": "b1", "qty": 1},
+        {"batchref": "b2", "qty": 2},
+    )
+    stop = asyncio.Event()
+    started = asyncio.Event()
+    handled = []
+
+    async def handle(command: commands.ChangeBatchQuantity):
+        started.set()
+        await asyncio.sleep(0.01)
+        handled.append(command.ref)
+
+    event_consumer = EventConsumer(consumer, handle, drain_timeout=1)
+    task = asyncio.create_task(event_consumer.run(stop))
+    await started.wait()
+    stop.set()
+    await asyncio.wait_for(task, timeout=1)
+
+    assert sorted(handled) == ["b1", "b2"]
+    assert pending(consumer) == 0
+
+
+@pytest.mark.asyncio
+async def test_records_lag_from_stream_ids():
+    consumer = await make_consumer({"batchref": "b1", "qty": 1})
+
+    async def handle(command):
+        pass
+
+    event_consumer = EventConsumer(consumer, handle, clock=lambda: 10 ** 12)
+    await consumer.start()
+    await event_consumer.process(await consumer.read())
+
+    assert event_consumer.stats.last_lag > 0
+    assert event_consumer.stats.max_lag == event_consumer.stats.last_lag
+
+
+@pytest.mark.asyncio
+async def test_duplicate_event_ids_never_reach_the_handler():
+    wrapped = {"id": "evt-1", "type": "ChangeBatchQuantity", "data": {"batchref": "b1", "qty": 5}}
+    consumer = await make_consumer(wrapped, wrapped, {**wrapped, "id": "evt-2"})
+    handled = []
+
+    async def handle(command):
+        handled.append(command)
+
+    event_consumer = EventConsumer(consumer, handle, dedup=DedupStore())
+    await consumer.start()
+    await event_consumer.process(await consumer.read())
+
+    assert len(handled) == 2
+    assert event_consumer.stats.duplicates == 1
+    assert pending(consumer) == 0
+
+
+@pytest.mark.asyncio
+async def test_failed_events_are_released_for_redelivery():
+    wrapped = {"id": "evt-1", "type": "ChangeBatchQuantity", "data": {"batchref": "b1", "qty": 5}}
+    consumer = await make_consumer(wrapped)
+    dedup = DedupStore()
+    attempts = []
+
+    async def handle(command):
+        attempts.append(command)
+        if len(attempts) == 1:
+            raise RuntimeError("boom")
+
+    event_consumer = EventConsumer(consumer, handle, dedup=dedup)
+    await consumer.start()
+    messages = await consumer.read()
+    await event_consumer.process(messages)
+    await event_consumer.process(messages)
+
+    assert len(attempts) == 2
+    assert event_consumer.stats.duplicates == 0
+
+
+def change(batchref: str, sku: str = "LAMP") -> dict:
+    return {redis.STREAM_FIELD: json.dumps({"batchref": batchref, "qty": 1, "sku": sku})}
+
+
+@pytest.mark.asyncio
+async def test_a_key_taken_over_by_another_consumer_is_unblocked(clock):
+    session = InMemoryRedis(clock=clock)
+    failing, healthy = [
+        StreamConsumer(
+            session, streams=[STREAM], group="allocation", consumer=name,
+            block_ms=10, claim_idle_ms=1000, claim_interval=0, clock=clock,
+        )
+        for name in ("failing", "healthy")
+    ]
+    handled = []
+
+    async def broken(command):
+        raise RuntimeError("boom")
+
+    async def handle(command):
+        handled.append(command.ref)
+
+    stuck = EventConsumer(failing, broken, redeliver_interval=0)
+    other = EventConsumer(healthy, handle)
+    await failing.start()
+    await session.xadd(STREAM, change("b1"))
+    await stuck.process(await failing.read())
+    assert stuck.stats.failed == 1
+
+    # 오래 걸려 있던 b1 은 다른 컨슈머가 XAUTOCLAIM 으로 가져가서 처리한다
+    clock.now += 2
+    await other.process(await healthy.read())
+    assert handled == ["b1"]
+
+    # 막혀 있던 컨슈머는 PEL 을 보고 더 기다리지 않는다. 그동안 받은 같은 SKU 메시지를 처리한다
+    stuck._handle = handle
+    await session.xadd(STREAM, change("b2"))
+    await stuck.process(await failing.read())
+    assert handled == ["b1"]
+    await stuck.redeliver()
+
+    assert handled == ["b1", "b2"]
+    assert stuck.stats.taken_over == 1
+    assert pending(failing) == 0
+
+
+@pytest.mark.asyncio
+async def test_messages_past_max_deliveries_go_to_the_dead_letter_stream():
+    consumer = await make_consumer(
+        {"batchref": "poison", "qty": 1, "sku": "LAMP"},
+        {"batchref": "b2", "qty": 2, "sku": "LAMP"},
+    )
+    handled = []
+
+    async def handle(command):
+        if command.ref == "poison":
+            raise RuntimeError("boom")
+        handled.append(command.ref)
+
+    event_consumer = EventConsumer(consumer, handle, max_deliveries=3, redeliver_interval=0)
+    await consumer.start()
+    await event_consumer.process(await consumer.read())
+    await event_consumer.redeliver()
+    assert handled == []
+
+    await event_consumer.redeliver()
+
+    assert handled == ["b2"]
+    assert event_consumer.stats.dead_lettered == 1
+    assert pending(consumer) == 0
+    [fields] = consumer._session._streams["dead_letters"].entries.values()
+    assert fields["source_stream"] == STREAM
+    assert json.loads(fields[redis.STREAM_FIELD])["batchref"] == "poison"
+    assert "boom" in fields["error"]
+
+
+@pytest.mark.asyncio
+async def test_a_brief_failure_is_redelivered_without_waiting_for_the_claim_timeout():
+    consumer = await make_consumer(
+        {"batchref": "flaky", "qty": 1, "sku": "LAMP"},
+        {"batchref": "b2", "qty": 2, "sku": "LAMP"},
+    )
+    handled, attempts = [], []
+
+    async def handle(command):
+        attempts.append(command.ref)
+        if attempts == ["flaky"]:
+            raise RuntimeError("boom")
+        handled.append(command.ref)
+
+    stop = asyncio.Event()
+    event_consumer = EventConsumer(consumer, handle, redeliver_interval=0.01)
+    task = asyncio.create_task(event_consumer.run(stop))
+    while event_consumer.stats.handled < 2:
+        await asyncio.sleep(0.001)
+    stop.set()
+    await asyncio.wait_for(task, timeout=1)
+
+    assert handled == ["flaky", "b2"]
+    assert event_consumer.stats.redelivered == 2
+    assert pending(consumer) == 0
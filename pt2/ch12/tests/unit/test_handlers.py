@@ -274,3 +274,34 @@ class TestChangeBatchQuantity:
         assert batch1.available_quantity == 5
         # 다음 배치에서 20을 재할당한다
         assert batch2.available_quantity == 30
+
+
+class FailingBuffer:
+    def __init__(self):
+        self.flushes = 0
+
+    async def after_handle(self):
+        self.flushes += 1
+        raise RuntimeError("flush failed")
+
+
+class TestAfterHandle:
+    @pytest.mark.asyncio
+    async def test_failed_commands_keep_their_exception_and_do_not_flush(self):
+        uow = FakeUnitOfWork()
+        buffer = FailingBuffer()
+
+        with pytest.raises(handlers.InvalidSku):
+            await messagebus.handle(commands.Allocate("o1", "NONEXISTENTSKU", 10), uow, buffer=buffer)
+
+        assert buffer.flushes == 0
+
+    @pytest.mark.asyncio
+    async def test_successful_commands_flush(self):
+        uow = FakeUnitOfWork()
+        buffer = FailingBuffer()
+
+        with pytest.raises(RuntimeError, match="flush failed"):
+            await messagebus.handle(commands.CreateBatch("b1", "LAMP", 10, None), uow, buffer=buffer)
+
+        assert buffer.flushes == 1
@@ -0,0 +1,144 @@
+import asyncio
+
+import pytest
+
+from pt2.ch12.src.allocation.adapters.hub import BrokerFeed, EventHub, SlowConsumer
+from pt2.ch12.src.allocation.adapters.inmemory import InMemoryRedis
+from pt2.ch12.src.allocation.domain import commands, events
+from pt2.ch12.src.allocation.service_layer import messagebus
+from pt2.ch12.tests.unit.test_handlers import FakeUnitOfWork
+
+
+@pytest.mark.asyncio
+async def test_subscribers_only_get_the_skus_and_orders_they_asked_for():
+    hub = EventHub()
+    everything = hub.subscribe()
+    lamps = hub.subscribe(skus=["LAMP"])
+    order = hub.subscribe(orderids=["o2"])
+
+    hub.publish(events.Allocated("o1", "LAMP", 1, "b1"))
+    hub.publish(events.Allocated("o2", "TABLE", 1, "b2"))
+    hub.publish(events.OutOfStock("LAMP"))
+
+    assert len(everything) == 3
+    assert (await lamps.get()).orderid == "o1"
+    assert await lamps.get() == events.OutOfStock("LAMP")
+    assert await order.get() == events.Allocated("o2", "TABLE", 1, "b2")
+    assert len(order) == 0
+
+
+@pytest.mark.asyncio
+async def test_get_waits_for_the_next_event_or_times_out():
+    hub = EventHub()
+    subscription = hub.subscribe()
+
+    assert await subscription.get(timeout=0.01) is None
+
+    waiting = asyncio.create_task(subscription.get(timeout=1))
+    await asyncio.sleep(0)
+    hub.publish(events.OutOfStock("LAMP"))
+    assert await waiting == events.OutOfStock("LAMP")
+
+
+@pytest.mark.asyncio
+async def test_slow_subscribers_are_dropped_without_holding_back_others():
+    hub = EventHub(buffer_size=2)
+    slow = hub.subscribe()
+    fast = hub.subscribe()
+
+    for i in range(3):
+        hub.publish(events.OutOfStock(f"sku{i}"))
+        await fast.get()
+
+    assert slow.dropped
+    with pytest.raises(SlowConsumer):
+        await slow.get()
+    assert len(hub) == 1
+    assert hub.stats.dropped_subscribers == 1
+    assert hub.stats.delivered == 5
+
+
+@pytest.mark.asyncio
+async def test_closed_subscriptions_stop_receiving():
+    hub = EventHub()
+    subscription = hub.subscribe()
+    subscription.close()
+
+    assert hub.publish(events.OutOfStock("LAMP")) == 0
+    assert hub.stats.subscribers == 0
+
+
+@pytest.mark.asyncio
+async def test_reallocation_is_pushed_through_the_message_bus():
+    uow = FakeUnitOfWork()
+    hub = EventHub()
+    await messagebus.handle(commands.CreateBatch("b1", "LAMP", 10, None), uow)
+    await messagebus.handle(commands.CreateBatch("b2", "LAMP", 10, None), uow)
+    await messagebus.handle(commands.Allocate("o1", "LAMP", 8), uow)
+    subscription = hub.subscribe(orderids=["o1"])
+
+    await messagebus.handle(commands.ChangeBatchQuantity("b1", 5), uow, hub=hub)
+
+    assert await subscription.get() == events.Deallocated("o1", "LAMP", 8)
+    assert await subscription.get() == events.Allocated("o1", "LAMP", 8, "b2")
+
+
+@pytest.mark.asyncio
+async def test_broker_feed_delivers_changes_from_every_process_once():
+    broker = InMemoryRedis()
+    api_hub, other_api_hub = EventHub(), EventHub()
+    api_feed = BrokerFeed(api_hub, broker, block_ms=10)
+    other_api_feed = BrokerFeed(other_api_hub, broker, block_ms=10)
+    # 컨슈머 프로세스는 보내기만 한다
+    consumer_feed = BrokerFeed(EventHub(), broker, relay=False)
+    for feed in (api_feed, other_api_feed, consumer_feed):
+        await feed.start()
+    mine, theirs = api_hub.subscribe(), other_api_hub.subscribe()
+    while len(broker._subscribers[BrokerFeed.CHANNEL]) < 2:
+        await asyncio.sleep(0.01)
+
+    uow = FakeUnitOfWork()
+    await messagebus.handle(commands.CreateBatch("b1", "LAMP", 10, None), uow)
+    await messagebus.handle(commands.Allocate("o1", "LAMP", 8), uow, hub=api_hub, hub_feed=api_feed)
+    await asyncio.sleep(0.05)
+    consumer_feed.broadcast(events.Deallocated("o1", "LAMP", 8))
+
+    for subscription in (mine, theirs):
+        assert await subscription.get(timeout=1) == events.Allocated("o1", "LAMP", 8, "b1")
+        assert await subscription.get(timeout=1) == events.Deallocated("o1", "LAMP", 8)
+        assert await subscription.get(timeout=0.05) is None
+
+    assert len(broker._subscribers[BrokerFeed.CHANNEL]) == 2
+    for feed in (api_feed, other_api_feed, consumer_feed):
+        await feed.close()
+
+
+class HangingRedis(InMemoryRedis):
+    async def publish(self, channel, message):
+        await asyncio.sleep(10)
+
+
+@pytest.mark.asyncio
+async def test_a_hanging_broker_does_not_hold_back_the_message_bus():
+    feed = BrokerFeed(EventHub(), HangingRedis(), publish_timeout=0.05, relay=False)
+    await feed.start()
+    uow = FakeUnitOfWork()
+    await messagebus.handle(commands.CreateBatch("b1", "LAMP", 10, None), uow)
+
+    loop = asyncio.get_running_loop()
+    started = loop.time()
+    await messagebus.handle(commands.Allocate("o1", "LAMP", 8), uow, hub_feed=feed)
+    assert loop.time() - started < 0.05
+
+    await feed.close()
+    assert feed.stats.failed == 1
+    assert feed.stats.broadcast == 0
+
+
+@pytest.mark.asyncio
+async def test_broadcasts_beyond_max_pending_are_dropped():
+    feed = BrokerFeed(EventHub(), InMemoryRedis(), max_pending=1, relay=False)
+
+    assert feed.broadcast(events.OutOfStock("LAMP"))
+    assert not feed.broadcast(events.OutOfStock("TABLE"))
+    assert feed.stats.dropped == 1
@@ -0,0 +1,99 @@
+import asyncio
+
+import pytest
+
+from pt2.ch12.src.allocation.adapters.idempotency import (
+    IdempotencyConflict,
+    IdempotencyStore,
+    StoredResponse,
+    fingerprint,
+)
+
+
+def counting(response: StoredResponse):
+    calls = []
+
+    async def run():
+        calls.append(1)
+        await asyncio.sleep(0)
+        return response
+
+    return run, calls
+
+
+@pytest.mark.asyncio
+async def test_a_retry_with_the_same_key_replays_the_first_response():
+    store = IdempotencyStore()
+    run, calls = counting(StoredResponse(202, {"message": "allocated"}))
+    request = fingerprint({"orderid": "o1", "sku": "LAMP", "qty": 1})
+
+    first = await store.execute("allocate:k1", request, run)
+    second = await store.execute("allocate:k1", request, run)
+
+    assert first == (StoredResponse(202, {"message": "allocated"}), False)
+    assert second == (StoredResponse(202, {"message": "allocated"}), True)
+    assert len(calls) == 1
+    assert store.stats.replays == 1
+
+
+@pytest.mark.asyncio
+async def test_reusing_a_key_for_a_different_request_is_a_conflict():
+    store = IdempotencyStore()
+    run, _ = counting(StoredResponse(202, {}))
+    await store.execute("allocate:k1", fingerprint({"qty": 1}), run)
+
+    with pytest.raises(IdempotencyConflict):
+        await store.execute("allocate:k1", fingerprint({"qty": 2}), run)
+
+
+@pytest.mark.asyncio
+async def test_concurrent_duplicates_run_once():
+    store = IdempotencyStore()
+    release = asyncio.Event()
+    calls = []
+
+    async def run():
+        calls.append(1)
+        await release.wait()
+        return StoredResponse(201, {"message": "Batch added"})
+
+    request = fingerprint({"ref": "b1"})
+    duplicates = [
+        asyncio.create_task(store.execute("batches:k1", request, run))
+        for _ in range(5)
+    ]
+    await asyncio.sleep(0)
+    release.set()
+    results = await asyncio.gather(*duplicates)
+
+    assert len(calls) == 1
+    assert [replayed for _, replayed in results].count(False) == 1
+    assert store.stats.coalesced == 4
+
+
+@pytest.mark.asyncio
+async def test_server_errors_are_not_remembered():
+    store = IdempotencyStore()
+    run, calls = counting(StoredResponse(503, {"detail": "unavailable"}))
+
+    await store.execute("allocate:k1", "fp", run)
+    await store.execute("allocate:k1", "fp", run)
+
+    assert len(calls) == 2
+    assert len(store) == 0
+
+
+@pytest.mark.asyncio
+async def test_entries_are_evicted_by_size_and_expire_after_ttl(clock):
+    store = IdempotencyStore(maxsize=2, ttl=60, clock=clock)
+    run, calls = counting(StoredResponse(200, {}))
+
+    for key in ("k1", "k2", "k3"):
+        await store.execute(key, "fp", run)
+    assert len(store) == 2
+    assert store.stats.evictions == 1
+
+    clock.now += 61
+    await store.execute("k3", "fp", run)
+    assert store.stats.expirations == 1
+    assert len(calls) == 4
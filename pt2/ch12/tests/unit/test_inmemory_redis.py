@@ -0,0 +1,149 @@
+import asyncio
+import json
+
+import pytest
+
+from pt2.ch12.src.allocation.adapters import redis
+from pt2.ch12.src.allocation.adapters.inmemory import InMemoryRedis
+from pt2.ch12.src.allocation.adapters.redis import AsyncRedis
+from pt2.ch12.src.allocation.adapters.streams import PubSubConsumer
+
+
+@pytest.mark.asyncio
+async def test_hash_commands_behave_like_redis():
+    session = InMemoryRedis()
+
+    assert await session.hset("h", "a", "1") == 1
+    assert await session.hset("h", mapping={"a": "2", "b": 3}) == 1
+    assert await session.hgetall("h") == {"a": "2", "b": "3"}
+    assert await session.hget("h", "b") == "3"
+
+    assert await session.hdel("h", "a", "missing") == 1
+    assert await session.hdel("h", "b") == 1
+    assert await session.hgetall("h") == {}
+    assert await session.delete("h") == 0
+
+
+@pytest.mark.asyncio
+async def test_redis_read_model_keeps_one_hash_per_order():
+    read_model = redis.RedisReadModel(InMemoryRedis())
+
+    await read_model.add("order1", "sku1", "batch1")
+    await read_model.add("order1", "sku2", "batch2")
+    await read_model.add("order2", "sku1", "batch1")
+    await read_model.remove("order1", "sku1")
+
+    assert await read_model.allocations("order1") == [
+        {"batchref": "batch2", "sku": "sku2"},
+    ]
+    assert await read_model.allocations("order2") == [
+        {"batchref": "batch1", "sku": "sku1"},
+    ]
+    assert await read_model.allocations("unknown") == []
+
+
+@pytest.mark.asyncio
+async def test_redis_read_model_reads_many_orders_in_one_round_trip():
+    class CountingRedis(InMemoryRedis):
+        round_trips = 0
+
+        async def round_trip(self):
+            if not self._pipelined:
+                self.round_trips += 1
+
+    session = CountingRedis()
+    read_model = redis.RedisReadModel(session)
+    await read_model.add("order1", "sku1", "batch1")
+    await read_model.add("order2", "sku2", "batch2")
+    session.round_trips = 0
+
+    found = await read_model.allocations_many(["order1", "order2", "unknown"])
+
+    assert found == {
+        "order1": [{"batchref": "batch1", "sku": "sku1"}],
+        "order2": [{"batchref": "batch2", "sku": "sku2"}],
+        "unknown": [],
+    }
+    assert session.round_trips == 1
+
+
+@pytest.mark.asyncio
+async def test_memory_uri_selects_the_in_process_stand_in():
+    pool = redis.init_redis_pool(redis_uri="memory://")
+    session = await pool.__anext__()
+
+    assert isinstance(session, InMemoryRedis)
+
+
+@pytest.mark.asyncio
+async def test_memory_backend_does_not_need_a_memory_uri():
+    pool = redis.init_redis_pool(redis_uri="redis://localhost:6379/0", backend=redis.MEMORY)
+    session = await pool.__anext__()
+
+    assert isinstance(session, InMemoryRedis)
+
+
+@pytest.mark.asyncio
+async def test_publish_fans_out_to_every_subscriber():
+    session = InMemoryRedis()
+    first, second, other = session.pubsub(), session.pubsub(), session.pubsub()
+    await first.subscribe("line_allocated")
+    await second.subscribe("line_allocated")
+    await other.subscribe("out_of_stock")
+
+    assert await session.publish("line_allocated", b"payload") == 2
+
+    for pubsub in (first, second):
+        message = await pubsub.get_message(ignore_subscribe_messages=True)
+        assert message["channel"] == "line_allocated"
+        assert message["data"] == "payload"
+    assert await other.get_message(ignore_subscribe_messages=True) is None
+
+    await first.unsubscribe()
+    assert await session.publish("line_allocated", "again") == 1
+
+
+@pytest.mark.asyncio
+async def test_slow_subscriber_loses_the_oldest_messages():
+    session = InMemoryRedis(pubsub_buffer=2)
+    pubsub = session.pubsub()
+    await pubsub.subscribe("line_allocated")
+    for i in range(4):
+        await session.publish("line_allocated", str(i))
+
+    received = [
+        (await pubsub.get_message(ignore_subscribe_messages=True))["data"]
+        for _ in range(2)
+    ]
+
+    assert received == ["2", "3"]
+    assert pubsub.dropped == session.dropped == 3
+
+
+@pytest.mark.asyncio
+async def test_get_message_waits_for_a_publish():
+    session = InMemoryRedis()
+    pubsub = session.pubsub()
+    await pubsub.subscribe("line_allocated")
+    await pubsub.get_message()
+
+    waiting = asyncio.create_task(pubsub.get_message(timeout=1))
+    await asyncio.sleep(0)
+    await session.publish("line_allocated", "late")
+
+    assert (await asyncio.wait_for(waiting, timeout=1))["data"] == "late"
+    assert await pubsub.get_message(timeout=0.01) is None
+
+
+@pytest.mark.asyncio
+async def test_pubsub_consumer_reads_from_the_in_process_broker():
+    session = InMemoryRedis()
+    consumer = PubSubConsumer(session, channels=["change_batch_quantity"], consumer="c1", block_ms=10)
+    await consumer.start()
+
+    await AsyncRedis(session).publish_raw("change_batch_quantity", b'{"batchref": "b1", "qty": 1}')
+    [message] = await consumer.read()
+    await consumer.close()
+
+    assert message.stream == "change_batch_quantity"
+    assert json.loads(message.fields[redis.STREAM_FIELD]) == {"batchref": "b1", "qty": 1}
@@ -0,0 +1,87 @@
+import asyncio
+
+import pytest
+
+from pt2.ch12.src.allocation.adapters.notifications import OutOfStockNotifier
+from pt2.ch12.src.allocation.domain import commands
+from pt2.ch12.src.allocation.service_layer import messagebus
+from pt2.ch12.tests.unit.test_handlers import FakeUnitOfWork
+
+
+class FakeMailer:
+    def __init__(self, delay: float = 0.0, fail: bool = False):
+        self.sent = []
+        self.delay = delay
+        self.fail = fail
+
+    async def send(self, to, subject, body):
+        await asyncio.sleep(self.delay)
+        if self.fail:
+            raise ConnectionRefusedError("smtp is down")
+        self.sent.append((to, subject, body))
+
+
+@pytest.mark.asyncio
+async def test_the_same_sku_is_notified_once_per_window(clock):
+    notifier = OutOfStockNotifier(FakeMailer(), "admin@made.com", dedup_window=60, clock=clock)
+
+    assert notifier.notify("LAMP")
+    assert not notifier.notify("LAMP")
+    assert notifier.notify("TABLE")
+    clock.now = 61
+    assert notifier.notify("LAMP")
+
+    assert notifier.stats.suppressed == 1
+    assert len(notifier) == 2
+
+
+@pytest.mark.asyncio
+async def test_pending_skus_are_sent_as_one_digest():
+    mailer = FakeMailer()
+    notifier = OutOfStockNotifier(mailer, "admin@made.com", digest_interval=0.01)
+    await notifier.start()
+    for sku in ("LAMP", "TABLE", "LAMP"):
+        notifier.notify(sku)
+
+    await asyncio.sleep(0.05)
+    await notifier.close()
+
+    [(to, subject, body)] = mailer.sent
+    assert to == "admin@made.com"
+    assert subject == "out of stock for 2 skus"
+    assert body.splitlines()[1:] == ["LAMP", "TABLE"]
+
+
+@pytest.mark.asyncio
+async def test_digests_are_dropped_when_the_send_queue_is_full():
+    notifier = OutOfStockNotifier(FakeMailer(), "admin@made.com", max_queue=1)
+    notifier.notify("LAMP")
+    assert notifier.flush() == ["LAMP"]
+    notifier.notify("TABLE")
+
+    assert notifier.flush() is None
+    assert notifier.stats.dropped == 1
+
+
+@pytest.mark.asyncio
+async def test_a_slow_or_failing_mail_server_does_not_block_the_message_bus():
+    uow = FakeUnitOfWork()
+    mailer = FakeMailer(delay=10, fail=True)
+    notifier = OutOfStockNotifier(mailer, "admin@made.com", drain_timeout=0.01)
+    await notifier.start()
+    await messagebus.handle(commands.CreateBatch("b1", "LAMP", 1, None), uow)
+    await messagebus.handle(commands.Allocate("o1", "LAMP", 1), uow, notifier=notifier)
+
+    await asyncio.wait_for(
+        messagebus.handle(commands.Allocate("o2", "LAMP", 1), uow, notifier=notifier),
+        timeout=1,
+    )
+    await asyncio.wait_for(
+        messagebus.handle(commands.Allocate("o3", "LAMP", 1), uow, notifier=notifier),
+        timeout=1,
+    )
+    await notifier.close()
+
+    assert notifier.stats.received == 2
+    assert notifier.stats.suppressed == 1
+    assert mailer.sent == []
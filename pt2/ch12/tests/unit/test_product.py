@@ -34,3 +34,17 @@ def test_product_allocate_should_emit_an_event():
 
     assert product.messages[-1] == expected_event
     assert allocation is "batch1"
+
+
+def test_every_change_to_the_batches_bumps_the_version():
+    product = Product(sku='SMALL-FORK', batches=[Batch('batch1', 'SMALL-FORK', 10, eta=today)])
+    line = OrderLine('order1', 'SMALL-FORK', 4)
+
+    product.allocate(line)
+    product.deallocate(line)
+    product.deallocate(line)
+    product.add_batch(Batch('batch2', 'SMALL-FORK', 20, eta=tomorrow))
+    product.change_batch_quantity('batch2', 15)
+
+    assert product.version_number == 4
+    assert product.max_available_quantity == 15
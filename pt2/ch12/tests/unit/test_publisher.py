@@ -0,0 +1,127 @@
+import json
+
+import pytest
+
+from pt2.ch12.src.allocation.adapters import redis
+from pt2.ch12.src.allocation.adapters.inmemory import InMemoryRedis
+from pt2.ch12.src.allocation.adapters.publisher import BatchingPublisher
+from pt2.ch12.src.allocation.domain import events
+
+
+class RecordingRedis(InMemoryRedis):
+    def __init__(self):
+        super().__init__()
+        self.published = []
+        self.round_trips = 0
+        self.fail = False
+
+    async def round_trip(self):
+        if self._pipelined:
+            return
+        self.round_trips += 1
+        if self.fail:
+            raise ConnectionError("redis is down")
+
+    async def publish(self, channel: str, message: str) -> int:
+        await self.round_trip()
+        self.published.append((channel, json.loads(message)["data"]["orderid"]))
+        return 0
+
+
+def allocated(orderid: str) -> events.Allocated:
+    return events.Allocated(orderid=orderid, sku="LAMP", qty=1, batchref="b1")
+
+
+def make_publisher(**kwargs):
+    session = RecordingRedis()
+    return session, BatchingPublisher(redis.AsyncRedis(session), **kwargs)
+
+
+@pytest.mark.asyncio
+async def test_publish_many_uses_a_single_round_trip():
+    session = RecordingRedis()
+
+    await redis.AsyncRedis(session).publish_many(
+        [("line_allocated", allocated(f"o{i}")) for i in range(10)]
+    )
+
+    assert session.round_trips == 1
+    assert [orderid for _, orderid in session.published] == [f"o{i}" for i in range(10)]
+
+
+@pytest.mark.asyncio
+async def test_cascade_mode_sends_everything_when_handle_finishes():
+    session, publisher = make_publisher(max_batch=100)
+
+    for i in range(5):
+        await publisher.publish("line_allocated", allocated(f"o{i}"))
+    assert session.published == []
+
+    await publisher.after_handle()
+
+    assert len(session.published) == 5
+    assert session.round_trips == 1
+    assert publisher.stats.flushes == 1
+
+
+@pytest.mark.asyncio
+async def test_flushes_in_chunks_of_max_batch():
+    session, publisher = make_publisher(max_batch=2)
+
+    for i in range(5):
+        await publisher.publish("line_allocated", allocated(f"o{i}"))
+    await publisher.close()
+
+    assert [orderid for _, orderid in session.published] == [f"o{i}" for i in range(5)]
+    assert publisher.stats.max_flush_size == 2
+    assert len(publisher) == 0
+
+
+@pytest.mark.asyncio
+async def test_failed_flush_keeps_events_and_does_not_fail_the_command():
+    session, publisher = make_publisher(max_batch=100)
+    session.fail = True
+
+    await publisher.publish("line_allocated", allocated("o1"))
+    await publisher.after_handle()
+
+    assert len(publisher) == 1
+    assert publisher.stats.failures == 1
+
+    session.fail = False
+    await publisher.publish("line_allocated", allocated("o2"))
+    await publisher.after_handle()
+
+    assert [orderid for _, orderid in session.published] == ["o1", "o2"]
+
+
+@pytest.mark.asyncio
+async def test_buffer_is_bounded_while_redis_is_down():
+    session, publisher = make_publisher(max_batch=2, max_buffer=4)
+    session.fail = True
+
+    for i in range(10):
+        try:
+            await publisher.publish("line_allocated", allocated(f"o{i}"))
+        except ConnectionError:
+            pass
+
+    assert len(publisher) <= 4
+    assert publisher.stats.dropped > 0
+
+    session.fail = False
+    await publisher.close()
+    assert session.published[-1] == ("line_allocated", "o9")
+
+
+@pytest.mark.asyncio
+async def test_window_mode_flushes_in_the_background():
+    session, publisher = make_publisher(mode="window", max_delay=0.001)
+    await publisher.start()
+
+    await publisher.publish("line_allocated", allocated("o1"))
+    await publisher.after_handle()
+    assert session.published == []
+
+    await publisher.close()
+    assert session.published == [("line_allocated", "o1")]
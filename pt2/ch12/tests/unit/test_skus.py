@@ -0,0 +1,20 @@
+from pt2.ch12.src.allocation.adapters.skus import BloomFilter
+
+
+def test_bloom_filter_has_no_false_negatives():
+    bloom = BloomFilter(1_000, error_rate=0.01)
+    for i in range(1_000):
+        bloom.add(f"sku-{i}")
+
+    assert all(f"sku-{i}" in bloom for i in range(1_000))
+    assert len(bloom) == 1_000
+
+
+def test_bloom_filter_false_positive_rate_stays_near_the_target():
+    bloom = BloomFilter(1_000, error_rate=0.01)
+    for i in range(1_000):
+        bloom.add(f"sku-{i}")
+
+    false_positives = sum(f"unknown-{i}" in bloom for i in range(10_000))
+
+    assert false_positives < 10_000 * 0.02
@@ -0,0 +1,196 @@
+import asyncio
+import json
+import time
+
+import pytest
+
+from pt2.ch12.src.allocation.adapters import redis
+from pt2.ch12.src.allocation.adapters.breaker import CLOSED, HALF_OPEN, OPEN, CircuitBreaker
+from pt2.ch12.src.allocation.adapters.inmemory import InMemoryRedis
+from pt2.ch12.src.allocation.adapters.spool import Spool, SpoolingPublisher
+from pt2.ch12.src.allocation.domain import events
+
+
+class FaultyRedis(InMemoryRedis):
+    """ 끊기거나 멈추는 레디스 흉내. """
+
+    def __init__(self):
+        super().__init__()
+        self.down = False
+        self.hang = False
+
+    async def round_trip(self):
+        if not self._pipelined:
+            if self.hang:
+                await asyncio.sleep(3600)
+            if self.down:
+                raise ConnectionError("redis is down")
+        await super().round_trip()
+
+
+def allocated(orderid: str) -> events.Allocated:
+    return events.Allocated(orderid=orderid, sku="LAMP", qty=1, batchref="b1")
+
+
+def make_publisher(tmp_path, session, clock, **kwargs) -> SpoolingPublisher:
+    return SpoolingPublisher(
+        redis.AsyncRedis(session, transport=redis.STREAMS),
+        Spool(str(tmp_path / "publish.spool")),
+        breaker=CircuitBreaker(failure_threshold=2, reset_timeout=5.0, clock=clock),
+        timeout=0.01,
+        **kwargs,
+    )
+
+
+async def delivered(session: InMemoryRedis) -> list:
+    stream = session._streams.get("line_allocated")
+    if stream is None:
+        return []
+    return [
+        json.loads(fields[redis.STREAM_FIELD])["data"]["orderid"]
+        for fields in stream.entries.values()
+    ]
+
+
+def test_breaker_opens_after_consecutive_failures_and_retries_after_timeout(clock):
+    breaker = CircuitBreaker(failure_threshold=2, slow_call=0.1, reset_timeout=5.0, clock=clock)
+
+    breaker.record_failure()
+    breaker.record(0.5)
+    assert breaker.state == OPEN
+    assert not breaker.allow()
+
+    clock.now += 5
+    assert breaker.state == HALF_OPEN
+    assert breaker.allow()
+    # 시험 호출은 하나만
+    assert not breaker.allow()
+
+    breaker.record(0.01)
+    assert breaker.state == CLOSED
+
+
+@pytest.mark.asyncio
+async def test_latency_stays_flat_while_redis_hangs(tmp_path, clock):
+    session = FaultyRedis()
+    session.hang = True
+    publisher = make_publisher(tmp_path, session, clock)
+
+    started = time.monotonic()
+    for i in range(50):
+        await publisher.publish("line_allocated", allocated(f"o{i}"))
+    elapsed = time.monotonic() - started
+
+    # 첫 호출만 타임아웃을 기다리고, 나머지는 스풀 뒤에 바로 붙는다
+    assert elapsed < 0.5
+    assert len(publisher) == 50
+    assert publisher.stats.spooled == 50
+
+    # 재전송도 실패하면 브레이커가 열리고, 그 뒤로는 레디스를 건드리지 않는다
+    assert await publisher.replay() == 0
+    assert publisher.breaker.state == OPEN
+    started = time.monotonic()
+    assert await publisher.replay() == 0
+    assert time.monotonic() - started < 0.01
+
+
+@pytest.mark.asyncio
+async def test_spooled_events_are_replayed_in_order_once_redis_recovers(tmp_path, clock):
+    session = FaultyRedis()
+    publisher = make_publisher(tmp_path, session, clock=clock, replay_batch=3)
+
+    await publisher.publish("line_allocated", allocated("o0"))
+    session.down = True
+    for i in range(1, 6):
+        await publisher.publish("line_allocated", allocated(f"o{i}"))
+    assert await publisher.replay() == 0
+    assert publisher.breaker.state == OPEN
+
+    session.down = False
+    # 스풀이 비기 전에는 새 이벤트도 뒤에 줄을 선다
+    await publisher.publish("line_allocated", allocated("o6"))
+    assert await delivered(session) == ["o0"]
+    assert await publisher.replay() == 0
+
+    clock.now += 5
+    assert await publisher.replay() == 6
+
+    assert await delivered(session) == [f"o{i}" for i in range(7)]
+    assert len(publisher) == 0
+    assert publisher.breaker.state == CLOSED
+
+
+@pytest.mark.asyncio
+async def test_spool_survives_a_restart(tmp_path):
+    path = str(tmp_path / "publish.spool")
+    spool = Spool(path)
+    spool.append([("a", b"1"), ("b", b"22"), ("c", b"333")])
+    records, offset = spool.read(1)
+    spool.commit(offset, len(records))
+    spool.close()
+
+    reopened = Spool(path)
+
+    assert len(reopened) == 2
+    assert reopened.read(10)[0] == [("b", b"22"), ("c", b"333")]
+
+
+class Crash(Exception):
+    pass
+
+
+@pytest.mark.asyncio
+async def test_crash_while_emptying_the_spool_replays_instead_of_skipping(tmp_path, monkeypatch):
+    path = str(tmp_path / "publish.spool")
+    spool = Spool(path, fsync=True)
+    spool.append([("a", b"1"), ("b", b"22")])
+    records, offset = spool.read(10)
+
+    def crash():
+        raise Crash()
+
+    # 오프셋은 0 으로 적었지만 파일을 비우기 전에 죽는다
+    monkeypatch.setattr(spool, "_truncate", crash)
+    with pytest.raises(Crash):
+        spool.commit(offset, len(records))
+    spool.close()
+
+    reopened = Spool(path)
+    reopened.append([("c", b"333")])
+
+    # 이미 보낸 레코드는 한 번 더 나가지만(받는 쪽이 봉투 ID로 거른다) 새 레코드를 잃지 않는다
+    assert reopened.read(10)[0] == [("a", b"1"), ("b", b"22"), ("c", b"333")]
+
+
+@pytest.mark.asyncio
+async def test_offset_past_the_end_of_the_spool_is_reset(tmp_path):
+    path = str(tmp_path / "publish.spool")
+    spool = Spool(path)
+    spool.append([("a", b"1"), ("b", b"22")])
+    records, offset = spool.read(10)
+    spool.close()
+    # 예전 순서(비우고 나서 오프셋을 적기)로 가다 죽은 상태
+    open(path, "wb").close()
+    with open(f"{path}.offset", "w") as f:
+        f.write(str(offset))
+
+    reopened = Spool(path)
+    reopened.append([("c", b"333")])
+
+    assert len(reopened) == 1
+    assert reopened.read(10)[0] == [("c", b"333")]
+
+
+@pytest.mark.asyncio
+async def test_partial_record_at_the_tail_is_dropped(tmp_path):
+    path = str(tmp_path / "publish.spool")
+    spool = Spool(path)
+    spool.append([("a", b"1")])
+    spool.close()
+    with open(path, "ab") as f:
+        f.write(Spool.HEADER.pack(1, 10) + b"bxx")
+
+    reopened = Spool(path)
+    reopened.append([("c", b"3")])
+
+    assert reopened.read(10)[0] == [("a", b"1"), ("c", b"3")]
@@ -0,0 +1,164 @@
+import asyncio
+import json
+
+import pytest
+
+from pt2.ch12.src.allocation.adapters import redis
+from pt2.ch12.src.allocation.adapters.inmemory import InMemoryRedis
+from pt2.ch12.src.allocation.adapters.streams import StreamConsumer
+from pt2.ch12.src.allocation.domain import commands, events
+from pt2.ch12.src.allocation.entrypoints import redis_eventconsumer
+
+
+def make_consumer(session, name, clock, **kwargs) -> StreamConsumer:
+    return StreamConsumer(
+        session,
+        streams=["line_allocated"],
+        group="allocation",
+        consumer=name,
+        block_ms=10,
+        clock=clock,
+        **kwargs,
+    )
+
+
+def allocated(orderid: str) -> events.Allocated:
+    return events.Allocated(orderid=orderid, sku="LAMP", qty=1, batchref="b1")
+
+
+@pytest.mark.asyncio
+async def test_streams_transport_appends_and_trims_with_maxlen():
+    session = InMemoryRedis()
+    channel = redis.AsyncRedis(session, transport=redis.STREAMS, stream_maxlen=3)
+
+    await channel.publish("line_allocated", allocated("o1"))
+    await channel.publish_many(
+        [("line_allocated", allocated(f"o{i}")) for i in range(2, 6)]
+    )
+
+    assert await session.xlen("line_allocated") == 3
+
+
+@pytest.mark.asyncio
+async def test_xreadgroup_resumes_after_the_last_delivered_entry_across_trims():
+    session = InMemoryRedis()
+    await session.xgroup_create("s", "g", id="0", mkstream=True)
+    for i in range(10):
+        await session.xadd("s", {"n": i}, maxlen=6)
+
+    [(_, first)] = await session.xreadgroup("g", "c1", {"s": ">"}, count=4)
+    for i in range(10, 20):
+        await session.xadd("s", {"n": i}, maxlen=6)
+    [(_, second)] = await session.xreadgroup("g", "c1", {"s": ">"}, count=4)
+
+    assert [fields["n"] for _, fields in first] == ["4", "5", "6", "7"]
+    # 읽지 않은 사이에 잘려나간 항목은 건너뛴다
+    assert [fields["n"] for _, fields in second] == ["14", "15", "16", "17"]
+    [(_, rest)] = await session.xreadgroup("g", "c1", {"s": ">"}, count=10)
+    assert [fields["n"] for _, fields in rest] == ["18", "19"]
+
+
+@pytest.mark.asyncio
+async def test_xreadgroup_with_block_zero_waits_for_a_new_entry():
+    session = InMemoryRedis()
+    await session.xgroup_create("s", "g", id="$", mkstream=True)
+
+    assert await session.xreadgroup("g", "c1", {"s": ">"}) == []
+    reading = asyncio.create_task(session.xreadgroup("g", "c1", {"s": ">"}, block=0))
+    await asyncio.sleep(0.05)
+    assert not reading.done()
+
+    entry_id = await session.xadd("s", {"n": 1})
+    assert await asyncio.wait_for(reading, timeout=1) == [("s", [(entry_id, {"n": "1"})])]
+
+
+@pytest.mark.asyncio
+async def test_consumers_in_a_group_share_the_stream(clock):
+    session = InMemoryRedis()
+    channel = redis.AsyncRedis(session, transport=redis.STREAMS)
+    first = make_consumer(session, "c1", clock, batch_size=2)
+    second = make_consumer(session, "c2", clock, batch_size=2)
+    await first.ensure_groups()
+    await second.ensure_groups()
+
+    for i in range(4):
+        await channel.publish("line_allocated", allocated(f"o{i}"))
+
+    got_first = await first.read()
+    got_second = await second.read()
+
+    orderids = [
+        json.loads(message.fields[redis.STREAM_FIELD])["data"]["orderid"]
+        for message in got_first + got_second
+    ]
+    assert orderids == ["o0", "o1", "o2", "o3"]
+    assert await first.read() == []
+
+
+@pytest.mark.asyncio
+async def test_unacked_messages_are_reclaimed_by_another_consumer(clock):
+    session = InMemoryRedis(clock=clock)
+    channel = redis.AsyncRedis(session, transport=redis.STREAMS)
+    dead = make_consumer(session, "dead", clock=clock, claim_idle_ms=1000)
+    alive = make_consumer(session, "alive", clock=clock, claim_idle_ms=1000)
+    await dead.ensure_groups()
+
+    await channel.publish("line_allocated", allocated("o1"))
+    await channel.publish("line_allocated", allocated("o2"))
+    delivered = await dead.read()
+    await dead.ack(delivered[:1])
+
+    assert await alive.read() == []
+
+    clock.now += 10
+    reclaimed = await alive.read()
+    assert [message.id for message in reclaimed] == [delivered[1].id]
+
+    await alive.ack(reclaimed)
+    clock.now += 10
+    assert await alive.read() == []
+
+
+@pytest.mark.asyncio
+async def test_consume_turns_messages_into_commands_and_acks(monkeypatch):
+    session = InMemoryRedis()
+    stop = asyncio.Event()
+    handled = []
+
+    async def fake_handle(message, uow, **dependencies):
+        handled.append(message)
+        if message.ref == "fails":
+            raise RuntimeError("boom")
+        if len(handled) == 3:
+            stop.set()
+
+    monkeypatch.setattr(redis_eventconsumer.messagebus, "handle", fake_handle)
+    consumer = StreamConsumer(
+        session,
+        streams=["change_batch_quantity"],
+        group="allocation",
+        consumer="c1",
+        block_ms=10,
+    )
+    for payload in [
+        {"batchref": "b1", "qty": 5},
+        "not json {",
+        {"batchref": "fails", "qty": 1},
+        {"batchref": "b2", "qty": 7},
+    ]:
+        data = payload if isinstance(payload, str) else json.dumps(payload)
+        await session.xadd("change_batch_quantity", {redis.STREAM_FIELD: data})
+
+    await asyncio.wait_for(
+        redis_eventconsumer.consume(consumer, lambda: None, stop),
+        timeout=1,
+    )
+
+    assert handled == [
+        commands.ChangeBatchQuantity(ref="b1", qty=5),
+        commands.ChangeBatchQuantity(ref="fails", qty=1),
+        commands.ChangeBatchQuantity(ref="b2", qty=7),
+    ]
+    # 실패한 메시지만 ACK 되지 않고 남는다
+    pending = session._streams["change_batch_quantity"].groups["allocation"].pending
+    assert len(pending) == 1